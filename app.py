@@ -1,30 +1,63 @@
+import time
+# 页面脚本开始执行的时间，用于统计启动和重跑耗时
+script_started_at = time.perf_counter()
 import streamlit as st
 import pandas as pd
-import requests
-import re
-import io
+import importlib.metadata
+import importlib.util
 import json
 import sys
 import traceback
+from collections import deque
 from database import init_db, verify_password  # 导入数据库初始化和验证函数
+from database import init_jobs_db, get_job, get_job_tasks, list_resumable_jobs, get_resumable_tasks
+from capi import extract_cookie, extract_csrfcode
+from executor import DEFAULT_MAX_WORKERS, MAX_WORKERS_LIMIT
+from operations import split_by_region, run_sharded, count_resources, RETRYABLE_PREFIXES, AMBIGUOUS_PREFIXES, CBS_REGION_IDS, DEFAULT_CBS_REGION_ID
+from background import submit_job, cancel_job, list_jobs
+from preflight import plan_operation, reconcile_unconfirmed
+from database import init_inventory_db, query_inventory
+from inventory import sync_inventory, refresh_resources, image_rows_from_inventory, INVENTORY_TYPES, INVENTORY_TYPE_LABELS
+from sweep import sync_sweep_inventory, find_orphans, orphan_shards, bound_snapshot_ids, drop_bound_snapshots, SWEEP_ACTIONS, SWEEP_FIELDS, DEFAULT_MIN_AGE_DAYS
+from pipeline import run_pipeline, check_pipeline_regions, count_pipeline_steps, STEP_SPECS, DEFAULT_STEPS, DEFAULT_REGION_LIMIT, DEFAULT_INSTANCE_LIMIT, STEP_DONE, STEP_FAILED, STEP_SKIPPED
+from tracker import track_completion, is_success_state, TRACKED_OPERATIONS, GIVE_UP_STATES
+from metrics import phase_timer, observe_phase, timed_iter, get_snapshot, render_prometheus, reset_metrics
+from ingest import read_upload, content_hash
+from report import build_report
+from result_store import ResultStore, RESULT_FIELDS
+from planner import load_profiles, estimate_plan, estimate_pipeline, format_duration
+from scheduling import SIZED_ACTIONS, sizes_from_rows, resolve_disk_sizes, order_longest_first
+
+# 页面准备（不含批量操作本身）耗时的预算（秒）：会话首次加载、之后每次点击重跑，超出时在侧边栏提示
+STARTUP_BUDGET_SECONDS = {"session_start": 3.0, "rerun": 0.5}
+
+# 检查openpyxl是否已安装，只查找模块不导入，导出Excel时才真正导入；结果在进程内缓存
+@st.cache_resource(show_spinner=False)
+def probe_excel_support():
+    if importlib.util.find_spec("openpyxl") is None:
+        return False, None
+    try:
+        return True, importlib.metadata.version("openpyxl")
+    except importlib.metadata.PackageNotFoundError:
+        return True, "未知"
+
+# 初始化数据库，每个进程只执行一次
+@st.cache_resource(show_spinner=False)
+def initialize_databases():
+    init_db()
+    init_jobs_db()
+    init_inventory_db()
+    return True
 
 # 在应用标题之前检查openpyxl状态，确保状态信息最先显示
 st.sidebar.title("环境状态")
 
-# 检查是否有openpyxl模块
-try:
-    import openpyxl
-    from openpyxl import Workbook
-    EXCEL_EXPORT_AVAILABLE = True
-    excel_version = openpyxl.__version__
-    st.sidebar.success(f"✅ openpyxl模块已加载: 版本 {excel_version}")
-except ImportError as e:
-    EXCEL_EXPORT_AVAILABLE = False
-    st.sidebar.error(f"❌ 无法导入openpyxl模块: {str(e)}")
+EXCEL_EXPORT_AVAILABLE, excel_version = probe_excel_support()
+if EXCEL_EXPORT_AVAILABLE:
+    st.sidebar.success(f"✅ openpyxl模块可用: 版本 {excel_version}（导出Excel时加载）")
+else:
+    st.sidebar.error("❌ 未找到openpyxl模块")
     st.sidebar.info("您可以通过运行 'pip install openpyxl' 来安装此模块")
-except Exception as e:
-    EXCEL_EXPORT_AVAILABLE = False
-    st.sidebar.error(f"❌ 加载openpyxl模块时出现未知错误: {str(e)}")
     st.sidebar.info("Python路径: " + ", ".join(sys.path))
 
 # 显示Python环境信息
@@ -33,416 +66,735 @@ st.sidebar.info(f"Python版本: {sys.version}")
 st.sidebar.info(f"Pandas版本: {pd.__version__}")
 
 # 初始化数据库
-init_db()
+initialize_databases()
 
-# 读取CSV文件
-def load_instance_data(file_path):
-    df = pd.read_csv(file_path)
+# 解析上传的CSV文件，按文件内容的哈希缓存，脚本重跑时不再重复解析同一个文件
+@st.cache_data(max_entries=16, show_spinner=False)
+def parse_upload(file_hash, _content, resource_type):
+    return read_upload(_content, resource_type)
+
+# 读取上传的CSV文件：只保留需要的列，去除重复行，ID格式错误的行不参与操作
+def load_upload(uploaded_file, resource_type):
+    content = uploaded_file.getvalue()
+    try:
+        with phase_timer("csv_parse"):
+            df, invalid_rows, duplicates = parse_upload(content_hash(content), content, resource_type)
+    except ValueError as e:
+        st.error(f"{uploaded_file.name}: {e}")
+        return None
+    if duplicates:
+        st.info(f"{uploaded_file.name}: 已去除 {duplicates} 行重复数据")
+    if len(invalid_rows):
+        st.warning(f"{uploaded_file.name}: {len(invalid_rows)} 行ID格式错误或所属实例有格式错误的行，将被跳过")
+        with st.expander(f"查看 {uploaded_file.name} 中格式错误的行"):
+            st.dataframe(invalid_rows)
     return df
 
-# 从请求中提取cookie
-def extract_cookie(request_text):
-    # 尝试从 -H 'cookie: ...' 格式提取
-    match = re.search(r"-H 'cookie: ([^']*)'", request_text)
-    if match:
-        return match.group(1)
-    
-    # 尝试从 -b '...' 格式提取
-    match = re.search(r"-b '([^']*)'", request_text)
-    if match:
-        return match.group(1)
-    
-    return ''
-
-# 从请求中提取x-csrfcode
-def extract_csrfcode(request_text):
-    match = re.search(r"-H 'x-csrfcode: ([^']*)'", request_text)
-    return match.group(1) if match else ''
-
-# 构建请求头
-def build_headers(cookie, csrfcode):
-    return {
-        'accept': 'application/json, text/javascript, */*; q=0.01',
-        'accept-language': 'zh-CN,zh;q=0.9,en;q=0.8',
-        'cache-control': 'no-cache',
-        'content-type': 'application/json; charset=UTF-8',
-        'cookie': cookie,
-        'origin': 'https://console.cloud.tencent.com',
-        'pragma': 'no-cache',
-        'priority': 'u=1, i',
-        'referer': 'https://console.cloud.tencent.com/cvm/instance/index',
-        'sec-ch-ua': '"Google Chrome";v="131", "Chromium";v="131", "Not_A Brand";v="24"',
-        'sec-ch-ua-mobile': '?0',
-        'sec-ch-ua-platform': '"macOS"',
-        'sec-fetch-dest': 'empty',
-        'sec-fetch-mode': 'cors',
-        'sec-fetch-site': 'same-site',
-        'user-agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36',
-        'x-csrfcode': csrfcode,
-    }
+# 精简显示的结果表格列
+LIVE_VIEW_COLUMNS = ["地域", "资源ID", "状态", "错误信息", "请求ID", "结果ID", "时间"]
 
-# 通用请求函数
-def send_request(action, data, cookie, csrfcode, uin, region=None):
-    if region:
-        url = f'https://workbench.cloud.tencent.com/cgi/capi?i=cvm/{action}&uin={uin}&region={region}'
-    else:
-        url = f'https://capi.cloud.tencent.com/cgi/capi?i=cbs/{action}&uin={uin}'
-    headers = build_headers(cookie, csrfcode)
-    response = requests.post(url, headers=headers, json=data)
-    return response.json()
+# 实时表格只显示最近的行数，完整结果在“结果报告”中分页查看
+LIVE_TAIL_ROWS = 200
 
-# 发送关机请求的函数
-def stop_instances(instance_ids, cookie, csrfcode, region, uin):
-    results = []  # 存储所有实例的关机结果
-    success_count = 0
-    fail_count = 0
-    
-    for instance_id in instance_ids:
-        data = {
-            "serviceType": "cvm",
-            "action": "StopInstances",
-            "data": {
-                "Version": "2017-03-12",
-                "InstanceIds": [instance_id],
-                "StopType": "SOFT_FIRST",
-                "StoppedMode": "KEEP_CHARGING"
-            },
-            "region": region
-        }
-        response_json = send_request("StopInstances", data, cookie, csrfcode, uin, region)
-        
-        # 解析响应结果
-        status = "成功"
-        error_msg = ""
-        request_id = ""
-        full_response = json.dumps(response_json, ensure_ascii=False, indent=2)
-        
-        if 'data' in response_json and 'Response' in response_json['data']:
-            request_id = response_json['data']['Response'].get('RequestId', '')
-            if 'Error' in response_json['data']['Response']:
-                status = "失败"
-                error_msg = response_json['data']['Response']['Error'].get('Message', '未知错误')
-                fail_count += 1
-            else:
-                success_count += 1
-        else:
-            status = "失败"
-            error_msg = "无效的响应格式"
-            fail_count += 1
-        
-        # 记录结果
-        results.append({
-            "实例ID": instance_id,
-            "状态": status,
-            "错误信息": error_msg,
-            "请求ID": request_id,
-            "时间": pd.Timestamp.now().strftime("%Y-%m-%d %H:%M:%S")
+# 只保留最近若干行的实时表格：每次刷新在同一占位组件中重绘，界面开销不随资源数量增长
+class TailTable:
+    def __init__(self, columns, limit=LIVE_TAIL_ROWS):
+        self.columns = columns
+        self.rows = deque(maxlen=limit)
+        self.total = 0
+        self.caption = st.empty()
+        self.placeholder = st.empty()
+
+    def extend(self, rows):
+        self.rows.extend(rows)
+        self.total += len(rows)
+
+    def render(self):
+        if self.total > self.rows.maxlen:
+            self.caption.caption(f"显示最近 {self.rows.maxlen} 条（共 {self.total} 条）")
+        self.placeholder.dataframe(pd.DataFrame(list(self.rows), columns=self.columns))
+
+# 精简显示：只有一个进度条、吞吐量/剩余时间统计和一个只显示最近结果的表格，
+# 界面开销不随资源数量增长；完整结果和原始响应保存在结果存储中，可在“结果报告”中分页和按需查看
+class LiveResultView:
+    def __init__(self, label, total, refresh_interval=0.5):
+        self.label = label
+        self.total = total
+        self.refresh_interval = refresh_interval
+        self.done = 0
+        self.failed = 0
+        self.started_at = time.monotonic()
+        self.refreshed_at = 0.0
+        self.pending_rows = []
+        self.progress_bar = st.progress(0.0)
+        self.stats = st.empty()
+        self.table = TailTable(LIVE_VIEW_COLUMNS)
+
+    def add(self, result):
+        self.done += 1
+        if result['status'] != "成功":
+            self.failed += 1
+        self.pending_rows.append({
+            "地域": result['region'],
+            "资源ID": result['resource_id'],
+            "状态": result['status'],
+            "错误信息": result['error_message'],
+            "请求ID": result['request_id'],
+            "结果ID": result['result_id'],
+            "时间": result['time']
         })
-        
-        # 在界面显示详细信息
-        st.subheader(f"实例 {instance_id} 关机请求结果")
-        st.write(f"状态: {status}")
-        st.write(f"请求ID: {request_id}")
-        if error_msg:
-            st.error(f"错误信息: {error_msg}")
-        st.json(full_response)
-    
-    # 创建结果DataFrame
-    results_df = pd.DataFrame(results)
-    
-    # 在界面上显示结果统计
-    st.subheader("关机操作结果统计")
-    st.write(f"总计: {len(instance_ids)} 台实例")
-    st.write(f"成功: {success_count} 台")
-    st.write(f"失败: {fail_count} 台")
-    
-    # 显示详细结果表格
-    st.subheader("详细结果")
-    st.dataframe(results_df)
-    
-    # 提供CSV下载
-    csv = results_df.to_csv(index=False)
-    st.download_button(
-        label="下载关机结果报告(CSV)",
-        data=csv,
-        file_name=f"关机结果_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}.csv",
-        mime="text/csv"
-    )
-    
-    # 提供Excel下载，如果支持的话
-    if EXCEL_EXPORT_AVAILABLE:
-        try:
-            excel_buffer = io.BytesIO()
-            results_df.to_excel(excel_buffer, engine='openpyxl', index=False, sheet_name="关机结果")
-            excel_data = excel_buffer.getvalue()
-            
-            st.download_button(
-                label="下载关机结果报告(Excel)",
-                data=excel_data,
-                file_name=f"关机结果_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            )
-        except Exception as e:
-            st.error(f"Excel导出错误: {str(e)}")
-            st.info("错误类型: " + str(type(e).__name__))
-            st.code(traceback.format_exc())
-            st.warning("请使用CSV格式导出，或者检查openpyxl安装。")
-    else:
-        st.info("Excel导出功能不可用。请确保openpyxl库已正确安装且可被当前Python环境访问。")
-    
-    return results_df
+        if time.monotonic() - self.refreshed_at >= self.refresh_interval:
+            self.refresh()
 
-# 发送开机请求的函数
-def start_instances(instance_ids, cookie, csrfcode, region, uin):
-    results = []  # 存储所有实例的开机结果
-    success_count = 0
-    fail_count = 0
-    
-    for instance_id in instance_ids:
-        data = {
-            "serviceType": "cvm",
-            "action": "StartInstances",
-            "data": {
-                "Version": "2017-03-12",
-                "InstanceIds": [instance_id]
-            },
-            "region": region
-        }
-        response_json = send_request("StartInstances", data, cookie, csrfcode, uin, region)
-        
-        # 解析响应结果
-        status = "成功"
-        error_msg = ""
-        request_id = ""
-        full_response = json.dumps(response_json, ensure_ascii=False, indent=2)
-        
-        if 'data' in response_json and 'Response' in response_json['data']:
-            request_id = response_json['data']['Response'].get('RequestId', '')
-            if 'Error' in response_json['data']['Response']:
-                status = "失败"
-                error_msg = response_json['data']['Response']['Error'].get('Message', '未知错误')
-                fail_count += 1
-            else:
-                success_count += 1
+    def refresh(self):
+        elapsed = max(time.monotonic() - self.started_at, 1e-6)
+        speed = self.done / elapsed
+        remaining = (self.total - self.done) / speed if speed > 0 else 0
+        self.progress_bar.progress(self.done / self.total if self.total else 1.0)
+        self.stats.write(
+            f"{self.label}进度: {self.done}/{self.total}，失败 {self.failed}，"
+            f"速度 {speed:.1f} 个/秒，已用时 {elapsed:.0f} 秒，预计剩余 {remaining:.0f} 秒"
+        )
+        if self.pending_rows:
+            self.table.extend(self.pending_rows)
+            self.table.render()
+            self.pending_rows = []
+        self.refreshed_at = time.monotonic()
+
+    def finish(self):
+        self.refresh()
+
+# 逐个资源显示详细信息的最大资源数，超出时自动使用精简显示
+DETAIL_RENDER_LIMIT = 200
+
+# 精简显示时创建结果视图，否则返回 None（逐个资源显示详细信息）
+def open_view(label, shards, compact):
+    total = count_resources(shards)
+    if not compact and total > DETAIL_RENDER_LIMIT:
+        st.info(f"共 {total} 个资源，超过 {DETAIL_RENDER_LIMIT} 个，使用精简显示")
+        compact = True
+    return LiveResultView(label, total) if compact else None
+
+# 结果存储中各字段的显示名称
+RESULT_COLUMN_LABELS = {
+    "region": "地域", "job_id": "任务ID", "resource_id": "资源ID", "status": "状态", "error_code": "错误码",
+    "error_message": "错误信息", "request_id": "请求ID", "result_id": "结果ID", "time": "时间"
+}
+
+# 为一次操作创建结果存储，替换同一操作上一次的结果（删除其响应文件），并登记为结果报告
+def open_result_store(label):
+    if 'result_stores' not in st.session_state:
+        st.session_state.result_stores = {}
+    previous = st.session_state.result_stores.pop(label, None)
+    if previous is not None:
+        previous.close()
+    store = ResultStore()
+    st.session_state.result_stores[label] = store
+    register_report(f"{label}结果", store, list(RESULT_FIELDS),
+                    f"{label}结果_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}", excel=True,
+                    headers=[RESULT_COLUMN_LABELS[field] for field in RESULT_FIELDS])
+    return store
+
+# 每页显示的结果行数
+RESULT_PAGE_SIZE = 500
+
+# 分页显示结果存储中的记录
+def render_result_table(store, key):
+    pages = max(1, -(-len(store) // RESULT_PAGE_SIZE))
+    page = 1
+    if pages > 1:
+        page = st.number_input(f"页码（共 {pages} 页，每页 {RESULT_PAGE_SIZE} 行）", min_value=1, max_value=pages, value=1, key=f"page_{key}")
+    rows = store.page((page - 1) * RESULT_PAGE_SIZE, RESULT_PAGE_SIZE)
+    st.dataframe(pd.DataFrame(rows, columns=list(RESULT_FIELDS)).rename(columns=RESULT_COLUMN_LABELS))
+
+# 按资源ID读取结果存储中的原始响应
+def render_response_lookup(store, key):
+    failed_ids = store.failed_ids()
+    options = failed_ids[:1000]
+    resource_id = st.text_input("资源ID", key=f"lookup_{key}")
+    if not resource_id and options:
+        resource_id = st.selectbox(f"或选择失败的资源（共 {len(failed_ids)} 个）", options, key=f"failed_{key}")
+    if resource_id:
+        response_json = store.get_response(resource_id.strip())
+        if response_json is None:
+            st.warning(f"没有资源 {resource_id} 的响应")
         else:
-            status = "失败"
-            error_msg = "无效的响应格式"
-            fail_count += 1
+            st.json(json.dumps(response_json, ensure_ascii=False, indent=2))
+
+# 开关机的公共流程：发送请求、显示每台实例的结果、汇总统计并提供报告下载
+# shards 为 {地域: 资源列表}，各地域并行执行；job_ids 为继续执行已有任务时的 {地域: 任务ID}
+def power_instances(action, label, shards, cookie, csrfcode, uin, max_workers=DEFAULT_MAX_WORKERS, batch_mode=False, job_ids=None, compact=False):
+    store = open_result_store(label)  # 存储所有实例的结果
+    view = open_view(label, shards, compact)
+    
+    for result, response_json in timed_iter(run_sharded(action, shards, cookie, csrfcode, uin, max_workers, batch_mode, job_ids), "render"):
+        instance_id = result['resource_id']
+        status = result['status']
+        error_msg = result['error_message']
+        request_id = result['request_id']
         
         # 记录结果
-        results.append({
-            "实例ID": instance_id,
-            "状态": status,
-            "错误信息": error_msg,
-            "请求ID": request_id,
-            "时间": pd.Timestamp.now().strftime("%Y-%m-%d %H:%M:%S")
-        })
+        store.add(result, response_json)
+        if view is not None:
+            view.add(result)
+            continue
         
         # 在界面显示详细信息
-        st.subheader(f"实例 {instance_id} 开机请求结果")
+        st.subheader(f"实例 {instance_id} {label}请求结果")
         st.write(f"状态: {status}")
         st.write(f"请求ID: {request_id}")
         if error_msg:
             st.error(f"错误信息: {error_msg}")
-        st.json(full_response)
-    
-    # 创建结果DataFrame
-    results_df = pd.DataFrame(results)
+        st.json(json.dumps(response_json, ensure_ascii=False, indent=2))
+    if view is not None:
+        view.finish()
     
     # 在界面上显示结果统计
-    st.subheader("开机操作结果统计")
-    st.write(f"总计: {len(instance_ids)} 台实例")
-    st.write(f"成功: {success_count} 台")
-    st.write(f"失败: {fail_count} 台")
-    
-    # 显示详细结果表格
-    st.subheader("详细结果")
-    st.dataframe(results_df)
+    st.subheader(f"{label}操作结果统计")
+    st.write(f"总计: {count_resources(shards)} 台实例（{len(shards)} 个地域）")
+    st.write(f"成功: {len(store) - store.failed} 台")
+    st.write(f"失败: {store.failed} 台")
     
-    # 提供CSV下载
-    csv = results_df.to_csv(index=False)
-    st.download_button(
-        label="下载开机结果报告(CSV)",
-        data=csv,
-        file_name=f"开机结果_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}.csv",
-        mime="text/csv"
-    )
+    # 显示详细结果表格（精简显示时进度表格中只有最近的结果），完整结果可在下方“结果报告”中分页查看和导出
+    if view is None:
+        st.subheader("详细结果")
+        st.dataframe(pd.DataFrame(store.page(0, RESULT_PAGE_SIZE), columns=list(RESULT_FIELDS)).rename(columns=RESULT_COLUMN_LABELS))
     
-    # 提供Excel下载，如果支持的话
-    if EXCEL_EXPORT_AVAILABLE:
-        try:
-            excel_buffer = io.BytesIO()
-            results_df.to_excel(excel_buffer, engine='openpyxl', index=False, sheet_name="开机结果")
-            excel_data = excel_buffer.getvalue()
-            
+    return store
+
+REPORT_FORMATS = {
+    "csv": ("CSV", "text/csv"),
+    "xlsx": ("Excel", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
+
+# 保存报告的结果行（字典列表或结果存储），报告文件在用户点击“生成”后才生成，不占用批量操作本身的时间
+def register_report(label, rows, columns, file_name, excel=False, headers=None):
+    if 'reports' not in st.session_state:
+        st.session_state.reports = {}
+    st.session_state.reports[label] = {
+        "rows": rows, "columns": columns, "headers": headers, "file_name": file_name, "excel": excel, "files": {}
+    }
+
+# 显示一个报告的生成和下载按钮，生成的文件保存在报告中，页面重跑后仍可下载
+def render_report(key, label, report):
+    formats = ["csv"] + (["xlsx"] if report['excel'] and EXCEL_EXPORT_AVAILABLE else [])
+    for file_format in formats:
+        format_name, mime = REPORT_FORMATS[file_format]
+        if file_format not in report['files'] and st.button(f"生成{label}({format_name})", key=f"build_{key}_{file_format}"):
+            try:
+                with phase_timer("export"):
+                    report['files'][file_format] = build_report(report['rows'], report['columns'], file_format, label, report.get('headers'))
+            except Exception as e:
+                st.error(f"{format_name}导出错误: {str(e)}")
+                st.code(traceback.format_exc())
+        if file_format in report['files']:
             st.download_button(
-                label="下载开机结果报告(Excel)",
-                data=excel_data,
-                file_name=f"开机结果_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                label=f"下载{label}({format_name})",
+                data=report['files'][file_format],
+                file_name=f"{report['file_name']}.{file_format}",
+                mime=mime,
+                key=f"download_{key}_{file_format}"
             )
-        except Exception as e:
-            st.error(f"Excel导出错误: {str(e)}")
-            st.info("错误类型: " + str(type(e).__name__))
-            st.code(traceback.format_exc())
-            st.warning("请使用CSV格式导出，或者检查openpyxl安装。")
-    else:
+    if report['excel'] and not EXCEL_EXPORT_AVAILABLE:
         st.info("Excel导出功能不可用。请确保openpyxl库已正确安装且可被当前Python环境访问。")
-    
-    return results_df
 
-# 发送创建镜像请求的函数
-def create_images(data, cookie, csrfcode, region, uin):
+# 显示本次会话中各操作的结果报告
+def render_reports():
+    reports = st.session_state.get('reports', {})
+    if not reports:
+        return
+    st.subheader("结果报告")
+    for index, (label, report) in enumerate(reports.items()):
+        st.write(f"{label}：{len(report['rows'])} 行")
+        if isinstance(report['rows'], ResultStore):
+            with st.expander(f"查看{label}"):
+                render_result_table(report['rows'], f"report_{index}")
+            with st.expander(f"查看{label}的原始响应"):
+                render_response_lookup(report['rows'], f"report_{index}")
+        render_report(f"report_{index}", label, report)
+
+# 发送关机请求的函数
+def stop_instances(shards, cookie, csrfcode, uin, max_workers=DEFAULT_MAX_WORKERS, batch_mode=False, job_ids=None, compact=False):
+    return power_instances("StopInstances", "关机", shards, cookie, csrfcode, uin, max_workers, batch_mode, job_ids, compact)
+
+# 发送开机请求的函数
+def start_instances(shards, cookie, csrfcode, uin, max_workers=DEFAULT_MAX_WORKERS, batch_mode=False, job_ids=None, compact=False):
+    return power_instances("StartInstances", "开机", shards, cookie, csrfcode, uin, max_workers, batch_mode, job_ids, compact)
+
+# 完成状态跟踪表格的列
+TRACKING_COLUMNS = ["资源ID", "源资源ID", "状态", "时间"]
+
+# 批量查询新创建的镜像/快照状态直到全部完成，实时显示状态变化
+def render_tracking(action, label, targets, cookie, csrfcode, region, uin, max_workers=DEFAULT_MAX_WORKERS, job_id=None):
+    if not targets:
+        return
+    st.subheader(f"等待{label}完成（{region}）")
+    total = len(targets)
+    finished = 0
+    succeeded = 0
+    gave_up = 0
+    progress_bar = st.progress(0.0)
+    stats = st.empty()
+    table = TailTable(TRACKING_COLUMNS)
+    for poll in track_completion(action, targets, cookie, csrfcode, uin, region, job_id, max_workers):
+        rows = []
+        for resource_id, source_id, state, final in poll['changes']:
+            if final:
+                finished += 1
+                succeeded += 1 if is_success_state(action, state) else 0
+                gave_up += 1 if state in GIVE_UP_STATES else 0
+            rows.append({"资源ID": resource_id, "源资源ID": source_id, "状态": state, "时间": pd.Timestamp.now().strftime("%Y-%m-%d %H:%M:%S")})
+        if rows:
+            table.extend(rows)
+            table.render()
+        progress_bar.progress(finished / total)
+        next_poll = f"，{poll['interval']:.0f} 秒后再次查询" if poll['pending'] else ""
+        stats.write(f"{label}已完成 {finished}/{total}（成功 {succeeded}），查询请求 {poll['calls']} 次{next_poll}")
+    if gave_up:
+        resume_hint = f"；可以之后用 `python cli.py track --job-id {job_id}` 继续跟踪" if job_id is not None else ""
+        st.warning(f"{gave_up} 个{label}超时（TIMEOUT）或查询连续失败（QUERY_FAILED），已停止等待{resume_hint}")
+
+# 按 (地域, 任务ID) 分组跟踪新资源，每个地域一个跟踪表格
+def render_sharded_tracking(action, label, created, cookie, csrfcode, uin, max_workers=DEFAULT_MAX_WORKERS):
+    for (region, job_id), targets in created.items():
+        render_tracking(action, label, targets, cookie, csrfcode, region, uin, max_workers, job_id)
+
+# 发送创建镜像请求的函数；track 为 True 时等待新镜像全部创建完成
+def create_images(shards, cookie, csrfcode, uin, max_workers=DEFAULT_MAX_WORKERS, job_ids=None, compact=False, track=False):
     image_ids = []  # 用于存储 ImageId 的列表
-    for instance_id, group in data.groupby('ID_cvm'):
-        image_name = group['cvm_name'].iloc[0] + '-image'
-        data_disk_ids = group['ID_dataDisk'].tolist()
-        data = {
-            "serviceType": "cvm",
-            "action": "CreateImage",
-            "region": region,
-            "data": {
-                "Version": "2017-03-12",
-                "InstanceId": instance_id,
-                "ImageName": image_name,
-                "ImageDescription": "CDC迁移",
-                "ForcePoweroff": "FALSE",
-                "Sysprep": "FALSE",
-                "DataDiskIds": data_disk_ids
-            }
-        }
-        response_json = send_request("CreateImage", data, cookie, csrfcode, uin, region)
+    created = {}  # {(地域, 任务ID): {ImageId: InstanceId}}
+    store = open_result_store("创建镜像")
+    view = open_view("创建镜像", shards, compact)
+    for result, response_json in timed_iter(run_sharded("CreateImage", shards, cookie, csrfcode, uin, max_workers, job_ids=job_ids), "render"):
+        instance_id = result['resource_id']
+        if result['result_id']:
+            image_ids.append({'region': result['region'], 'InstanceId': instance_id, 'ImageId': result['result_id']})
+            created.setdefault((result['region'], result['job_id']), {})[result['result_id']] = instance_id
+        store.add(result, response_json)
+        if view is not None:
+            view.add(result)
+            continue
         
         # 显示详细信息
         st.subheader(f"为实例 {instance_id} 创建镜像结果")
         st.json(json.dumps(response_json, ensure_ascii=False, indent=2))
         
-        # 提取 ImageId 并添加到列表
-        if 'data' in response_json and 'Response' in response_json['data']:
-            image_id = response_json['data']['Response'].get('ImageId')
-            if image_id:
-                image_ids.append({'InstanceId': instance_id, 'ImageId': image_id})
-                st.success(f"成功创建镜像，ImageId: {image_id}")
-            else:
-                st.error("未获取到 ImageId")
+        if result['result_id']:
+            st.success(f"成功创建镜像，ImageId: {result['result_id']}")
         else:
-            st.error("响应格式无效")
+            st.error(result['error_message'])
+    if view is not None:
+        view.finish()
 
-    # 将 ImageId 列表转换为 DataFrame
+    # ImageId 列表在下方“结果报告”中按需生成
     if image_ids:
-        df_image_ids = pd.DataFrame(image_ids)
-        # 将 DataFrame 转换为 CSV
-        csv = df_image_ids.to_csv(index=False)
-        # 使用 Streamlit 提供下载链接
-        st.download_button(
-            label="下载 ImageId CSV",
-            data=csv,
-            file_name='image_ids.csv',
-            mime='text/csv'
-        )
+        register_report("ImageId 列表", image_ids, ["region", "InstanceId", "ImageId"], "image_ids")
+    if track:
+        render_sharded_tracking("CreateImage", "镜像创建", created, cookie, csrfcode, uin, max_workers)
 
 # 发送删除镜像请求的函数
-def delete_images(image_ids, cookie, csrfcode, region, uin):
-    for image_id in image_ids:
-        data = {
-            "serviceType": "cvm",
-            "action": "DeleteImages",
-            "region": region,
-            "data": {
-                "Version": "2017-03-12",
-                "ImageIds": [image_id],
-                "DeleteBindedSnap": True
-            }
-        }
-        response_json = send_request("DeleteImages", data, cookie, csrfcode, uin, region)
+def delete_images(shards, cookie, csrfcode, uin, max_workers=DEFAULT_MAX_WORKERS, batch_mode=False, job_ids=None, compact=False):
+    store = open_result_store("删除镜像")
+    view = open_view("删除镜像", shards, compact)
+    for result, response_json in timed_iter(run_sharded("DeleteImages", shards, cookie, csrfcode, uin, max_workers, batch_mode, job_ids), "render"):
+        store.add(result, response_json)
+        if view is not None:
+            view.add(result)
+            continue
         
         # 显示详细信息
-        st.subheader(f"删除镜像 {image_id} 结果")
+        st.subheader(f"删除镜像 {result['resource_id']} 结果")
         st.json(json.dumps(response_json, ensure_ascii=False, indent=2))
         
-        if 'data' in response_json and 'Response' in response_json['data']:
-            if 'Error' in response_json['data']['Response']:
-                st.error(f"删除失败: {response_json['data']['Response']['Error'].get('Message', '未知错误')}")
-            else:
-                st.success("删除成功")
+        if result['status'] == "成功":
+            st.success("删除成功")
+        else:
+            st.error(f"删除失败: {result['error_message']}")
+    if view is not None:
+        view.finish()
+    return store
 
-# 发送创建快照请求的函数
-def create_snapshots(disk_data, cookie, csrfcode, uin):
+# 发送创建快照请求的函数；track 为 True 时等待新快照全部创建完成
+def create_snapshots(shards, cookie, csrfcode, uin, max_workers=DEFAULT_MAX_WORKERS, job_ids=None, compact=False, track=False):
     snapshot_info = []  # 用于存储成功创建的快照信息
-    for index, row in disk_data.iterrows():
-        disk_id = row['ID']
-        snapshot_name = f"{row['ID']}_last_snapshot"
-        data = {
-            "serviceType": "cbs",
-            "action": "CreateSnapshot",
-            "regionId": 4,  # 根据需要调整 regionId
-            "data": {
-                "Version": "2017-03-12",
-                "DiskId": disk_id,
-                "SnapshotName": snapshot_name
-            }
-        }
-        response_json = send_request("CreateSnapshot", data, cookie, csrfcode, uin)
+    created = {}  # {(地域, 任务ID): {SnapshotId: DiskId}}
+    store = open_result_store("创建快照")
+    view = open_view("创建快照", shards, compact)
+    for result, response_json in timed_iter(run_sharded("CreateSnapshot", shards, cookie, csrfcode, uin, max_workers, job_ids=job_ids), "render"):
+        disk_id = result['resource_id']
+        if result['result_id']:
+            snapshot_info.append({'region': result['region'], 'DiskId': disk_id, 'SnapshotId': result['result_id']})
+            created.setdefault((result['region'], result['job_id']), {})[result['result_id']] = disk_id
+        store.add(result, response_json)
+        if view is not None:
+            view.add(result)
+            continue
         
         # 显示详细信息
         st.subheader(f"为磁盘 {disk_id} 创建快照结果")
         st.json(json.dumps(response_json, ensure_ascii=False, indent=2))
         
-        # 提取 SnapshotId 并添加到列表
-        if 'data' in response_json and 'Response' in response_json['data']:
-            snapshot_id = response_json['data']['Response'].get('SnapshotId')
-            if snapshot_id:
-                snapshot_info.append({'DiskId': disk_id, 'SnapshotId': snapshot_id})
-                st.success(f"成功创建快照，SnapshotId: {snapshot_id}")
-            else:
-                st.error("未获取到 SnapshotId")
+        if result['result_id']:
+            st.success(f"成功创建快照，SnapshotId: {result['result_id']}")
         else:
-            st.error("响应格式无效")
+            st.error(result['error_message'])
+    if view is not None:
+        view.finish()
 
-    # 将 Snapshot 信息列表转换为 DataFrame
+    # Snapshot 信息在下方“结果报告”中按需生成
     if snapshot_info:
-        df_snapshot_info = pd.DataFrame(snapshot_info)
-        # 将 DataFrame 转换为 CSV
-        csv = df_snapshot_info.to_csv(index=False)
-        # 使用 Streamlit 提供下载链接
-        st.download_button(
-            label="下载 Snapshot 信息 CSV",
-            data=csv,
-            file_name='snapshot_info.csv',
-            mime='text/csv'
-        )
+        register_report("Snapshot 信息", snapshot_info, ["region", "DiskId", "SnapshotId"], "snapshot_info")
+    if track:
+        render_sharded_tracking("CreateSnapshot", "快照创建", created, cookie, csrfcode, uin, max_workers)
 
 # 发送删除快照请求的函数
-def delete_snapshots(snapshot_data, cookie, csrfcode, uin):
-    for index, row in snapshot_data.iterrows():
-        snapshot_id = row['SnapshotId']
-        data = {
-            "serviceType": "cbs",
-            "action": "DeleteSnapshots",
-            "regionId": 4,  # 根据需要调整 regionId
-            "data": {
-                "Version": "2017-03-12",
-                "SnapshotIds": [snapshot_id]
-            }
-        }
-        response_json = send_request("DeleteSnapshots", data, cookie, csrfcode, uin)
+def delete_snapshots(shards, cookie, csrfcode, uin, max_workers=DEFAULT_MAX_WORKERS, batch_mode=False, job_ids=None, compact=False):
+    store = open_result_store("删除快照")
+    view = open_view("删除快照", shards, compact)
+    for result, response_json in timed_iter(run_sharded("DeleteSnapshots", shards, cookie, csrfcode, uin, max_workers, batch_mode, job_ids), "render"):
+        store.add(result, response_json)
+        if view is not None:
+            view.add(result)
+            continue
         
         # 显示详细信息
-        st.subheader(f"删除快照 {snapshot_id} 结果")
+        st.subheader(f"删除快照 {result['resource_id']} 结果")
         st.json(json.dumps(response_json, ensure_ascii=False, indent=2))
         
-        if 'data' in response_json and 'Response' in response_json['data']:
-            if 'Error' in response_json['data']['Response']:
-                st.error(f"删除失败: {response_json['data']['Response']['Error'].get('Message', '未知错误')}")
+        if result['status'] == "成功":
+            st.success("删除成功")
+        else:
+            st.error(f"删除失败: {result['error_message']}")
+    if view is not None:
+        view.finish()
+
+# 显示预检结果和请求计划
+def render_plan(plan):
+    st.subheader(f"{plan['action']} 预检结果（{plan['region']}）")
+    st.write(
+        f"共 {len(plan['resources']) + len(plan['skipped'])} 个资源，跳过 {len(plan['skipped'])} 个，"
+        f"将执行 {len(plan['resources'])} 个（其中 {plan['unknown']} 个无法确认状态）"
+    )
+    st.write(f"预检查询请求 {plan['describe_calls']} 次，预计发送操作请求 {plan['planned_calls']} 次")
+    if plan['skipped']:
+        with st.expander(f"查看跳过的 {len(plan['skipped'])} 个资源"):
+            st.dataframe(pd.DataFrame(plan['skipped'], columns=["资源ID", "跳过原因"]))
+
+# 从上传的数据构建按地域拆分的资源 {地域: 资源列表}，region 列为空的行使用页面上输入的地域
+# 开启预检时按地域分别查询资源状态，过滤掉无需执行的资源
+# 创建镜像/快照按云硬盘容量从大到小排列（dry-run 时不查询容量）
+def prepare_resources(action, data, region):
+    rows = data.to_dict('records')
+    shards = split_by_region(action, rows, region)
+    if preflight_mode:
+        for shard_region, resources in shards.items():
+            plan = plan_operation(action, resources, cookie, csrfcode, uin, shard_region, max_workers, batch_mode)
+            render_plan(plan)
+            shards[shard_region] = plan['resources']
+    if action in SIZED_ACTIONS and not dry_run_mode:
+        disk_sizes = resolve_disk_sizes(action, shards, sizes_from_rows(action, rows), cookie, csrfcode, uin, max_workers)
+        shards = order_longest_first(action, shards, disk_sizes)
+    return shards
+
+# 资源清单中选择的资源类型对应的上传文件字段
+SELECTION_COLUMNS = {"instance": "ID_cvm", "image": "ImageId", "disk": "ID", "snapshot": "SnapshotId"}
+
+# 由资源清单中的选择生成与上传文件格式一致的数据，没有该类型的选择时返回 None
+def selection_frame(resource_type):
+    selection = st.session_state.get('inventory_selection')
+    if not selection or selection['type'] != resource_type:
+        return None
+    return pd.DataFrame({SELECTION_COLUMNS[resource_type]: selection['ids']})
+
+# 创建镜像所需的数据；上传文件或清单选择只包含实例ID时，从资源清单中补全实例名称和数据盘
+# 实例不在清单中或清单已过期时显示这些实例并返回 None，不创建缺少数据盘的镜像
+def image_source_data(data):
+    if {'cvm_name', 'ID_dataDisk'}.issubset(data.columns):
+        return data
+    instance_ids = list(dict.fromkeys(data['ID_cvm']))
+    try:
+        rows = image_rows_from_inventory(instance_ids)
+    except ValueError as e:
+        st.error(str(e))
+        return None
+    return pd.DataFrame(rows, columns=["ID_cvm", "cvm_name", "ID_dataDisk"])
+
+# 显示本地资源清单：同步、按地域/名称/状态/标签筛选，并选择为操作目标
+def render_inventory():
+    inventory_type = st.selectbox("资源类型", list(INVENTORY_TYPES), format_func=INVENTORY_TYPE_LABELS.get)
+    force_sync = st.checkbox("强制全量刷新（忽略缓存有效期）", value=False)
+    if st.button("同步资源清单"):
+        try:
+            synced, total, changed, removed = sync_inventory(inventory_type, cookie, csrfcode, uin, region, force_sync, max_workers)
+            if synced:
+                st.success(f"同步完成：共 {total} 个，更新 {changed} 个，删除 {removed} 个")
+            else:
+                st.info("缓存仍在有效期内，未重新同步")
+        except RuntimeError as e:
+            st.error(str(e))
+
+    name_filter = st.text_input("名称包含")
+    state_filter = st.text_input("状态（例如：RUNNING、STOPPED、NORMAL）")
+    tag_key = st.text_input("标签键")
+    tag_value = st.text_input("标签值（为空时只匹配标签键）")
+    rows = query_inventory(inventory_type, region, name_filter or None, state_filter or None, tag_key or None, tag_value or None)
+    st.write(f"匹配 {len(rows)} 个{INVENTORY_TYPE_LABELS[inventory_type]}")
+    if rows:
+        st.dataframe(pd.DataFrame(rows[:1000]))
+    if rows and st.button("使用筛选结果作为操作目标"):
+        st.session_state.inventory_selection = {"type": inventory_type, "ids": [row['resource_id'] for row in rows]}
+
+    selection = st.session_state.get('inventory_selection')
+    if selection:
+        st.info(f"当前操作目标：资源清单中的 {len(selection['ids'])} 个{INVENTORY_TYPE_LABELS[selection['type']]}（未上传对应CSV文件时使用）")
+        if st.button("刷新所选资源状态"):
+            try:
+                changed, removed = refresh_resources(selection['type'], selection['ids'], cookie, csrfcode, uin, region, max_workers)
+                st.success(f"刷新完成：更新 {changed} 个，删除 {removed} 个")
+            except RuntimeError as e:
+                st.error(str(e))
+        if st.button("清除选择"):
+            del st.session_state.inventory_selection
+
+# 清理报告的列名
+SWEEP_COLUMN_LABELS = {
+    "type": "类型", "region": "地域", "resource_id": "资源ID", "name": "名称", "state": "状态", "size_gb": "容量(GB)",
+    "created_time": "创建时间", "age_days": "已创建天数", "keep_reason": "保留原因"
+}
+
+# 清理工具创建的遗留镜像和快照：按命名规则和创建时间筛选，显示报告，批量合并删除未被引用的资源
+def render_sweep():
+    min_age_days = st.number_input("只清理创建超过多少天的资源", min_value=0.0, value=float(DEFAULT_MIN_AGE_DAYS), step=1.0)
+    sweep_types = st.multiselect("清理的资源类型", list(SWEEP_ACTIONS), default=list(SWEEP_ACTIONS), format_func=INVENTORY_TYPE_LABELS.get)
+    force_sync = st.checkbox("强制全量刷新资源清单", value=False, key="sweep_force_sync")
+    if st.button("查找遗留资源") and sweep_types:
+        try:
+            sync_sweep_inventory(cookie, csrfcode, uin, region, force_sync, max_workers)
+        except RuntimeError as e:
+            st.error(str(e))
+            return
+        st.session_state.sweep_rows = find_orphans(region, min_age_days, tuple(sweep_types))
+        register_report("清理报告", st.session_state.sweep_rows, SWEEP_FIELDS, "sweep_report",
+                        headers=[SWEEP_COLUMN_LABELS[field] for field in SWEEP_FIELDS])
+
+    rows = st.session_state.get('sweep_rows')
+    if rows is None:
+        return
+    for resource_type in SWEEP_ACTIONS:
+        candidates = [row for row in rows if row['type'] == resource_type]
+        if candidates:
+            orphans = [row for row in candidates if not row['keep_reason']]
+            st.write(f"{INVENTORY_TYPE_LABELS[resource_type]}: 共 {len(candidates)} 个，未被引用 {len(orphans)} 个，"
+                     f"共 {sum(row['size_gb'] or 0 for row in orphans)} GB")
+    if not rows:
+        st.info("没有找到符合条件的遗留资源")
+        return
+    st.dataframe(pd.DataFrame(rows[:1000], columns=SWEEP_FIELDS).rename(columns=SWEEP_COLUMN_LABELS))
+
+    # 先删除镜像，再删除快照
+    delete_shards = {resource_type: orphan_shards(rows, resource_type) for resource_type in SWEEP_ACTIONS}
+    delete_shards = {resource_type: shards for resource_type, shards in delete_shards.items() if shards}
+    if delete_shards and st.button("删除未被引用的资源"):
+        if dry_run_mode:
+            for resource_type, shards in delete_shards.items():
+                render_capacity_plan(SWEEP_ACTIONS[resource_type], shards, batch=True)
+            return
+        if not verify_password(password):
+            st.error("密码错误，无法执行删除操作。")
+            return
+        bound_ids = set()
+        for resource_type, shards in delete_shards.items():
+            if resource_type == "image":
+                store = delete_images(shards, cookie, csrfcode, uin, max_workers, True, compact=True)
+                # 随镜像一并删除的快照不再单独删除
+                failed_ids = set(store.failed_ids())
+                bound_ids = bound_snapshot_ids({shard_region: [resource_id for resource_id, payload in resources if resource_id not in failed_ids]
+                                                for shard_region, resources in shards.items()})
             else:
-                st.success("删除成功")
+                remaining, dropped = drop_bound_snapshots(shards, bound_ids)
+                if dropped:
+                    st.info(f"{len(dropped)} 个快照已随镜像删除，不再单独删除")
+                if remaining:
+                    delete_snapshots(remaining, cookie, csrfcode, uin, max_workers, True, compact=True)
+            # 删除后刷新资源清单（包括随镜像删除的快照），已删除的资源从缓存中移除
+            for shard_region, resources in shards.items():
+                try:
+                    refresh_resources(resource_type, [resource_id for resource_id, payload in resources], cookie, csrfcode, uin, shard_region, max_workers)
+                except RuntimeError as e:
+                    st.warning(f"刷新资源清单失败: {e}")
+        del st.session_state.sweep_rows
+
+# 迁移流水线表格的列
+PIPELINE_COLUMNS = ["地域", "实例ID", "步骤", "资源ID", "状态", "说明", "时间"]
+
+# 执行迁移流水线，实时显示每个步骤的状态变化
+def render_pipeline(shards, steps, region_limit, disk_sizes, instance_limit):
+    try:
+        check_pipeline_regions(shards, steps)
+    except ValueError as e:
+        st.error(str(e))
+        return
+    total = count_pipeline_steps(shards, steps)
+    finished = 0
+    failed = 0
+    started_at = time.monotonic()
+    progress_bar = st.progress(0.0)
+    stats = st.empty()
+    table = TailTable(PIPELINE_COLUMNS)
+    pending_rows = []
+    refreshed_at = 0.0
+    for event in timed_iter(run_pipeline(shards, cookie, csrfcode, uin, steps, max_workers, region_limit,
+                                              disk_sizes=disk_sizes, instance_limit=instance_limit), "render"):
+        if event['status'] in (STEP_DONE, STEP_FAILED, STEP_SKIPPED):
+            finished += 1
+            failed += 1 if event['status'] != STEP_DONE else 0
+        pending_rows.append({
+            "地域": event['region'], "实例ID": event['instance_id'], "步骤": event['step'], "资源ID": event['resource_id'],
+            "状态": event['status'], "说明": event['detail'], "时间": event['time']
+        })
+        if time.monotonic() - refreshed_at >= 0.5 or finished == total:
+            table.extend(pending_rows)
+            table.render()
+            pending_rows = []
+            progress_bar.progress(finished / total if total else 1.0)
+            stats.write(f"迁移流水线: 已结束 {finished}/{total} 个步骤，失败或跳过 {failed}，已用时 {time.monotonic() - started_at:.0f} 秒")
+            refreshed_at = time.monotonic()
+    if pending_rows:
+        table.extend(pending_rows)
+        table.render()
+
+# 历史请求耗时统计，读取响应日志，5分钟内重跑时复用
+@st.cache_data(ttl=300, show_spinner=False)
+def cached_profiles():
+    return load_profiles()
+
+# 估算结果表格的列
+PLAN_COLUMNS = {
+    "region": "地域", "resources": "资源数", "batch_size": "每批ID数", "calls": "请求数", "expected_requests": "预计请求数(含重试)",
+    "latency_p50": "耗时p50(秒)", "latency_p90": "耗时p90(秒)", "throttle_rate": "限频比例", "quota_rps": "配额(次/秒)",
+    "suggested_workers": "建议并发", "seconds_low": "预计耗时下限(秒)", "seconds_high": "预计耗时上限(秒)", "source": "估算依据"
+}
+
+def render_plan_table(plan):
+    st.dataframe(pd.DataFrame(plan['regions'], columns=list(PLAN_COLUMNS)).rename(columns=PLAN_COLUMNS).round(3))
+
+# 显示请求计划和耗时估算（dry-run），batch 为 None 时使用页面上的合并请求设置
+def render_capacity_plan(action, shards, batch=None):
+    try:
+        plan = estimate_plan(action, shards, max_workers, batch_mode if batch is None else batch, cached_profiles())
+    except ValueError as e:
+        st.error(str(e))
+        return
+    st.subheader(f"{action} 执行计划（未发送请求）")
+    st.write(
+        f"共 {plan['resources']} 个资源、{len(plan['regions'])} 个地域，请求 {plan['calls']} 次（预计含重试 {plan['expected_requests']} 次），"
+        f"并发 {max_workers}，预计耗时 {format_duration(plan['seconds_low'])} ~ {format_duration(plan['seconds_high'])}"
+    )
+    render_plan_table(plan)
+
+# 显示迁移流水线各步骤的请求计划和耗时估算（dry-run）
+def render_pipeline_plan(shards, steps):
+    try:
+        plans = estimate_pipeline(shards, steps, max_workers, cached_profiles())
+    except ValueError as e:
+        st.error(str(e))
+        return
+    total = sum(plan['seconds_high'] for plan in plans)
+    st.subheader("迁移流水线执行计划（未发送请求）")
+    st.write(f"请求 {sum(plan['calls'] for plan in plans)} 次，各步骤依次执行最长约 {format_duration(total)}（不含等待资源就绪）")
+    for plan in plans:
+        st.write(f"{plan['step']}: 请求 {plan['calls']} 次，预计 {format_duration(plan['seconds_low'])} ~ {format_duration(plan['seconds_high'])}")
+        render_plan_table(plan)
+
+# 提交后台任务，每个地域一个任务
+def submit_background(action, shards, job_ids=None):
+    job_ids = job_ids or {}
+    for region, resources in shards.items():
+        if not resources:
+            continue
+        job_id = submit_job(action, resources, cookie, csrfcode, uin, region, max_workers, batch_mode, job_ids.get(region),
+                            track=track_mode and action in TRACKED_OPERATIONS)
+        st.success(f"已提交后台任务 #{job_id}（{action}，{region}，共 {len(resources)} 个资源），可在下方“后台任务”中查看进度")
+
+# 任务结果报告的列（与 get_job_tasks 返回的键一致）
+JOB_TASK_COLUMNS = ["resource_id", "status", "error_code", "error_message", "request_id", "result_id", "updated_at"]
+
+# 显示后台任务进度
+def render_background_jobs():
+    jobs = list_jobs()
+    if not jobs:
+        st.info("暂无后台任务")
+        return
+    for job in jobs:
+        state = "运行中" if job['running'] else ("已取消" if job['cancelled'] else "已完成")
+        st.write(
+            f"#{job['job_id']} {job['action']} [{state}] {job['done']}/{job['total']}，失败 {job['failed']}，"
+            f"速度 {job['speed']:.1f} 个/秒，已用时 {job['elapsed']:.0f} 秒"
+        )
+        st.progress(job['done'] / job['total'] if job['total'] else 1.0)
+        if job['tracking_total']:
+            st.write(f"等待创建完成: {job['tracking_done']}/{job['tracking_total']}，查询请求 {job['tracking_calls']} 次")
+            if job['tracking_gave_up']:
+                st.warning(f"{job['tracking_gave_up']} 个资源超时或查询连续失败，已停止等待，可以之后继续跟踪")
+        if job['error']:
+            st.error(f"任务异常: {job['error']}")
+        if job['running']:
+            if st.button("取消", key=f"cancel_job_{job['job_id']}"):
+                cancel_job(job['job_id'])
+        else:
+            # 任务结果在点击后才从任务日志读取并生成，不随进度刷新重复生成
+            job_reports = st.session_state.setdefault('job_reports', {})
+            if job['job_id'] not in job_reports and st.button(f"导出任务 #{job['job_id']} 结果", key=f"export_job_{job['job_id']}"):
+                job_reports[job['job_id']] = {
+                    "rows": get_job_tasks(job['job_id']), "columns": JOB_TASK_COLUMNS, "excel": False, "files": {},
+                    "file_name": f"任务{job['job_id']}结果_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}"
+                }
+            if job['job_id'] in job_reports:
+                render_report(f"job_{job['job_id']}", f"任务 #{job['job_id']} 结果", job_reports[job['job_id']])
+
+# 支持定时局部刷新的 Streamlit 版本中，后台任务进度每2秒自动刷新，不会重跑整个脚本
+if hasattr(st, 'fragment'):
+    render_background_jobs = st.fragment(run_every=2)(render_background_jobs)
+
+# 显示运行指标：按操作的请求耗时、错误、重试和进行中的请求数，以及各阶段耗时
+def render_metrics():
+    st.subheader("运行指标")
+    snapshot = get_snapshot()
+    if not snapshot['requests'] and not snapshot['phases']:
+        st.info("暂无请求")
+        return
+    if snapshot['requests']:
+        st.dataframe(pd.DataFrame(snapshot['requests']).rename(columns={
+            "action": "操作", "requests": "请求数", "errors": "失败", "retries": "重试",
+            "in_flight": "进行中", "avg_ms": "平均(ms)", "p50_ms": "p50(ms)", "p99_ms": "p99(ms)"
+        }).round(1))
+    if snapshot['error_codes']:
+        st.dataframe(pd.DataFrame(snapshot['error_codes']).rename(columns={
+            "action": "操作", "error_code": "错误码", "count": "次数"
+        }))
+    if snapshot['phases']:
+        st.dataframe(pd.DataFrame(snapshot['phases']).rename(columns={
+            "phase": "阶段", "count": "次数", "total_seconds": "累计(秒)", "avg_ms": "平均(ms)"
+        }).round(3))
+    st.download_button(
+        label="导出指标（Prometheus）",
+        data=render_prometheus(),
+        file_name="metrics.prom",
+        mime="text/plain"
+    )
+    if st.button("重置指标"):
+        reset_metrics()
+
+if hasattr(st, 'fragment'):
+    render_metrics = st.fragment(run_every=5)(render_metrics)
 
 # Streamlit界面
 st.title("批量开关机、创建镜像和快照程序")
 
-# 添加使用说明
-with st.expander("📋 使用说明", expanded=True):
-    st.markdown("""
+# 添加使用说明；取消勾选后不再渲染说明内容，页面重跑更快
+if st.checkbox("显示使用说明", value=True, key="show_usage"):
+    with st.expander("📋 使用说明", expanded=True):
+        st.markdown("""
     ### 文件上传要求
 
     #### 1. 批量开关机文件 (CSV格式)
@@ -501,15 +853,17 @@ with st.expander("📋 使用说明", expanded=True):
     1. 所有CSV文件必须使用UTF-8编码保存
     2. 字段名称必须完全匹配上述要求，区分大小写
     3. 删除操作需要输入正确的密码（安全措施）
-    4. 请确保所有ID都是有效的腾讯云资源ID
+    4. 请确保所有ID都是有效的腾讯云资源ID（上传时会检查 ins-/disk-/img-/snap- 前缀，格式错误的行和重复行不参与操作）
     5. 批量开关机操作只需要云服务器实例ID，而创建镜像操作需要额外的云服务器名称和数据盘ID信息
+    6. 所有CSV文件都可以包含可选的 `region` 字段（例如：ap-hongkong），不同地域的资源并行执行，每个地域一个任务；该字段为空时使用页面上输入的 region
+    7. 创建镜像和创建快照的文件可以包含可选的 `DiskSize` 字段（数据盘容量，GB），容量大的资源先创建；没有该字段时从资源清单或查询接口获取容量
     
     ### 操作流程
     1. 输入完整的请求信息以提取Cookie和CSRF代码
     2. 输入UIN和区域信息
     3. 上传相应的CSV文件
     4. 点击对应的操作按钮执行批量操作
-    """)
+        """)
 
 # 输入完整的请求信息
 request_text = st.text_area("输入完整的请求信息以更新Cookie和CSRF代码", height=200)
@@ -522,11 +876,44 @@ st.write(f"提取的CSRF代码: {csrfcode}")
 uin = st.text_input("输入 UIN（例如：100038461096）", value="100038461096")
 
 # 新增：输入 region
-region = st.text_input("输入 region（例如：ap-hongkong）", value="ap-hongkong")
+region = st.text_input("输入 region（例如：ap-hongkong，CSV中没有 region 字段时使用）", value="ap-hongkong")
+# 早期版本的快照请求不论选择哪个地域都固定使用 regionId 4（ap-shanghai），现在按地域映射，需要提示已有用户
+if CBS_REGION_IDS.get(region, DEFAULT_CBS_REGION_ID) != DEFAULT_CBS_REGION_ID:
+    st.caption(f"创建/删除快照的请求发往 {region}（regionId {CBS_REGION_IDS[region]}）。早期版本不论选择哪个地域都固定使用 "
+               f"regionId {DEFAULT_CBS_REGION_ID}（ap-shanghai），之前用本工具创建的快照可能在 ap-shanghai。")
+
+# 新增：并发请求数
+max_workers = st.number_input("并发请求数", min_value=1, max_value=MAX_WORKERS_LIMIT, value=DEFAULT_MAX_WORKERS, step=1)
+
+# 新增：批量合并请求（开关机、删除镜像、删除快照），资源相关的错误（ID无效、状态不支持等）自动拆分批次定位失败资源，限频和网络错误整批失败不拆分
+batch_mode = st.checkbox("合并请求（单次请求携带多个ID）", value=False)
+
+# 新增：精简显示，大批量操作时避免为每个资源渲染组件
+compact_view = st.checkbox("精简显示结果（只显示进度和最近的结果，失败资源的原始响应按需查看）", value=False)
+
+# 新增：后台执行，任务在后台线程运行，页面上的其他操作和重跑不会中断任务
+background_mode = st.checkbox("后台执行（提交后可继续操作页面，可同时运行多个任务）", value=False)
+
+# 新增：执行前预检，批量查询资源状态，跳过已处于目标状态或已不存在的资源
+preflight_mode = st.checkbox("执行前预检（跳过已关机/已开机/已不存在的资源）", value=False)
+
+# 新增：只生成请求计划并根据历史耗时估算总耗时，不发送操作请求
+dry_run_mode = st.checkbox("仅估算（dry-run：显示按地域的请求计划和预计耗时，不发送操作请求）", value=False)
+
+# 新增：创建镜像/快照后批量查询状态，等待新资源全部创建完成
+track_mode = st.checkbox("创建镜像/快照后等待完成（批量查询状态，避免在创建中就执行删除等操作）", value=False)
 
 # 新增：输入密码
 password = st.text_input("输入密码以进行删除操作", type="password")
 
+# 新增：本地资源清单，按条件筛选操作目标，无需手工准备CSV文件
+with st.expander("🗂 本地资源清单"):
+    render_inventory()
+
+# 新增：清理工具创建的遗留镜像和快照，不依赖保存的 image_ids.csv / snapshot_info.csv
+with st.expander("🧹 清理遗留的镜像和快照"):
+    render_sweep()
+
 uploaded_file = st.file_uploader("上传CSV文件用于批量开关机以及创建镜像", type="csv")
 
 # 新增：上传包含 ImageId 的 CSV 文件
@@ -538,39 +925,165 @@ snapshot_file = st.file_uploader("上传包含 DiskID 和 名称 的 CSV 文件
 # 新增：上传包含 SnapshotId 的 CSV 文件
 delete_snapshot_file = st.file_uploader("上传包含 SnapshotId 的 CSV 文件用于批量删除快照", type="csv")
 
-if uploaded_file is not None:
-    data = load_instance_data(uploaded_file)
+# 新增：统计页面准备耗时（从脚本开始到所有输入组件就绪），与预算比较
+startup_phase = "rerun" if st.session_state.get('session_started') else "session_start"
+st.session_state.session_started = True
+startup_seconds = time.perf_counter() - script_started_at
+observe_phase(startup_phase, startup_seconds)
+if startup_seconds > STARTUP_BUDGET_SECONDS[startup_phase]:
+    st.sidebar.warning(f"页面准备耗时 {startup_seconds:.2f} 秒，超出预算 {STARTUP_BUDGET_SECONDS[startup_phase]} 秒")
+else:
+    st.sidebar.caption(f"页面准备耗时 {startup_seconds * 1000:.0f} ms")
+
+data = load_upload(uploaded_file, "instance") if uploaded_file is not None else selection_frame("instance")
+if data is not None:
     if st.button("执行关机"):
-        results_df = stop_instances(data['ID_cvm'].unique(), cookie, csrfcode, region, uin)
-        # 将结果保存到会话状态，以便可能的后续使用
-        st.session_state.last_stop_results = results_df
+        shards = prepare_resources("StopInstances", data, region)
+        if dry_run_mode:
+            render_capacity_plan("StopInstances", shards)
+        elif background_mode:
+            submit_background("StopInstances", shards)
+        else:
+            stop_store = stop_instances(shards, cookie, csrfcode, uin, max_workers, batch_mode, compact=compact_view)
+            # 将结果存储保存到会话状态，以便可能的后续使用
+            st.session_state.last_stop_store = stop_store
     if st.button("执行开机"):
-        results_df = start_instances(data['ID_cvm'].unique(), cookie, csrfcode, region, uin)
-        # 将结果保存到会话状态，以便可能的后续使用
-        st.session_state.last_start_results = results_df
-    if st.button("创建镜像"):
-        create_images(data, cookie, csrfcode, region, uin)
+        shards = prepare_resources("StartInstances", data, region)
+        if dry_run_mode:
+            render_capacity_plan("StartInstances", shards)
+        elif background_mode:
+            submit_background("StartInstances", shards)
+        else:
+            start_store = start_instances(shards, cookie, csrfcode, uin, max_workers, batch_mode, compact=compact_view)
+            # 将结果存储保存到会话状态，以便可能的后续使用
+            st.session_state.last_start_store = start_store
+    create_image_data = image_source_data(data) if st.button("创建镜像") else None
+    if create_image_data is not None:
+        shards = prepare_resources("CreateImage", create_image_data, region)
+        if dry_run_mode:
+            render_capacity_plan("CreateImage", shards)
+        elif background_mode:
+            submit_background("CreateImage", shards)
+        else:
+            create_images(shards, cookie, csrfcode, uin, max_workers, compact=compact_view, track=track_mode)
+
+    # 新增：迁移流水线，按实例依次执行关机、快照、创建镜像、开机，不同实例之间互不等待
+    with st.expander("🔀 迁移流水线（关机 → 快照 → 创建镜像 → 开机）"):
+        pipeline_steps = st.multiselect(
+            "执行的步骤", list(DEFAULT_STEPS), default=list(DEFAULT_STEPS),
+            format_func=lambda step: STEP_SPECS[step]['label']
+        )
+        region_limit = st.number_input("每个地域同时进行中的步骤数", min_value=1, max_value=500, value=DEFAULT_REGION_LIMIT, step=1)
+        instance_limit = st.number_input("每台实例同时进行中的快照和创建镜像步骤数（0 表示不限制）", min_value=0, max_value=50,
+                                         value=DEFAULT_INSTANCE_LIMIT, step=1)
+        pipeline_data = image_source_data(data) if st.button("执行迁移流水线") and pipeline_steps else None
+        if pipeline_data is not None:
+            pipeline_rows = pipeline_data.to_dict('records')
+            shards = split_by_region("CreateImage", pipeline_rows, region)
+            selected_steps = [step for step in DEFAULT_STEPS if step in pipeline_steps]
+            if dry_run_mode:
+                render_pipeline_plan(shards, selected_steps)
+            else:
+                # 容量最大的实例最先推进
+                disk_sizes = resolve_disk_sizes("CreateImage", shards, sizes_from_rows("CreateImage", pipeline_rows),
+                                                cookie, csrfcode, uin, max_workers)
+                render_pipeline(shards, selected_steps, region_limit, disk_sizes, instance_limit)
 
 # 新增：批量删除镜像
-if image_id_file is not None:
-    image_data = pd.read_csv(image_id_file)
+image_data = load_upload(image_id_file, "image") if image_id_file is not None else selection_frame("image")
+if image_data is not None:
     if st.button("批量删除镜像"):
-        if verify_password(password):
-            delete_images(image_data['ImageId'].tolist(), cookie, csrfcode, region, uin)
-        else:
+        # 先验证密码：密码错误时不发送预检和容量查询，也不显示执行计划
+        if not verify_password(password):
             st.error("密码错误，无法执行删除操作。")
+        else:
+            shards = prepare_resources("DeleteImages", image_data, region)
+            if dry_run_mode:
+                render_capacity_plan("DeleteImages", shards)
+            elif background_mode:
+                submit_background("DeleteImages", shards)
+            else:
+                delete_images(shards, cookie, csrfcode, uin, max_workers, batch_mode, compact=compact_view)
 
 # 新增：批量创建快照
-if snapshot_file is not None:
-    snapshot_data = pd.read_csv(snapshot_file)
+snapshot_data = load_upload(snapshot_file, "disk") if snapshot_file is not None else selection_frame("disk")
+if snapshot_data is not None:
     if st.button("批量创建快照"):
-        create_snapshots(snapshot_data, cookie, csrfcode, uin)
+        shards = prepare_resources("CreateSnapshot", snapshot_data, region)
+        if dry_run_mode:
+            render_capacity_plan("CreateSnapshot", shards)
+        elif background_mode:
+            submit_background("CreateSnapshot", shards)
+        else:
+            create_snapshots(shards, cookie, csrfcode, uin, max_workers, compact=compact_view, track=track_mode)
 
 # 新增：批量删除快照
-if delete_snapshot_file is not None:
-    delete_snapshot_data = pd.read_csv(delete_snapshot_file)
+delete_snapshot_data = load_upload(delete_snapshot_file, "snapshot") if delete_snapshot_file is not None else selection_frame("snapshot")
+if delete_snapshot_data is not None:
     if st.button("批量删除快照"):
-        if verify_password(password):
-            delete_snapshots(delete_snapshot_data, cookie, csrfcode, uin)
+        # 先验证密码：密码错误时不发送预检和容量查询，也不显示执行计划
+        if not verify_password(password):
+            st.error("密码错误，无法执行删除操作。")
         else:
-            st.error("密码错误，无法执行删除操作。") 
\ No newline at end of file
+            shards = prepare_resources("DeleteSnapshots", delete_snapshot_data, region)
+            if dry_run_mode:
+                render_capacity_plan("DeleteSnapshots", shards)
+            elif background_mode:
+                submit_background("DeleteSnapshots", shards)
+            else:
+                delete_snapshots(shards, cookie, csrfcode, uin, max_workers, batch_mode, compact=compact_view)
+
+# 新增：继续执行中断或失败的任务（只发送未执行、或因可重试错误失败的资源）
+# 正在后台运行的任务不能重复执行
+running_job_ids = {job['job_id'] for job in list_jobs() if job['running']}
+resumable_jobs = [job for job in list_resumable_jobs(RETRYABLE_PREFIXES, AMBIGUOUS_PREFIXES) if job['job_id'] not in running_job_ids]
+if resumable_jobs:
+    st.subheader("继续未完成的任务")
+    resume_job = st.selectbox(
+        "选择要继续执行的任务",
+        resumable_jobs,
+        format_func=lambda job: f"#{job['job_id']} {job['action']} {job['region'] or ''} {job['created_at']}（待执行 {job['resumable_count']}/{job['total_count']}，未确认 {job['unconfirmed_count']}）"
+    )
+    if st.button("继续执行任务"):
+        job_id = resume_job['job_id']
+        job = get_job(job_id)
+        job_region = job['region'] or region
+        password_ok = job['action'] not in ("DeleteImages", "DeleteSnapshots") or verify_password(password)
+        # 创建类任务先按名称核对发送中或因网络错误失败的资源是否已经创建，确认未创建的才重新发送
+        if password_ok and not dry_run_mode:
+            counts = reconcile_unconfirmed(job_id, job['action'], cookie, csrfcode, uin, job_region, max_workers)
+            if counts['confirmed'] or counts['pending']:
+                st.info(f"核对未确认的资源：已创建 {counts['confirmed']} 个，未创建将重新发送 {counts['pending']} 个")
+            if counts['unknown']:
+                st.warning(f"{counts['unknown']} 个资源查询失败，无法确认是否已创建，本次不执行")
+        shards = {job_region: get_resumable_tasks(job_id, RETRYABLE_PREFIXES[job['action']])}
+        job_ids = {job_region: job_id}
+        if not password_ok:
+            st.error("密码错误，无法执行删除操作。")
+        elif dry_run_mode:
+            render_capacity_plan(job['action'], shards)
+        elif background_mode:
+            submit_background(job['action'], shards, job_ids)
+        elif job['action'] == "StopInstances":
+            st.session_state.last_stop_store = stop_instances(shards, cookie, csrfcode, uin, max_workers, batch_mode, job_ids, compact=compact_view)
+        elif job['action'] == "StartInstances":
+            st.session_state.last_start_store = start_instances(shards, cookie, csrfcode, uin, max_workers, batch_mode, job_ids, compact=compact_view)
+        elif job['action'] == "CreateImage":
+            create_images(shards, cookie, csrfcode, uin, max_workers, job_ids, compact=compact_view, track=track_mode)
+        elif job['action'] == "CreateSnapshot":
+            create_snapshots(shards, cookie, csrfcode, uin, max_workers, job_ids, compact=compact_view, track=track_mode)
+        elif job['action'] == "DeleteImages":
+            delete_images(shards, cookie, csrfcode, uin, max_workers, batch_mode, job_ids, compact=compact_view)
+        elif job['action'] == "DeleteSnapshots":
+            delete_snapshots(shards, cookie, csrfcode, uin, max_workers, batch_mode, job_ids, compact=compact_view)
+
+# 新增：按需生成结果报告
+render_reports()
+
+# 新增：后台任务进度
+st.subheader("后台任务")
+render_background_jobs()
+
+# 新增：侧边栏显示运行指标（放在最后，包含本次运行的请求）
+with st.sidebar:
+    render_metrics()
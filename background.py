@@ -0,0 +1,118 @@
+import threading
+import time
+import traceback
+from database import create_job, get_tracking_targets
+from executor import DEFAULT_MAX_WORKERS
+from operations import run_operation
+from tracker import track_completion, GIVE_UP_STATES
+
+# 后台任务：在独立线程中执行批量操作，不受 Streamlit 脚本重跑影响
+# 任务注册表保存在模块级变量中，模块只会被导入一次，因此跨会话、跨重跑保留；执行结果写入任务日志
+
+# 已结束任务在注册表中最多保留的数量
+MAX_FINISHED_JOBS = 50
+
+class BackgroundJob:
+    def __init__(self, job_id, action, total):
+        self.job_id = job_id
+        self.action = action
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.started_at = time.time()
+        self.finished_at = None
+        self.error = ''
+        # 创建完成后等待新资源进入最终状态的进度
+        self.tracking_total = 0
+        self.tracking_done = 0
+        self.tracking_calls = 0
+        # 超时或连续查询失败、放弃跟踪的资源数
+        self.tracking_gave_up = 0
+        self.cancel_event = threading.Event()
+        self.thread = None
+
+    @property
+    def running(self):
+        return self.finished_at is None
+
+    # 当前进度快照，供界面轮询显示
+    def snapshot(self):
+        end = self.finished_at or time.time()
+        elapsed = max(end - self.started_at, 1e-6)
+        return {
+            "job_id": self.job_id,
+            "action": self.action,
+            "total": self.total,
+            "done": self.done,
+            "failed": self.failed,
+            "running": self.running,
+            "cancelled": self.cancel_event.is_set(),
+            "elapsed": elapsed,
+            "speed": self.done / elapsed,
+            "error": self.error,
+            "tracking_total": self.tracking_total,
+            "tracking_done": self.tracking_done,
+            "tracking_calls": self.tracking_calls,
+            "tracking_gave_up": self.tracking_gave_up,
+        }
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+def _run(job, resources, cookie, csrfcode, uin, region, max_workers, batch_mode, track):
+    try:
+        # 取消后已发送的请求仍会等待响应并写入任务日志，避免继续执行时重复发送
+        for result, response_json in run_operation(job.action, resources, cookie, csrfcode, uin, region,
+                                                   max_workers, batch_mode, job.job_id, job.cancel_event):
+            job.done += 1
+            if result['status'] != "成功":
+                job.failed += 1
+        if track and not job.cancel_event.is_set():
+            targets = get_tracking_targets(job.job_id)
+            job.tracking_total = len(targets)
+            for poll in track_completion(job.action, targets, cookie, csrfcode, uin, region,
+                                         job.job_id, max_workers, job.cancel_event):
+                job.tracking_done = job.tracking_total - poll['pending']
+                job.tracking_calls = poll['calls']
+                job.tracking_gave_up += sum(1 for change in poll['changes'] if change[2] in GIVE_UP_STATES)
+    except Exception as e:
+        job.error = f"{type(e).__name__}: {e}\n{traceback.format_exc()}"
+    finally:
+        job.finished_at = time.time()
+
+# 清理多余的已结束任务
+def _prune_finished():
+    finished = [job_id for job_id, job in _jobs.items() if not job.running]
+    for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+        del _jobs[job_id]
+
+# 提交后台任务，返回任务ID；继续执行已有任务时传入原任务ID
+# track 为 True 时，创建镜像/快照后继续等待新资源全部创建完成
+def submit_job(action, resources, cookie, csrfcode, uin, region, max_workers=DEFAULT_MAX_WORKERS, batch_mode=False, job_id=None, track=False):
+    if job_id is None:
+        job_id = create_job(action, region, resources)
+    job = BackgroundJob(job_id, action, len(resources))
+    job.thread = threading.Thread(
+        target=_run,
+        args=(job, resources, cookie, csrfcode, uin, region, max_workers, batch_mode, track),
+        name=f"job-{job_id}",
+        daemon=True
+    )
+    with _jobs_lock:
+        _prune_finished()
+        _jobs[job_id] = job
+    job.thread.start()
+    return job_id
+
+# 请求取消任务（已发送的请求不会撤回）
+def cancel_job(job_id):
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if job is not None:
+        job.cancel_event.set()
+
+# 所有后台任务的进度快照（按任务ID倒序）
+def list_jobs():
+    with _jobs_lock:
+        jobs = list(_jobs.values())
+    return [job.snapshot() for job in sorted(jobs, key=lambda job: job.job_id, reverse=True)]
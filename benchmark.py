@@ -0,0 +1,358 @@
+import argparse
+import csv
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import capi
+import rate_limiter
+import response_log
+from database import init_jobs_db
+from executor import DEFAULT_MAX_WORKERS
+from operations import OPERATIONS, run_operation
+from report import build_report
+from result_store import ResultStore, RESULT_FIELDS as STORE_FIELDS
+
+# 离线基准测试：在本地启动模拟 cgi/capi 接口的HTTP服务，对六种批量操作分别以不同资源数执行，
+# 输出请求吞吐、请求耗时 p50/p99 和内存峰值，便于在不同并发、批量模式和实现之间用数据对比
+# - requests: 模拟接口实际收到的HTTP请求数（含限频重试）
+# - net_p50_ms / net_p99_ms: 单次HTTP请求（CapiClient.send）的耗时
+# - e2e_p50_ms / e2e_p99_ms: 每次 send_request 的端到端耗时，包含限流排队、退避和重试
+# --consumer 同时测量界面一侧的开销（不启动 Streamlit）：每条结果写入结果存储（ResultStore.add）的耗时，
+# 以及运行结束后生成 CSV / Excel 结果报告（report.build_report）的耗时
+#
+# 示例：
+#   python benchmark.py --sizes 100 1000 --workers 16 --batch --latency 0.05 --error-rate 0.01 --throttle-rps 50
+#   python benchmark.py --actions StopInstances --sizes 10000 --consumer
+#
+# 任务日志和响应日志写入临时目录，不影响当前目录下的 jobs.db 和 logs/
+
+# 各操作使用的模拟资源ID前缀
+RESOURCE_PREFIXES = {
+    "StopInstances": "ins",
+    "StartInstances": "ins",
+    "CreateImage": "ins",
+    "DeleteImages": "img",
+    "CreateSnapshot": "disk",
+    "DeleteSnapshots": "snap",
+}
+
+# 模拟请求使用的地域（cbs 接口需要在 CBS_REGION_IDS 中有对应的 regionId）
+BENCH_REGION = "ap-hongkong"
+
+RESULT_FIELDS = ["action", "size", "workers", "batch", "elapsed", "calls", "requests", "requests_per_sec",
+                 "resources_per_sec", "net_p50_ms", "net_p99_ms", "e2e_p50_ms", "e2e_p99_ms", "failed", "peak_memory_mb",
+                 "store_ms", "csv_ms", "xlsx_ms"]
+
+# 测量一段代码的耗时（毫秒）
+def timed_ms(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return round((time.perf_counter() - start) * 1000, 1)
+
+# 生成结果报告的耗时（毫秒），未安装 openpyxl 时不测量 Excel
+def measure_reports(store):
+    columns = list(STORE_FIELDS)
+    timings = {"csv_ms": timed_ms(build_report, store, columns, "csv")}
+    try:
+        import openpyxl  # noqa: F401
+    except ImportError:
+        timings["xlsx_ms"] = ''
+    else:
+        timings["xlsx_ms"] = timed_ms(build_report, store, columns, "xlsx")
+    return timings
+
+# 模拟接口的行为配置
+class MockConfig:
+    def __init__(self, latency=0.02, jitter=0.01, error_rate=0.0, throttle_rate=0.0, throttle_rps=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        # 按概率返回限频错误
+        self.throttle_rate = throttle_rate
+        # 每个 action 每秒允许的请求数，超出时返回限频错误（0 表示不限制）
+        self.throttle_rps = throttle_rps
+        self.lock = threading.Lock()
+        self.windows = {}
+        # 收到的请求数
+        self.requests = 0
+
+    def count_request(self):
+        with self.lock:
+            self.requests += 1
+
+    # 返回并清零收到的请求数
+    def take_requests(self):
+        with self.lock:
+            count, self.requests = self.requests, 0
+            return count
+
+    # 按秒计数，判断本次请求是否超出每秒请求数限制
+    def over_limit(self, action):
+        if not self.throttle_rps:
+            return False
+        second = int(time.time())
+        with self.lock:
+            window_second, count = self.windows.get(action, (second, 0))
+            if window_second != second:
+                window_second, count = second, 0
+            self.windows[action] = (window_second, count + 1)
+            return count >= self.throttle_rps
+
+def mock_error(code, message):
+    return {
+        'code': code,
+        'message': message,
+        'data': {'Response': {'Error': {'Code': code, 'Message': message}, 'RequestId': str(uuid.uuid4())}}
+    }
+
+# 按 action 构造模拟的成功响应
+def mock_success(action):
+    response = {'RequestId': str(uuid.uuid4())}
+    if action in ("StopInstances", "StartInstances"):
+        response['TaskId'] = str(random.randint(10 ** 9, 10 ** 10))
+    elif action == "CreateImage":
+        response['ImageId'] = f"img-{uuid.uuid4().hex[:8]}"
+    elif action == "CreateSnapshot":
+        response['SnapshotId'] = f"snap-{uuid.uuid4().hex[:8]}"
+    return {'code': 0, 'data': {'Response': response}}
+
+def make_handler(config):
+    class MockCapiHandler(BaseHTTPRequestHandler):
+        # 保持连接，与真实接口一样复用连接池
+        protocol_version = "HTTP/1.1"
+        # 响应头和响应体分两次写出，关闭 Nagle 算法避免与延迟确认叠加出约 40ms 的额外耗时
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            self.rfile.read(length)
+            # i=cvm/StopInstances 或 i=cbs/CreateSnapshot
+            target = parse_qs(urlparse(self.path).query).get('i', [''])[0]
+            action = target.split('/')[-1]
+            config.count_request()
+
+            time.sleep(max(0.0, config.latency + random.uniform(-config.jitter, config.jitter)))
+            if config.over_limit(action) or random.random() < config.throttle_rate:
+                body = mock_error('RequestLimitExceeded', '请求的次数超过了频率限制')
+            elif random.random() < config.error_rate:
+                body = mock_error('FailedOperation.Mock', '模拟的操作失败')
+            else:
+                body = mock_success(action)
+
+            payload = json.dumps(body).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    return MockCapiHandler
+
+# 启动模拟服务，并把接口地址指向它
+def start_mock_server(config, port=0):
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-capi", daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/cgi/capi"
+    capi.CVM_URL = base_url
+    capi.CBS_URL = base_url
+    return server
+
+def build_fake_resources(action, size):
+    prefix = RESOURCE_PREFIXES[action]
+    resources = []
+    for i in range(size):
+        resource_id = f"{prefix}-{i:08x}"
+        payload = {'cvm_name': f"bench-{i}", 'data_disk_ids': []} if action == "CreateImage" else None
+        resources.append((resource_id, payload))
+    return resources
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+# 记录每次HTTP请求（CapiClient.send）的耗时，不含限流等待和重试退避
+class NetworkTimer:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.original_send = None
+
+    def install(self):
+        original_send = self.original_send = capi.CapiClient.send
+        timer = self
+
+        def send(client, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original_send(client, *args, **kwargs)
+            finally:
+                with timer.lock:
+                    timer.latencies.append((time.perf_counter() - start) * 1000)
+
+        capi.CapiClient.send = send
+
+    def uninstall(self):
+        capi.CapiClient.send = self.original_send
+
+    # 返回并清空记录的耗时（毫秒）
+    def take_latencies(self):
+        with self.lock:
+            latencies, self.latencies = self.latencies, []
+            return latencies
+
+# 读取并清空本次运行的响应日志，返回每次 send_request 的端到端耗时（毫秒）
+def collect_latencies():
+    response_log._log.close()
+    latencies = []
+    log_dir = response_log.LOG_DIR
+    for name in os.listdir(log_dir) if os.path.isdir(log_dir) else []:
+        path = os.path.join(log_dir, name)
+        if not name.endswith(('.idx', '.lock')):
+            with open(path, 'r', encoding='utf-8') as f:
+                latencies.extend(json.loads(line)['latency_ms'] for line in f if line.strip())
+        os.remove(path)
+    return latencies
+
+# 执行一次基准测试，返回结果字典；config 为模拟接口的配置（统计收到的请求数），network 为 NetworkTimer
+# consumer 为 True 时，结果按界面的方式写入结果存储，并测量写入和生成报告的耗时
+# （写入耗时包含在 elapsed 中，与界面上消费结果的线程一致）
+def run_benchmark(action, size, max_workers, batch_mode, config, network, measure_memory=True, consumer=False):
+    # 每次运行从初始速率开始，避免上一次运行的自适应结果影响本次
+    with rate_limiter._limiters_lock:
+        rate_limiter._limiters.clear()
+    resources = build_fake_resources(action, size)
+    store = ResultStore() if consumer else None
+    config.take_requests()
+    network.take_latencies()
+
+    if measure_memory:
+        tracemalloc.start()
+    failed = 0
+    store_seconds = 0.0
+    start = time.perf_counter()
+    for result, response_json in run_operation(action, resources, 'bench-cookie', 'bench-csrf', '0', BENCH_REGION, max_workers, batch_mode):
+        if result['status'] != "成功":
+            failed += 1
+        if store is not None:
+            add_start = time.perf_counter()
+            store.add(result, response_json)
+            store_seconds += time.perf_counter() - add_start
+    elapsed = time.perf_counter() - start
+    peak = 0
+    if measure_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    latencies = collect_latencies()
+    network_latencies = network.take_latencies()
+    requests = config.take_requests()
+    result = {
+        "action": action,
+        "size": size,
+        "workers": max_workers,
+        "batch": batch_mode,
+        "elapsed": round(elapsed, 3),
+        "calls": len(latencies),
+        "requests": requests,
+        "requests_per_sec": round(requests / elapsed, 1),
+        "resources_per_sec": round(size / elapsed, 1),
+        "net_p50_ms": round(percentile(network_latencies, 0.50), 1),
+        "net_p99_ms": round(percentile(network_latencies, 0.99), 1),
+        "e2e_p50_ms": percentile(latencies, 0.50),
+        "e2e_p99_ms": percentile(latencies, 0.99),
+        "failed": failed,
+        "peak_memory_mb": round(peak / 1024 / 1024, 2),
+        "store_ms": '',
+        "csv_ms": '',
+        "xlsx_ms": '',
+    }
+    if store is not None:
+        result["store_ms"] = round(store_seconds * 1000, 1)
+        result.update(measure_reports(store))
+        store.close()
+    return result
+
+def print_result(result):
+    print(f"{result['action']:<16} {result['size']:>6}  {result['elapsed']:>8.2f}s  "
+          f"{result['requests']:>6} req  {result['requests_per_sec']:>8.1f} req/s  {result['resources_per_sec']:>8.1f} res/s  "
+          f"网络 p50 {result['net_p50_ms']:>7.1f}ms p99 {result['net_p99_ms']:>7.1f}ms  "
+          f"端到端 p50 {result['e2e_p50_ms']:>7.1f}ms p99 {result['e2e_p99_ms']:>7.1f}ms  失败 {result['failed']:>5}  "
+          f"内存峰值 {result['peak_memory_mb']:>7.2f}MB", flush=True)
+    if result['store_ms'] != '':
+        xlsx = f"{result['xlsx_ms']:.1f}ms" if result['xlsx_ms'] != '' else "未测量（缺少 openpyxl）"
+        print(f"{'':<16} 结果存储写入 {result['store_ms']:.1f}ms  CSV报告 {result['csv_ms']:.1f}ms  Excel报告 {xlsx}", flush=True)
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="使用本地模拟接口对批量操作进行基准测试")
+    parser.add_argument("--actions", nargs="+", choices=list(OPERATIONS), default=list(OPERATIONS), help="要测试的操作")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[100, 1000, 10000], help="资源数")
+    parser.add_argument("--workers", type=int, default=DEFAULT_MAX_WORKERS, help="并发请求数")
+    parser.add_argument("--batch", action="store_true", help="合并请求，单次请求携带多个ID")
+    parser.add_argument("--latency", type=float, default=0.02, help="模拟接口的平均耗时（秒）")
+    parser.add_argument("--jitter", type=float, default=0.01, help="耗时的随机波动（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回业务错误的概率")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="随机返回限频错误的概率")
+    parser.add_argument("--throttle-rps", type=int, default=0, help="每个操作每秒允许的请求数，超出时返回限频错误（0 表示不限制）")
+    parser.add_argument("--no-memory", action="store_true", help="不统计内存峰值（tracemalloc 会降低吞吐）")
+    parser.add_argument("--consumer", action="store_true", help="同时测量结果存储写入和生成结果报告的耗时")
+    parser.add_argument("-o", "--output", help="结果输出文件，.csv 或 .json")
+    return parser.parse_args(argv)
+
+def write_results(results, output_file):
+    with open(output_file, 'w', encoding='utf-8', newline='') as f:
+        if output_file.endswith('.json'):
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        else:
+            writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+            writer.writeheader()
+            writer.writerows(results)
+
+def main(argv=None):
+    args = parse_args(argv)
+    output_file = os.path.abspath(args.output) if args.output else None
+    config = MockConfig(args.latency, args.jitter, args.error_rate, args.throttle_rate, args.throttle_rps)
+    server = start_mock_server(config)
+    network = NetworkTimer()
+    network.install()
+
+    # 任务日志和响应日志写入临时目录
+    work_dir = tempfile.mkdtemp(prefix="capi-bench-")
+    original_dir = os.getcwd()
+    os.chdir(work_dir)
+    results = []
+    try:
+        init_jobs_db()
+        print(f"模拟接口: {capi.CVM_URL}，并发 {args.workers}，批量模式 {'开' if args.batch else '关'}")
+        for action in args.actions:
+            for size in args.sizes:
+                result = run_benchmark(action, size, args.workers, args.batch, config, network, not args.no_memory, args.consumer)
+                print_result(result)
+                results.append(result)
+    finally:
+        os.chdir(original_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+        network.uninstall()
+        server.shutdown()
+
+    if output_file:
+        write_results(results, output_file)
+        print(f"结果已保存到 {output_file}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
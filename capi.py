@@ -0,0 +1,134 @@
+import re
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from executor import MAX_WORKERS_LIMIT
+from rate_limiter import call_with_limit, get_error_code
+from metrics import observe_request, track_in_flight, phase_timer
+from response_log import log_response
+
+# 每个主机的连接池大小，需不小于最大并发数，避免并发时反复新建连接
+POOL_MAXSIZE = MAX_WORKERS_LIMIT
+# 连接超时和读取超时（秒）
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+
+CVM_URL = 'https://workbench.cloud.tencent.com/cgi/capi'
+CBS_URL = 'https://capi.cloud.tencent.com/cgi/capi'
+
+# 从请求中提取cookie
+def extract_cookie(request_text):
+    # 尝试从 -H 'cookie: ...' 格式提取
+    match = re.search(r"-H 'cookie: ([^']*)'", request_text)
+    if match:
+        return match.group(1)
+    
+    # 尝试从 -b '...' 格式提取
+    match = re.search(r"-b '([^']*)'", request_text)
+    if match:
+        return match.group(1)
+    
+    return ''
+
+# 从请求中提取x-csrfcode
+def extract_csrfcode(request_text):
+    match = re.search(r"-H 'x-csrfcode: ([^']*)'", request_text)
+    return match.group(1) if match else ''
+
+# 构建请求头
+def build_headers(cookie, csrfcode):
+    return {
+        'accept': 'application/json, text/javascript, */*; q=0.01',
+        'accept-language': 'zh-CN,zh;q=0.9,en;q=0.8',
+        'cache-control': 'no-cache',
+        'content-type': 'application/json; charset=UTF-8',
+        'cookie': cookie,
+        'origin': 'https://console.cloud.tencent.com',
+        'pragma': 'no-cache',
+        'priority': 'u=1, i',
+        'referer': 'https://console.cloud.tencent.com/cvm/instance/index',
+        'sec-ch-ua': '"Google Chrome";v="131", "Chromium";v="131", "Not_A Brand";v="24"',
+        'sec-ch-ua-mobile': '?0',
+        'sec-ch-ua-platform': '"macOS"',
+        'sec-fetch-dest': 'empty',
+        'sec-fetch-mode': 'cors',
+        'sec-fetch-site': 'same-site',
+        'user-agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36',
+        'x-csrfcode': csrfcode,
+    }
+
+# 构造与接口响应格式一致的错误响应，便于统一解析
+def build_error_response(code, message):
+    return {
+        'code': code,
+        'message': message,
+        'data': {'Response': {'Error': {'Code': code, 'Message': message}}}
+    }
+
+# 复用连接的请求客户端，持有当前Cookie/CSRF对应的会话和请求头
+class CapiClient:
+    def __init__(self, cookie, csrfcode, pool_maxsize=POOL_MAXSIZE,
+                 connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT):
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        self.session.headers.update(build_headers(cookie, csrfcode))
+        # 两个主机（workbench 和 capi）各维护一个连接池；http 用于本地模拟接口（benchmark.py）
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_maxsize)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    # 根据是否指定region选择CVM或CBS接口地址
+    def build_url(self, action, uin, region=None):
+        if region:
+            return f'{CVM_URL}?i=cvm/{action}&uin={uin}&region={region}'
+        return f'{CBS_URL}?i=cbs/{action}&uin={uin}'
+
+    # cbs 接口的地域由请求体中的 regionId 指定，URL中不携带 region
+    def send(self, action, data, uin, region=None):
+        url = self.build_url(action, uin, region if data.get('serviceType') != 'cbs' else None)
+        try:
+            with phase_timer('network'):
+                response = self.session.post(url, json=data, timeout=self.timeout)
+        except requests.Timeout as e:
+            return build_error_response('ClientError.Timeout', f'请求超时: {e}')
+        except requests.RequestException as e:
+            return build_error_response('ClientError.NetworkError', f'网络请求失败: {e}')
+        try:
+            return response.json()
+        except ValueError:
+            return build_error_response('ClientError.InvalidResponse', f'无法解析响应 (HTTP {response.status_code})')
+
+    def close(self):
+        self.session.close()
+
+# 最多缓存的客户端数量（多个会话可能使用不同的Cookie）
+MAX_CACHED_CLIENTS = 8
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+# 获取当前Cookie/CSRF对应的客户端，超出缓存数量时淘汰最早创建的客户端
+def get_client(cookie, csrfcode):
+    key = (cookie, csrfcode)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            if len(_clients) >= MAX_CACHED_CLIENTS:
+                # 不主动关闭，仍在使用的请求结束后由垃圾回收释放连接
+                _clients.pop(next(iter(_clients)))
+            client = CapiClient(cookie, csrfcode)
+            _clients[key] = client
+        return client
+
+# 通用请求函数，按 action 和 region 自适应限流（cbs 接口同样按地域区分限流器），被限频时自动退避重试
+# 每次调用（含重试）在结构化响应日志中记录一行，resource_ids 和 job_id 仅用于日志
+def send_request(action, data, cookie, csrfcode, uin, region=None, resource_ids=None, job_id=None):
+    client = get_client(cookie, csrfcode)
+    start = time.monotonic()
+    with track_in_flight(action):
+        response_json = call_with_limit(action, region, lambda: client.send(action, data, uin, region))
+    latency = time.monotonic() - start
+    observe_request(action, latency, get_error_code(response_json))
+    log_response(action, region, resource_ids, job_id, latency, response_json)
+    return response_json
@@ -0,0 +1,414 @@
+import argparse
+import csv
+import json
+import sys
+from capi import extract_cookie, extract_csrfcode
+from database import init_db, init_jobs_db, init_inventory_db, verify_password, create_job, get_job, get_resumable_tasks, record_task_results, get_tracking_targets, TASK_SUCCESS
+from executor import DEFAULT_MAX_WORKERS, MAX_WORKERS_LIMIT
+from operations import split_by_region, run_sharded, count_resources, is_blank, REQUIRED_COLUMNS, REGION_COLUMN, RETRYABLE_PREFIXES
+from preflight import plan_operation, reconcile_unconfirmed
+from pipeline import run_pipeline, check_pipeline_regions, DEFAULT_STEPS, DEFAULT_REGION_LIMIT, DEFAULT_INSTANCE_LIMIT, STEP_FAILED, STEP_SKIPPED
+from tracker import track_completion, is_success_state, TRACKED_OPERATIONS, GIVE_UP_STATES
+from metrics import phase_timer, timed_iter, render_prometheus
+from planner import estimate_plan, estimate_pipeline, format_duration
+from scheduling import SIZED_ACTIONS, sizes_from_rows, resolve_disk_sizes, order_longest_first
+from inventory import refresh_resources, INVENTORY_TYPE_LABELS
+from ingest import read_upload, INVALID_REASON_COLUMN
+from sweep import sync_sweep_inventory, find_orphans, orphan_shards, bound_snapshot_ids, drop_bound_snapshots, SWEEP_ACTIONS, SWEEP_FIELDS, DEFAULT_MIN_AGE_DAYS
+
+# 命令行批量执行工具：不依赖 Streamlit，适合在定时任务和CI中运行大批量操作
+#
+# 示例：
+#   python cli.py stop -i instances.csv -o results.csv --request-file request.txt --uin 100038461096 --region ap-hongkong
+#   python cli.py delete-images -i image_ids.csv -o results.jsonl --request-file request.txt --password ******
+#   python cli.py resume --job-id 12 -o results.csv --request-file request.txt
+#   python cli.py create-images -i instances.csv -o results.csv --request-file request.txt --wait
+#   python cli.py track --job-id 13 --request-file request.txt
+#   python cli.py pipeline -i instances.csv -o pipeline.csv --request-file request.txt --steps stop,image,start
+#   python cli.py create-images -i instances.csv --dry-run --workers 16
+#   python cli.py sweep -o sweep.csv --request-file request.txt --region ap-hongkong,ap-singapore --min-age-days 30 --delete --password ******
+#
+# 输入文件可以包含可选的 region 列，不同地域的资源并行执行，每个地域一个任务ID；该列为空的行使用 --region
+# 创建镜像/快照和流水线按云硬盘容量从大到小发起，容量取自可选的 DiskSize 列、资源清单或查询接口
+
+# 子命令与操作的对应关系
+COMMANDS = {
+    "stop": "StopInstances",
+    "start": "StartInstances",
+    "create-images": "CreateImage",
+    "delete-images": "DeleteImages",
+    "create-snapshots": "CreateSnapshot",
+    "delete-snapshots": "DeleteSnapshots",
+}
+
+# 需要密码验证的操作
+DELETE_ACTIONS = ("DeleteImages", "DeleteSnapshots")
+
+RESULT_FIELDS = ["region", "job_id", "resource_id", "status", "error_code", "error_message", "request_id", "result_id", "time"]
+PIPELINE_FIELDS = ["region", "instance_id", "step", "resource_id", "status", "detail", "time"]
+
+# 各操作输入文件的类型（与界面上传文件相同，见 ingest.UPLOAD_COLUMNS）
+UPLOAD_TYPES = {
+    "StopInstances": "instance",
+    "StartInstances": "instance",
+    "CreateImage": "instance",
+    "DeleteImages": "image",
+    "CreateSnapshot": "disk",
+    "DeleteSnapshots": "snapshot",
+}
+
+# 跳过的行最多输出的条数
+INVALID_ROWS_SHOWN = 20
+
+# 读取并校验CSV文件（与界面上传相同：检查ID格式、去除重复行），返回 (字段列表, 合格的行列表)
+# 不合格的行输出到标准错误并跳过；缺少资源ID列时抛出 ValueError
+def read_rows(input_file, action):
+    with phase_timer("csv_parse"), open(input_file, 'rb') as f:
+        frame, invalid_rows, duplicates = read_upload(f.read(), UPLOAD_TYPES[action])
+    if duplicates:
+        print(f"{input_file}: 已去除 {duplicates} 行重复数据", file=sys.stderr)
+    if len(invalid_rows):
+        print(f"{input_file}: {len(invalid_rows)} 行ID格式错误或所属实例有格式错误的行，将被跳过", file=sys.stderr)
+        for row in invalid_rows.head(INVALID_ROWS_SHOWN).to_dict('records'):
+            reason = row.pop(INVALID_REASON_COLUMN)
+            values = ', '.join(f"{column}={value}" for column, value in row.items() if not is_blank(value))
+            print(f"  {values}: {reason}", file=sys.stderr)
+        if len(invalid_rows) > INVALID_ROWS_SHOWN:
+            print(f"  ……其余 {len(invalid_rows) - INVALID_ROWS_SHOWN} 行未列出", file=sys.stderr)
+    fieldnames = list(dict.fromkeys(list(frame.columns) + [column for column in invalid_rows.columns if column != INVALID_REASON_COLUMN]))
+    return fieldnames, frame.to_dict('records')
+
+# 逐条写出结果，输出文件以 .jsonl 结尾时写 JSON Lines，否则写 CSV
+class ResultWriter:
+    def __init__(self, output_file, fieldnames=RESULT_FIELDS):
+        self.file = open(output_file, 'w', encoding='utf-8', newline='')
+        self.jsonl = output_file.endswith('.jsonl')
+        if not self.jsonl:
+            self.writer = csv.DictWriter(self.file, fieldnames=fieldnames)
+            self.writer.writeheader()
+
+    def write(self, result):
+        if self.jsonl:
+            self.file.write(json.dumps(result, ensure_ascii=False) + '\n')
+        else:
+            self.writer.writerow(result)
+
+    def close(self):
+        self.file.close()
+
+# 从参数中获取Cookie和CSRF代码
+def load_credentials(args):
+    cookie = args.cookie or ''
+    csrfcode = args.csrfcode or ''
+    if args.request_file:
+        with open(args.request_file, 'r', encoding='utf-8') as f:
+            request_text = f.read()
+        cookie = cookie or extract_cookie(request_text)
+        csrfcode = csrfcode or extract_csrfcode(request_text)
+    return cookie, csrfcode
+
+# 等待任务创建的镜像/快照全部进入最终状态，返回创建失败的数量（包括超时和查询连续失败、放弃等待的资源）
+def wait_for_completion(action, job_id, cookie, csrfcode, uin, region, workers, timeout=None):
+    targets = get_tracking_targets(job_id)
+    if not targets:
+        print("没有需要等待完成的资源")
+        return 0
+    print(f"等待 {len(targets)} 个资源创建完成...")
+    failed = 0
+    gave_up = 0
+    for poll in track_completion(action, targets, cookie, csrfcode, uin, region, job_id, workers, timeout=timeout):
+        for resource_id, source_id, state, final in poll['changes']:
+            print(f"  {resource_id}（{source_id}）: {state}")
+            if final and not is_success_state(action, state):
+                failed += 1
+                gave_up += 1 if state in GIVE_UP_STATES else 0
+        print(f"剩余 {poll['pending']} 个，累计查询请求 {poll['calls']} 次")
+    if gave_up:
+        print(f"{gave_up} 个资源超时或查询连续失败，已停止等待，可以之后使用 track --job-id {job_id} 继续跟踪", file=sys.stderr)
+    return failed
+
+# 执行迁移流水线，逐条写出步骤状态变化，返回失败或跳过的步骤数
+def run_pipeline_command(args, shards, cookie, csrfcode, disk_sizes):
+    steps = [step for step in DEFAULT_STEPS if step in args.steps.split(',')]
+    try:
+        check_pipeline_regions(shards, steps)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    failed = 0
+    writer = ResultWriter(args.output, PIPELINE_FIELDS)
+    try:
+        for event in run_pipeline(shards, cookie, csrfcode, args.uin, steps, args.workers, args.region_limit,
+                                  disk_sizes=disk_sizes, instance_limit=args.instance_limit):
+            writer.write(event)
+            print(f"{event['time']} [{event['region']}] {event['instance_id']} {event['step']} {event['resource_id']}: {event['status']} {event['detail']}")
+            if event['status'] in (STEP_FAILED, STEP_SKIPPED):
+                failed += 1
+    finally:
+        writer.close()
+    print(f"迁移流水线: {len(shards)} 个地域 {count_resources(shards)} 台实例，失败或跳过 {failed} 个步骤，结果已保存到 {args.output}")
+    return failed
+
+# 清理遗留的镜像和快照：同步资源清单，输出报告；指定 --delete 时批量合并删除未被引用的资源
+# 返回删除失败的数量，删除结果写入报告的 delete_status / delete_error 列
+def run_sweep_command(args):
+    if args.delete and not args.dry_run and not verify_password(args.password):
+        print("密码错误，无法执行删除操作。", file=sys.stderr)
+        return 2
+    cookie, csrfcode = load_credentials(args)
+    if not cookie or not csrfcode:
+        print("未获取到Cookie或CSRF代码，请通过 --request-file 或 --cookie/--csrfcode 提供", file=sys.stderr)
+        return 2
+
+    init_inventory_db()
+    resource_types = [resource_type for resource_type in SWEEP_ACTIONS if resource_type in args.sweep_types.split(',')]
+    regions = [item.strip() for item in args.region.split(',') if item.strip()]
+    rows = []
+    for region in regions:
+        try:
+            sync_sweep_inventory(cookie, csrfcode, args.uin, region, args.force_sync, args.workers)
+        except RuntimeError as e:
+            print(f"[{region}] {e}", file=sys.stderr)
+            return 2
+        rows.extend(find_orphans(region, args.min_age_days, resource_types))
+    for resource_type in resource_types:
+        candidates = [row for row in rows if row['type'] == resource_type]
+        orphans = [row for row in candidates if not row['keep_reason']]
+        print(f"{INVENTORY_TYPE_LABELS[resource_type]}: 工具创建且超过 {args.min_age_days:g} 天 {len(candidates)} 个，"
+              f"未被引用 {len(orphans)} 个，共 {sum(row['size_gb'] or 0 for row in orphans)} GB")
+
+    # 先删除镜像，再删除快照；随镜像一并删除的快照不再单独删除
+    results = {}
+    failed = 0
+    bound_ids = set()
+    if args.delete:
+        for resource_type in resource_types:
+            action = SWEEP_ACTIONS[resource_type]
+            candidates = orphan_shards(rows, resource_type)
+            shards, dropped = drop_bound_snapshots(candidates, bound_ids) if resource_type == "snapshot" else (candidates, [])
+            for snapshot_id in dropped:
+                results[snapshot_id] = {"status": "成功", "error_message": "已随镜像删除"}
+            if not candidates:
+                continue
+            if args.dry_run:
+                print_plan(estimate_plan(action, shards, args.workers, True))
+                continue
+            deleted = {}
+            for result, response_json in run_sharded(action, shards, cookie, csrfcode, args.uin, args.workers, True):
+                results[result['resource_id']] = result
+                failed += 1 if result['status'] != "成功" else 0
+                if result['status'] == "成功":
+                    deleted.setdefault(result['region'], []).append(result['resource_id'])
+            if resource_type == "image":
+                bound_ids = bound_snapshot_ids(deleted)
+            # 删除后刷新资源清单（包括随镜像删除的快照），已删除的资源从缓存中移除
+            for region, resources in candidates.items():
+                try:
+                    refresh_resources(resource_type, [resource_id for resource_id, payload in resources], cookie, csrfcode, args.uin, region, args.workers)
+                except RuntimeError as e:
+                    print(f"[{region}] 刷新资源清单失败: {e}", file=sys.stderr)
+        if not args.dry_run:
+            print(f"删除 {len(results)} 个，失败 {failed} 个")
+
+    if args.output:
+        writer = ResultWriter(args.output, SWEEP_FIELDS + ["delete_status", "delete_error"])
+        try:
+            for row in rows:
+                result = results.get(row['resource_id'])
+                writer.write(dict(row, delete_status=result['status'] if result else '', delete_error=result['error_message'] if result else ''))
+        finally:
+            writer.close()
+        print(f"清理报告已保存到 {args.output}")
+    return 1 if failed else 0
+
+# 输出请求计划和耗时估算
+def print_plan(plan, label=None):
+    print(f"{label or plan['action']}: {plan['resources']} 个资源，请求 {plan['calls']} 次（预计含重试 {plan['expected_requests']} 次），"
+          f"并发 {plan['max_workers']}，预计耗时 {format_duration(plan['seconds_low'])} ~ {format_duration(plan['seconds_high'])}")
+    for item in plan['regions']:
+        print(f"  [{item['region']}] {item['resources']} 个资源，每批 {item['batch_size']} 个，请求 {item['calls']} 次，"
+              f"耗时 p50/p90 {item['latency_p50'] * 1000:.0f}/{item['latency_p90'] * 1000:.0f} ms，限频 {item['throttle_rate']:.1%}，"
+              f"配额约 {item['quota_rps']:.1f} 次/秒，建议并发 {item['suggested_workers']}，"
+              f"预计 {format_duration(item['seconds_low'])} ~ {format_duration(item['seconds_high'])}"
+              f"（依据: {item['source']}，{item['history_requests']} 条记录）")
+
+# 只生成请求计划并估算耗时，不发送任何操作请求
+def run_dry_run(args, action, shards):
+    if args.command == "pipeline":
+        steps = [step for step in DEFAULT_STEPS if step in args.steps.split(',')]
+        plans = estimate_pipeline(shards, steps, args.workers)
+        for plan in plans:
+            print_plan(plan, plan['step'])
+        total = sum(plan['seconds_high'] for plan in plans)
+        print(f"迁移流水线: 请求 {sum(plan['calls'] for plan in plans)} 次，各步骤依次执行最长约 {format_duration(total)}（不含等待资源就绪）")
+    else:
+        print_plan(estimate_plan(action, shards, args.workers, args.batch))
+    return 0
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="腾讯云批量操作命令行工具")
+    parser.add_argument("command", choices=list(COMMANDS) + ["resume", "track", "pipeline", "sweep"],
+                        help="要执行的操作，resume 表示继续执行已有任务，track 表示等待已有任务创建的镜像/快照完成，"
+                             "pipeline 表示按实例执行关机、快照、创建镜像、开机的迁移流水线，sweep 表示清理工具创建的遗留镜像和快照")
+    parser.add_argument("-i", "--input", help="输入CSV文件（字段要求与界面上传的文件一致）")
+    parser.add_argument("-o", "--output", help="结果输出文件，.csv 或 .jsonl（track 不需要）")
+    parser.add_argument("--job-id", type=int, help="resume 时要继续执行的任务ID")
+    parser.add_argument("--request-file", help="包含完整请求信息（curl）的文件，用于提取Cookie和CSRF代码")
+    parser.add_argument("--cookie", help="Cookie，优先于 --request-file")
+    parser.add_argument("--csrfcode", help="CSRF代码，优先于 --request-file")
+    parser.add_argument("--uin", default="100038461096", help="UIN")
+    parser.add_argument("--region", default="ap-hongkong", help=f"默认地域，输入文件中 {REGION_COLUMN} 列为空时使用；sweep 可以用逗号分隔多个地域")
+    parser.add_argument("--workers", type=int, default=DEFAULT_MAX_WORKERS, help=f"并发请求数（1-{MAX_WORKERS_LIMIT}）")
+    parser.add_argument("--batch", action="store_true", help="合并请求，单次请求携带多个ID")
+    parser.add_argument("--password", default="", help="删除操作需要的密码")
+    parser.add_argument("--preflight", action="store_true", help="执行前预检，跳过已处于目标状态或已不存在的资源")
+    parser.add_argument("--wait", action="store_true", help="创建镜像/快照后等待新资源全部创建完成")
+    parser.add_argument("--wait-timeout", type=int, help="--wait 和 track 每个资源等待完成的最长时间（秒），默认 7200")
+    parser.add_argument("--steps", default=",".join(DEFAULT_STEPS), help="pipeline 执行的步骤（stop,snapshot,image,start）")
+    parser.add_argument("--region-limit", type=int, default=DEFAULT_REGION_LIMIT, help="pipeline 每个地域同时进行中的步骤数")
+    parser.add_argument("--instance-limit", type=int, default=DEFAULT_INSTANCE_LIMIT, help="pipeline 每台实例同时进行中的快照和创建镜像步骤数（0 不限制）")
+    parser.add_argument("--min-age-days", type=float, default=DEFAULT_MIN_AGE_DAYS, help="sweep 只清理创建超过该天数的资源")
+    parser.add_argument("--sweep-types", default=",".join(SWEEP_ACTIONS), help="sweep 清理的资源类型（image,snapshot）")
+    parser.add_argument("--delete", action="store_true", help="sweep 删除未被引用的资源（需要 --password），不指定时只输出报告")
+    parser.add_argument("--force-sync", action="store_true", help="sweep 忽略资源清单缓存有效期，重新同步")
+    parser.add_argument("--metrics", help="结束后（任何子命令）把运行指标以 Prometheus 文本格式写入该文件")
+    parser.add_argument("--dry-run", action="store_true", help="只输出按地域的请求计划和根据历史耗时估算的总耗时，不发送操作请求")
+    args = parser.parse_args(argv)
+    if args.command == "track" and args.dry_run:
+        parser.error("track 不支持 --dry-run")
+    if args.command in ("resume", "track") and args.job_id is None:
+        parser.error(f"{args.command} 需要指定 --job-id")
+    if args.command not in ("resume", "track", "sweep") and not args.input:
+        parser.error("需要指定输入文件 --input")
+    if args.command != "track" and not args.dry_run and not args.output:
+        parser.error("需要指定输出文件 --output")
+    args.workers = max(1, min(MAX_WORKERS_LIMIT, args.workers))
+    return args
+
+# 把运行指标以 Prometheus 文本格式写入文件
+def write_metrics(metrics_file):
+    with open(metrics_file, 'w', encoding='utf-8') as f:
+        f.write(render_prometheus())
+    print(f"运行指标已保存到 {metrics_file}")
+
+# 所有子命令（包括 pipeline、track、sweep 和 --dry-run）结束时都写出运行指标，出错时也会写出
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        return run_command(args)
+    finally:
+        if args.metrics:
+            write_metrics(args.metrics)
+
+def run_command(args):
+    init_db()
+    init_jobs_db()
+    if args.command == "sweep":
+        return run_sweep_command(args)
+
+    # 按地域拆分的资源 {地域: 资源列表}，以及各地域的任务ID
+    job_ids = {}
+    rows = []
+    if args.command in ("resume", "track"):
+        job = get_job(args.job_id)
+        if job is None:
+            print(f"任务 {args.job_id} 不存在", file=sys.stderr)
+            return 2
+        action = job['action']
+        region = job['region'] or args.region
+        job_ids[region] = job['job_id']
+        shards = {region: get_resumable_tasks(job['job_id'], RETRYABLE_PREFIXES[action]) if args.command == "resume" else []}
+    else:
+        # 迁移流水线的输入与创建镜像相同
+        action = COMMANDS.get(args.command, "CreateImage")
+        try:
+            fieldnames, rows = read_rows(args.input, action)
+        except ValueError as e:
+            print(f"{args.input}: {e}", file=sys.stderr)
+            return 2
+        missing = [column for column in REQUIRED_COLUMNS[action] if column not in fieldnames]
+        if missing:
+            print(f"输入文件缺少字段: {', '.join(missing)}", file=sys.stderr)
+            return 2
+        shards = split_by_region(action, rows, args.region)
+
+    if args.command == "track" and action not in TRACKED_OPERATIONS:
+        print(f"任务 {args.job_id} 的操作 {action} 不需要等待完成", file=sys.stderr)
+        return 2
+
+    # 不需要预检时，dry-run 不发送任何请求，也不需要密码和Cookie
+    if args.dry_run and (not args.preflight or args.command == "pipeline"):
+        return run_dry_run(args, action, shards)
+
+    if action in DELETE_ACTIONS and not verify_password(args.password):
+        print("密码错误，无法执行删除操作。", file=sys.stderr)
+        return 2
+
+    cookie, csrfcode = load_credentials(args)
+    if not cookie or not csrfcode:
+        print("未获取到Cookie或CSRF代码，请通过 --request-file 或 --cookie/--csrfcode 提供", file=sys.stderr)
+        return 2
+
+    # 继续执行创建类任务前，先按名称核对发送中或因网络错误失败的资源是否已经创建
+    if args.command == "resume":
+        counts = reconcile_unconfirmed(job_ids[region], action, cookie, csrfcode, args.uin, region, args.workers)
+        if any(counts.values()):
+            print(f"核对未确认的资源: 已创建 {counts['confirmed']} 个，未创建将重新发送 {counts['pending']} 个，"
+                  f"查询失败暂不执行 {counts['unknown']} 个")
+        shards[region] = get_resumable_tasks(job_ids[region], RETRYABLE_PREFIXES[action])
+
+    if args.command == "track":
+        return 1 if wait_for_completion(action, job_ids[region], cookie, csrfcode, args.uin, region, args.workers, args.wait_timeout) else 0
+    if args.command == "pipeline":
+        disk_sizes = resolve_disk_sizes(action, shards, sizes_from_rows(action, rows), cookie, csrfcode, args.uin, args.workers)
+        return 1 if run_pipeline_command(args, shards, cookie, csrfcode, disk_sizes) else 0
+
+    if args.preflight:
+        for region, resources in shards.items():
+            plan = plan_operation(action, resources, cookie, csrfcode, args.uin, region, args.workers, args.batch)
+            print(f"预检 [{region}]: 跳过 {len(plan['skipped'])} 个，执行 {len(plan['resources'])} 个（{plan['unknown']} 个无法确认状态），"
+                  f"查询请求 {plan['describe_calls']} 次，预计操作请求 {plan['planned_calls']} 次")
+            for resource_id, reason in plan['skipped']:
+                print(f"  跳过 {resource_id}: {reason}")
+            shards[region] = plan['resources']
+            # 继续执行已有任务时，被跳过的资源在任务日志中标记为成功，不再出现在可继续列表中
+            if region in job_ids:
+                record_task_results(job_ids[region], [(resource_id, TASK_SUCCESS, '', reason, '', '') for resource_id, reason in plan['skipped']])
+
+    if args.dry_run:
+        return run_dry_run(args, action, shards)
+
+    # 创建镜像/快照按云硬盘容量从大到小发起
+    if action in SIZED_ACTIONS:
+        disk_sizes = resolve_disk_sizes(action, shards, sizes_from_rows(action, rows), cookie, csrfcode, args.uin, args.workers)
+        shards = order_longest_first(action, shards, disk_sizes)
+
+    for region, resources in shards.items():
+        if region not in job_ids:
+            job_ids[region] = create_job(action, region, resources)
+        print(f"[{region}] 任务ID: {job_ids[region]}（中断后可使用 resume --job-id {job_ids[region]} 继续执行）")
+
+    success_count = 0
+    fail_count = 0
+    writer = ResultWriter(args.output)
+    try:
+        results = run_sharded(action, shards, cookie, csrfcode, args.uin, args.workers, args.batch, job_ids)
+        for result, response_json in timed_iter(results, "export"):
+            writer.write(result)
+            if result['status'] == "成功":
+                success_count += 1
+            else:
+                fail_count += 1
+    finally:
+        writer.close()
+
+    print(f"{action}: 总计 {count_resources(shards)}，成功 {success_count}，失败 {fail_count}，结果已保存到 {args.output}")
+    if args.wait and action in TRACKED_OPERATIONS:
+        for region, job_id in job_ids.items():
+            create_failed = wait_for_completion(action, job_id, cookie, csrfcode, args.uin, region, args.workers, args.wait_timeout)
+            print(f"[{region}] 创建完成，失败 {create_failed} 个（任务 {job_id}）")
+            fail_count += create_failed
+    return 1 if fail_count else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
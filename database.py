@@ -1,4 +1,8 @@
 import sqlite3
+import json
+import threading
+import time
+from datetime import datetime
 
 # 初始化数据库并创建表
 def init_db():
@@ -21,4 +25,423 @@ def verify_password(input_password):
     cursor.execute('SELECT * FROM users WHERE username=? AND password=?', ('admin', input_password))
     result = cursor.fetchone() is not None
     conn.close()
-    return result 
\ No newline at end of file
+    return result 
+
+# 任务日志数据库，记录每个批量操作及其中每个资源的执行状态
+JOBS_DB = 'jobs.db'
+
+# 任务状态
+TASK_PENDING = 'pending'
+TASK_SUCCESS = 'success'
+TASK_FAILED = 'failed'
+# 创建类操作的请求发送前标记为发送中；收到响应后更新为成功或失败
+# 中断后仍为发送中的资源可能已经创建，继续执行前需要先按名称查询核对
+TASK_SENDING = 'sending'
+# 流水线中因依赖的步骤失败或取消而未执行的资源；不再继续执行，避免单独继续时打乱步骤顺序
+TASK_SKIPPED = 'skipped'
+
+# 打开任务日志数据库（WAL模式，允许读写并发）
+def connect_jobs_db():
+    conn = sqlite3.connect(JOBS_DB, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+# 初始化任务日志表
+def init_jobs_db():
+    conn = connect_jobs_db()
+    conn.executescript('''
+    CREATE TABLE IF NOT EXISTS jobs (
+        job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        action TEXT NOT NULL,
+        region TEXT,
+        created_at TEXT NOT NULL,
+        finished_at TEXT
+    );
+    CREATE TABLE IF NOT EXISTS tasks (
+        job_id INTEGER NOT NULL,
+        resource_id TEXT NOT NULL,
+        payload TEXT,
+        status TEXT NOT NULL,
+        error_code TEXT,
+        error_message TEXT,
+        request_id TEXT,
+        result_id TEXT,
+        updated_at TEXT,
+        PRIMARY KEY (job_id, resource_id)
+    );
+    CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (job_id, status);
+    CREATE TABLE IF NOT EXISTS completions (
+        job_id INTEGER NOT NULL,
+        resource_id TEXT NOT NULL,
+        source_id TEXT,
+        state TEXT,
+        final INTEGER NOT NULL DEFAULT 0,
+        updated_at TEXT,
+        PRIMARY KEY (job_id, resource_id)
+    );
+    ''')
+    conn.commit()
+    conn.close()
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+# 创建任务，并为每个资源插入一条待执行记录；payload 为重新执行时所需的参数（JSON）
+def create_job(action, region, resources):
+    conn = connect_jobs_db()
+    now = _now()
+    cursor = conn.execute('INSERT INTO jobs (action, region, created_at) VALUES (?, ?, ?)', (action, region, now))
+    job_id = cursor.lastrowid
+    conn.executemany(
+        'INSERT OR IGNORE INTO tasks (job_id, resource_id, payload, status, updated_at) VALUES (?, ?, ?, ?, ?)',
+        [(job_id, resource_id, json.dumps(payload, ensure_ascii=False) if payload is not None else None, TASK_PENDING, now)
+         for resource_id, payload in resources]
+    )
+    conn.commit()
+    conn.close()
+    return job_id
+
+# 批量写入资源执行结果，rows 为 (resource_id, status, error_code, error_message, request_id, result_id)
+def record_task_results(job_id, rows):
+    if not rows:
+        return
+    conn = connect_jobs_db()
+    now = _now()
+    conn.executemany(
+        'UPDATE tasks SET status=?, error_code=?, error_message=?, request_id=?, result_id=?, updated_at=? '
+        'WHERE job_id=? AND resource_id=?',
+        [(status, error_code, error_message, request_id, result_id, now, job_id, resource_id)
+         for resource_id, status, error_code, error_message, request_id, result_id in rows]
+    )
+    conn.commit()
+    conn.close()
+
+# 发送请求前把资源标记为发送中（立即写入）
+def mark_tasks_sending(job_id, resource_ids):
+    conn = connect_jobs_db()
+    now = _now()
+    conn.executemany(
+        'UPDATE tasks SET status=?, updated_at=? WHERE job_id=? AND resource_id=?',
+        [(TASK_SENDING, now, job_id, resource_id) for resource_id in resource_ids]
+    )
+    conn.commit()
+    conn.close()
+
+# 获取未确认是否已执行的资源：发送中，或失败且错误码以 ambiguous_prefixes 开头（请求可能已被处理）
+# 返回 [(资源ID, 参数, 最后更新时间)]
+def get_unconfirmed_tasks(job_id, ambiguous_prefixes=()):
+    like_clauses = ''.join([' OR (status = ? AND error_code LIKE ?)'] * len(ambiguous_prefixes))
+    params = [job_id, TASK_SENDING]
+    for prefix in ambiguous_prefixes:
+        params += [TASK_FAILED, prefix + '%']
+    conn = connect_jobs_db()
+    rows = conn.execute(
+        f'SELECT resource_id, payload, updated_at FROM tasks WHERE job_id=? AND (status=?{like_clauses}) ORDER BY rowid',
+        params
+    ).fetchall()
+    conn.close()
+    return [(resource_id, json.loads(payload) if payload else None, updated_at) for resource_id, payload, updated_at in rows]
+
+# 标记任务执行结束
+def finish_job(job_id):
+    conn = connect_jobs_db()
+    conn.execute('UPDATE jobs SET finished_at=? WHERE job_id=?', (_now(), job_id))
+    conn.commit()
+    conn.close()
+
+# 获取任务信息
+def get_job(job_id):
+    conn = connect_jobs_db()
+    conn.row_factory = sqlite3.Row
+    row = conn.execute('SELECT * FROM jobs WHERE job_id=?', (job_id,)).fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+# 获取任务中所有资源的执行记录（按原始顺序）
+def get_job_tasks(job_id):
+    conn = connect_jobs_db()
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute(
+        'SELECT resource_id, status, error_code, error_message, request_id, result_id, updated_at '
+        'FROM tasks WHERE job_id=? ORDER BY rowid',
+        (job_id,)
+    ).fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+# 构造"可继续执行"的筛选条件：待执行，或失败且错误码以可重试前缀开头
+def _resumable_condition(retryable_prefixes):
+    like_clauses = ' OR '.join(['t.error_code LIKE ?'] * len(retryable_prefixes)) or '0'
+    condition = f"(t.status = ? OR (t.status = ? AND ({like_clauses})))"
+    params = [TASK_PENDING, TASK_FAILED] + [prefix + '%' for prefix in retryable_prefixes]
+    return condition, params
+
+# 列出仍有可继续执行或未确认资源的任务（按创建时间倒序）
+# retryable_prefixes 为 {操作: 可重发的错误码前缀}，ambiguous_prefixes 为 {操作: 未确认是否已执行的失败错误码前缀}
+def list_resumable_jobs(retryable_prefixes, ambiguous_prefixes=None, limit=20):
+    clauses = []
+    params = []
+    for action, prefixes in retryable_prefixes.items():
+        condition, condition_params = _resumable_condition(prefixes)
+        clauses.append(f"(j.action = ? AND {condition})")
+        params += [action] + condition_params
+    unconfirmed_clauses = ['t.status = ?']
+    params.append(TASK_SENDING)
+    for action, prefixes in (ambiguous_prefixes or {}).items():
+        for prefix in prefixes:
+            unconfirmed_clauses.append('(j.action = ? AND t.status = ? AND t.error_code LIKE ?)')
+            params += [action, TASK_FAILED, prefix + '%']
+    conn = connect_jobs_db()
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute(f'''
+    SELECT j.job_id, j.action, j.region, j.created_at, j.finished_at,
+           SUM({' OR '.join(clauses) or '0'}) AS resumable_count,
+           SUM({' OR '.join(unconfirmed_clauses)}) AS unconfirmed_count,
+           COUNT(*) AS total_count
+    FROM jobs j JOIN tasks t ON t.job_id = j.job_id
+    GROUP BY j.job_id
+    HAVING resumable_count > 0 OR unconfirmed_count > 0
+    ORDER BY j.job_id DESC
+    LIMIT ?
+    ''', params + [limit]).fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+# 获取可继续执行的资源及其参数（按原始顺序）
+def get_resumable_tasks(job_id, retryable_prefixes):
+    condition, params = _resumable_condition(retryable_prefixes)
+    conn = connect_jobs_db()
+    rows = conn.execute(
+        f'SELECT t.resource_id, t.payload FROM tasks t WHERE t.job_id = ? AND {condition} ORDER BY t.rowid',
+        [job_id] + params
+    ).fetchall()
+    conn.close()
+    return [(resource_id, json.loads(payload) if payload else None) for resource_id, payload in rows]
+
+# 写入创建类任务产生的新资源（镜像/快照）的最新状态，rows 为 (resource_id, source_id, state, final)
+def record_completions(job_id, rows):
+    if not rows:
+        return
+    conn = connect_jobs_db()
+    now = _now()
+    conn.executemany(
+        'INSERT INTO completions (job_id, resource_id, source_id, state, final, updated_at) VALUES (?, ?, ?, ?, ?, ?) '
+        'ON CONFLICT(job_id, resource_id) DO UPDATE SET state=excluded.state, final=excluded.final, updated_at=excluded.updated_at',
+        [(job_id, resource_id, source_id, state, 1 if final else 0, now) for resource_id, source_id, state, final in rows]
+    )
+    conn.commit()
+    conn.close()
+
+# 获取创建成功但尚未确认最终状态的新资源，返回 {新资源ID: 源资源ID}
+def get_tracking_targets(job_id):
+    conn = connect_jobs_db()
+    rows = conn.execute(
+        'SELECT t.result_id, t.resource_id FROM tasks t '
+        'LEFT JOIN completions c ON c.job_id = t.job_id AND c.resource_id = t.result_id '
+        "WHERE t.job_id = ? AND t.status = ? AND t.result_id != '' AND COALESCE(c.final, 0) = 0 ORDER BY t.rowid",
+        (job_id, TASK_SUCCESS)
+    ).fetchall()
+    conn.close()
+    return dict(rows)
+
+# 按批写入结果的任务日志，避免每个资源单独提交一次事务
+# 缓冲区达到 flush_size 条或距上次写入超过 flush_interval 秒时写入数据库
+# 结果在各工作线程收到响应时写入，通过锁保证线程安全
+class JobJournal:
+    def __init__(self, job_id, flush_size=100, flush_interval=1.0):
+        self.job_id = job_id
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.flushed_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    # 发送前标记为发送中，不经过缓冲区
+    def mark_sending(self, resource_ids):
+        mark_tasks_sending(self.job_id, resource_ids)
+
+    def record(self, resource_id, status, error_code='', error_message='', request_id='', result_id=''):
+        with self.lock:
+            self.buffer.append((resource_id, status, error_code, error_message, request_id, result_id))
+            if len(self.buffer) >= self.flush_size or time.monotonic() - self.flushed_at >= self.flush_interval:
+                self._flush()
+
+    def _flush(self):
+        record_task_results(self.job_id, self.buffer)
+        self.buffer = []
+        self.flushed_at = time.monotonic()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        self.flush()
+        finish_job(self.job_id)
+
+
+# 资源清单缓存数据库，保存实例、云硬盘、镜像和快照的本地副本
+INVENTORY_DB = 'inventory.db'
+
+# 打开资源清单数据库（WAL模式）
+def connect_inventory_db():
+    conn = sqlite3.connect(INVENTORY_DB, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+# 初始化资源清单表
+def init_inventory_db():
+    conn = connect_inventory_db()
+    conn.executescript('''
+    CREATE TABLE IF NOT EXISTS resources (
+        resource_type TEXT NOT NULL,
+        resource_id TEXT NOT NULL,
+        region TEXT NOT NULL,
+        name TEXT,
+        state TEXT,
+        parent_id TEXT,
+        usage TEXT,
+        size_gb INTEGER,
+        created_time TEXT,
+        data TEXT,
+        hash TEXT,
+        synced_at REAL NOT NULL,
+        PRIMARY KEY (resource_type, resource_id)
+    );
+    CREATE INDEX IF NOT EXISTS idx_resources_region_state ON resources (resource_type, region, state);
+    CREATE INDEX IF NOT EXISTS idx_resources_name ON resources (resource_type, name);
+    CREATE INDEX IF NOT EXISTS idx_resources_parent ON resources (resource_type, parent_id);
+    CREATE TABLE IF NOT EXISTS resource_tags (
+        resource_type TEXT NOT NULL,
+        resource_id TEXT NOT NULL,
+        tag_key TEXT NOT NULL,
+        tag_value TEXT,
+        PRIMARY KEY (resource_type, resource_id, tag_key)
+    );
+    CREATE INDEX IF NOT EXISTS idx_resource_tags ON resource_tags (resource_type, tag_key, tag_value);
+    CREATE TABLE IF NOT EXISTS sync_state (
+        resource_type TEXT NOT NULL,
+        region TEXT NOT NULL,
+        synced_at REAL NOT NULL,
+        PRIMARY KEY (resource_type, region)
+    );
+    ''')
+    conn.commit()
+    conn.close()
+
+# 获取某类资源在某个地域的上次全量同步时间（时间戳），从未同步时返回 None
+def get_sync_time(resource_type, region):
+    conn = connect_inventory_db()
+    row = conn.execute('SELECT synced_at FROM sync_state WHERE resource_type=? AND region=?', (resource_type, region)).fetchone()
+    conn.close()
+    return row[0] if row else None
+
+# 写入资源记录，只更新内容有变化的行
+# records 为字典列表，字段见 resources 表，tags 为 [(key, value)]
+# full_sync 为 True 时删除本次未出现的资源并记录同步时间；removed_ids 为确认已不存在的资源
+def upsert_inventory(resource_type, region, records, synced_at, full_sync=False, removed_ids=()):
+    conn = connect_inventory_db()
+    existing = dict(conn.execute(
+        'SELECT resource_id, hash FROM resources WHERE resource_type=? AND region=?', (resource_type, region)
+    ).fetchall())
+    changed = [record for record in records if existing.get(record['resource_id']) != record['hash']]
+    conn.executemany('''
+    INSERT INTO resources (resource_type, resource_id, region, name, state, parent_id, usage, size_gb, created_time, data, hash, synced_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (resource_type, resource_id) DO UPDATE SET
+        region=excluded.region, name=excluded.name, state=excluded.state, parent_id=excluded.parent_id,
+        usage=excluded.usage, size_gb=excluded.size_gb, created_time=excluded.created_time,
+        data=excluded.data, hash=excluded.hash, synced_at=excluded.synced_at
+    ''', [(resource_type, r['resource_id'], region, r['name'], r['state'], r['parent_id'], r['usage'],
+           r['size_gb'], r['created_time'], r['data'], r['hash'], synced_at) for r in changed])
+    conn.executemany('DELETE FROM resource_tags WHERE resource_type=? AND resource_id=?',
+                     [(resource_type, r['resource_id']) for r in changed])
+    conn.executemany('INSERT OR REPLACE INTO resource_tags (resource_type, resource_id, tag_key, tag_value) VALUES (?, ?, ?, ?)',
+                     [(resource_type, r['resource_id'], key, value) for r in changed for key, value in r['tags']])
+
+    removed = set(removed_ids)
+    if full_sync:
+        removed.update(set(existing) - {record['resource_id'] for record in records})
+    conn.executemany('DELETE FROM resources WHERE resource_type=? AND resource_id=?', [(resource_type, rid) for rid in removed])
+    conn.executemany('DELETE FROM resource_tags WHERE resource_type=? AND resource_id=?', [(resource_type, rid) for rid in removed])
+    if full_sync:
+        conn.execute('INSERT OR REPLACE INTO sync_state (resource_type, region, synced_at) VALUES (?, ?, ?)',
+                     (resource_type, region, synced_at))
+    conn.commit()
+    conn.close()
+    return len(changed), len(removed)
+
+# 按条件查询资源清单，name 为名称包含的关键字，tag_value 为空时只匹配标签键
+def query_inventory(resource_type, region=None, name=None, state=None, tag_key=None, tag_value=None, limit=None):
+    sql = ('SELECT resource_id, region, name, state, parent_id, usage, size_gb, created_time FROM resources r '
+           'WHERE resource_type = ?')
+    params = [resource_type]
+    if region:
+        sql += ' AND region = ?'
+        params.append(region)
+    if state:
+        sql += ' AND state = ?'
+        params.append(state)
+    if name:
+        sql += ' AND name LIKE ?'
+        params.append(f'%{name}%')
+    if tag_key:
+        sql += ' AND EXISTS (SELECT 1 FROM resource_tags t WHERE t.resource_type = r.resource_type AND t.resource_id = r.resource_id AND t.tag_key = ?'
+        params.append(tag_key)
+        if tag_value:
+            sql += ' AND t.tag_value = ?'
+            params.append(tag_value)
+        sql += ')'
+    sql += ' ORDER BY resource_id'
+    if limit:
+        sql += ' LIMIT ?'
+        params.append(limit)
+    conn = connect_inventory_db()
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute(sql, params).fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+# 获取某类资源在某个地域缓存的原始数据，返回 {资源ID: 接口返回的资源字典}
+def get_inventory_data(resource_type, region):
+    conn = connect_inventory_db()
+    rows = conn.execute('SELECT resource_id, data FROM resources WHERE resource_type = ? AND region = ?',
+                        (resource_type, region)).fetchall()
+    conn.close()
+    return {resource_id: json.loads(data) for resource_id, data in rows if data}
+
+# 获取实例挂载的数据盘，返回 {实例ID: [云硬盘ID]}
+def get_attached_data_disks(instance_ids):
+    instance_ids = list(instance_ids)
+    attached = {instance_id: [] for instance_id in instance_ids}
+    conn = connect_inventory_db()
+    for start in range(0, len(instance_ids), 500):
+        chunk = instance_ids[start:start + 500]
+        rows = conn.execute(
+            f"SELECT parent_id, resource_id FROM resources WHERE resource_type='disk' AND usage='DATA_DISK' "
+            f"AND parent_id IN ({','.join('?' * len(chunk))}) ORDER BY resource_id",
+            chunk
+        ).fetchall()
+        for instance_id, disk_id in rows:
+            attached[instance_id].append(disk_id)
+    conn.close()
+    return attached
+
+# 按ID获取资源记录，返回 {资源ID: 记录}
+def get_inventory_by_ids(resource_type, resource_ids):
+    resource_ids = list(resource_ids)
+    records = {}
+    conn = connect_inventory_db()
+    conn.row_factory = sqlite3.Row
+    for start in range(0, len(resource_ids), 500):
+        chunk = resource_ids[start:start + 500]
+        rows = conn.execute(
+            f"SELECT resource_id, region, name, state, parent_id, usage, size_gb, created_time FROM resources "
+            f"WHERE resource_type=? AND resource_id IN ({','.join('?' * len(chunk))})",
+            [resource_type] + chunk
+        ).fetchall()
+        records.update((row['resource_id'], dict(row)) for row in rows)
+    conn.close()
+    return records
@@ -0,0 +1,56 @@
+from concurrent.futures import ThreadPoolExecutor
+
+# 默认并发请求数
+DEFAULT_MAX_WORKERS = 8
+MAX_WORKERS_LIMIT = 64
+
+# 并发执行任务，按输入顺序逐个返回 (item, 结果)
+def run_tasks(items, worker, max_workers=DEFAULT_MAX_WORKERS):
+    items = list(items)
+    if max_workers <= 1 or len(items) <= 1:
+        for item in items:
+            yield item, worker(item)
+        return
+
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(items)))
+    try:
+        futures = [executor.submit(worker, item) for item in items]
+        # 按提交顺序取结果，保证与输入顺序一致
+        for item, future in zip(items, futures):
+            yield item, future.result()
+    finally:
+        # 调用方中途退出或出现异常时，取消尚未开始的任务
+        executor.shutdown(wait=True, cancel_futures=True)
+
+# 按批次大小切分ID列表
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+# 发送一批ID，出现可归因于具体资源的错误（should_split 为真）时二分拆分重发，以定位出错的资源并让正常资源继续执行
+# 限频、网络等与资源无关的错误不拆分，整批资源使用同一响应
+def send_with_bisect(ids, send_batch, should_split):
+    response_json = send_batch(ids)
+    if len(ids) == 1 or not should_split(response_json):
+        return [(resource_id, response_json) for resource_id in ids]
+    middle = len(ids) // 2
+    return send_with_bisect(ids[:middle], send_batch, should_split) + send_with_bisect(ids[middle:], send_batch, should_split)
+
+# 批量并发执行，按输入顺序逐个返回 (ID, 该ID所在请求的响应)
+# cancel_event 被设置后，尚未发送的批次不再发送，其响应为 None
+# on_result(ID, 响应) 在工作线程中收到响应时立即调用，不依赖调用方是否继续读取结果（用于写任务日志）
+def run_batches(ids, send_batch, should_split, batch_size=1, max_workers=DEFAULT_MAX_WORKERS, cancel_event=None, on_result=None):
+    batches = list(chunked(list(ids), max(1, batch_size)))
+
+    def send(batch):
+        if cancel_event is not None and cancel_event.is_set():
+            return [(resource_id, None) for resource_id in batch]
+        pairs = send_with_bisect(batch, send_batch, should_split)
+        if on_result is not None:
+            for resource_id, response_json in pairs:
+                on_result(resource_id, response_json)
+        return pairs
+
+    for batch, pairs in run_tasks(batches, send, max_workers):
+        for resource_id, response_json in pairs:
+            yield resource_id, response_json
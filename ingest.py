@@ -0,0 +1,101 @@
+import io
+import hashlib
+import pandas as pd
+from operations import REGION_COLUMN
+from scheduling import SIZE_COLUMN
+
+# 上传文件的读取和校验：只读取需要的列（全部按字符串读取，避免ID被解析为数字），
+# 在发送任何请求之前一次性校验ID格式并去除重复行；大文件按块读取，每块先去重再合并
+
+# 各类上传文件读取的列，第一列为资源ID（必填），其余列可选（DiskSize 为数据盘容量，用于按容量排序）
+UPLOAD_COLUMNS = {
+    "instance": ["ID_cvm", "cvm_name", "ID_dataDisk", SIZE_COLUMN],
+    "image": ["ImageId"],
+    "disk": ["ID", SIZE_COLUMN],
+    "snapshot": ["SnapshotId"],
+}
+
+# ID列的格式
+ID_PATTERNS = {
+    "ID_cvm": r"ins-[0-9a-z]+",
+    "ID_dataDisk": r"disk-[0-9a-z]+",
+    "ImageId": r"img-[0-9a-z]+",
+    "ID": r"disk-[0-9a-z]+",
+    "SnapshotId": r"snap-[0-9a-z]+",
+}
+
+# 多行共同组成一个资源的上传文件：同一实例的多行（每块数据盘一行）合起来才是一次完整的创建镜像请求，
+# 任何一行不合格时同一实例的所有行都不参与操作，避免创建出缺少部分数据盘的镜像
+GROUP_COLUMNS = {"instance": "ID_cvm"}
+
+# 每次读取的行数
+CSV_CHUNK_ROWS = 100000
+
+# 校验失败的行额外记录的原因列
+INVALID_REASON_COLUMN = "错误原因"
+
+# 文件内容的哈希，用于缓存解析结果
+def content_hash(content):
+    return hashlib.sha256(content).hexdigest()
+
+# 逐列检查ID格式，返回每行的错误原因（合格的行为空字符串）
+def find_invalid(frame, resource_type):
+    id_column = UPLOAD_COLUMNS[resource_type][0]
+    reasons = pd.Series('', index=frame.index)
+    for column in UPLOAD_COLUMNS[resource_type]:
+        if column not in ID_PATTERNS or column not in frame.columns:
+            continue
+        values = frame[column]
+        blank = values.isna()
+        malformed = ~blank & ~values.fillna('').str.fullmatch(ID_PATTERNS[column])
+        if column == id_column:
+            reasons = reasons.mask(blank & (reasons == ''), f"{column} 为空")
+        reasons = reasons.mask(malformed & (reasons == ''), f"{column} 格式错误")
+    return reasons
+
+# 把与不合格行属于同一资源的合格行也移到不合格的行中，返回 (合格的数据, 不合格的行)
+def invalidate_groups(frame, invalid_rows, resource_type):
+    group_column = GROUP_COLUMNS.get(resource_type)
+    if group_column is None or invalid_rows.empty:
+        return frame, invalid_rows
+    bad_ids = set(invalid_rows[group_column].dropna())
+    affected = frame[group_column].isin(bad_ids)
+    if not affected.any():
+        return frame, invalid_rows
+    moved = frame[affected].assign(**{INVALID_REASON_COLUMN: f"同一 {group_column} 的其他行不合格"})
+    invalid_rows = pd.concat([invalid_rows, moved], ignore_index=True)
+    return frame[~affected].reset_index(drop=True), invalid_rows
+
+# 读取并校验上传的CSV内容，返回 (合格的数据, 不合格的行, 重复行数)
+# 同一实例有任何一行不合格时，该实例的所有行都算作不合格
+# 缺少资源ID列时抛出 ValueError
+def read_upload(content, resource_type, chunk_rows=CSV_CHUNK_ROWS):
+    columns = UPLOAD_COLUMNS[resource_type]
+    wanted = set(columns) | {REGION_COLUMN}
+    reader = pd.read_csv(io.BytesIO(content), usecols=lambda column: column in wanted, dtype=str,
+                         keep_default_na=False, encoding='utf-8-sig', chunksize=chunk_rows)
+    valid_chunks = []
+    invalid_chunks = []
+    total = 0
+    for chunk in reader:
+        if columns[0] not in chunk.columns:
+            raise ValueError(f"文件缺少字段: {columns[0]}")
+        for column in chunk.columns:
+            values = chunk[column].str.strip()
+            chunk[column] = values.where(values != '')
+        total += len(chunk)
+        chunk = chunk.drop_duplicates()
+        reasons = find_invalid(chunk, resource_type)
+        invalid = reasons != ''
+        if invalid.any():
+            invalid_chunks.append(chunk[invalid].assign(**{INVALID_REASON_COLUMN: reasons[invalid]}))
+        valid_chunks.append(chunk[~invalid])
+
+    if not valid_chunks:
+        return pd.DataFrame(columns=[columns[0]]), pd.DataFrame(columns=[columns[0], INVALID_REASON_COLUMN]), 0
+    frame = pd.concat(valid_chunks, ignore_index=True).drop_duplicates(ignore_index=True)
+    invalid_rows = pd.concat(invalid_chunks, ignore_index=True) if invalid_chunks else pd.DataFrame(columns=list(frame.columns) + [INVALID_REASON_COLUMN])
+    invalid_rows = invalid_rows.drop_duplicates(ignore_index=True)
+    duplicates = total - len(frame) - len(invalid_rows)
+    frame, invalid_rows = invalidate_groups(frame, invalid_rows, resource_type)
+    return frame, invalid_rows, duplicates
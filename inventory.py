@@ -0,0 +1,170 @@
+import hashlib
+import json
+import time
+from capi import send_request
+from database import get_sync_time, upsert_inventory, get_attached_data_disks, get_inventory_by_ids
+from executor import run_tasks, chunked, DEFAULT_MAX_WORKERS
+from operations import get_response_body
+from preflight import build_describe_request, DESCRIBE_SPECS, DESCRIBE_LIMIT
+
+# 本地资源清单：分页并发同步实例、云硬盘、镜像和快照到本地SQLite缓存，用于按条件筛选操作目标
+
+# 缓存有效期（秒），超过后再次使用时重新同步
+INVENTORY_TTL = 600
+
+# 转换标签列表为 [(key, value)]
+def parse_tags(item):
+    return [(tag.get('Key', ''), tag.get('Value', '')) for tag in item.get('Tags') or []]
+
+def parse_instance(item):
+    return {
+        "resource_id": item['InstanceId'],
+        "name": item.get('InstanceName', ''),
+        "state": item.get('InstanceState', ''),
+        "parent_id": None,
+        "usage": None,
+        "size_gb": sum(disk.get('DiskSize', 0) for disk in item.get('DataDisks') or []) + (item.get('SystemDisk') or {}).get('DiskSize', 0),
+        "created_time": item.get('CreatedTime', ''),
+        "tags": parse_tags(item),
+    }
+
+def parse_disk(item):
+    return {
+        "resource_id": item['DiskId'],
+        "name": item.get('DiskName', ''),
+        "state": item.get('DiskState', ''),
+        "parent_id": item.get('InstanceId') or None,
+        "usage": item.get('DiskUsage', ''),
+        "size_gb": item.get('DiskSize', 0),
+        "created_time": item.get('CreateTime', ''),
+        "tags": parse_tags(item),
+    }
+
+def parse_image(item):
+    return {
+        "resource_id": item['ImageId'],
+        "name": item.get('ImageName', ''),
+        "state": item.get('ImageState', ''),
+        "parent_id": None,
+        "usage": item.get('ImageDescription', ''),
+        "size_gb": item.get('ImageSize', 0),
+        "created_time": item.get('CreatedTime', ''),
+        "tags": parse_tags(item),
+    }
+
+def parse_snapshot(item):
+    return {
+        "resource_id": item['SnapshotId'],
+        "name": item.get('SnapshotName', ''),
+        "state": item.get('SnapshotState', ''),
+        "parent_id": item.get('DiskId') or None,
+        "usage": item.get('DiskUsage', ''),
+        "size_gb": item.get('DiskSize', 0),
+        "created_time": item.get('CreateTime', ''),
+        "tags": parse_tags(item),
+    }
+
+# 各类资源的同步配置：查询接口、解析函数和列出时的过滤条件（镜像只同步自定义镜像）
+INVENTORY_TYPES = {
+    "instance": {"describe": "DescribeInstances", "parse": parse_instance, "filters": None},
+    "disk": {"describe": "DescribeDisks", "parse": parse_disk, "filters": None},
+    "image": {"describe": "DescribeImages", "parse": parse_image, "filters": [{"Name": "image-type", "Values": ["PRIVATE_IMAGE"]}]},
+    "snapshot": {"describe": "DescribeSnapshots", "parse": parse_snapshot, "filters": None},
+}
+
+# 资源类型的中文名称
+INVENTORY_TYPE_LABELS = {"instance": "云服务器", "disk": "云硬盘", "image": "镜像", "snapshot": "快照"}
+
+# 查询一页，返回 (资源列表, 总数)
+def describe_page(resource_type, offset, cookie, csrfcode, uin, region, ids=None):
+    describe_action = INVENTORY_TYPES[resource_type]['describe']
+    spec = DESCRIBE_SPECS[describe_action]
+    filters = INVENTORY_TYPES[resource_type]['filters'] if ids is None else None
+    data = build_describe_request(describe_action, ids, offset, region, filters)
+    response_json = send_request(describe_action, data, cookie, csrfcode, uin, region, ids)
+    body = get_response_body(response_json)
+    if not body or 'Error' in body:
+        message = body.get('Error', {}).get('Message', '无效的响应格式') if body else '无效的响应格式'
+        raise RuntimeError(f"{describe_action} 查询失败: {message}")
+    return body.get(spec['set_key']) or [], body.get('TotalCount', 0)
+
+# 分页列出全部资源：先查询第一页获得总数，其余页并发查询
+def list_all(resource_type, cookie, csrfcode, uin, region, max_workers=DEFAULT_MAX_WORKERS):
+    items, total = describe_page(resource_type, 0, cookie, csrfcode, uin, region)
+
+    def fetch(offset):
+        return describe_page(resource_type, offset, cookie, csrfcode, uin, region)[0]
+
+    offsets = range(DESCRIBE_LIMIT, total, DESCRIBE_LIMIT)
+    for offset, page in run_tasks(offsets, fetch, max_workers):
+        items.extend(page)
+    return items
+
+# 将接口返回的资源转换为缓存记录（附带原始数据和内容摘要，用于增量写入）
+def to_records(resource_type, items):
+    parse = INVENTORY_TYPES[resource_type]['parse']
+    records = []
+    for item in items:
+        record = parse(item)
+        record['data'] = json.dumps(item, ensure_ascii=False, sort_keys=True)
+        record['hash'] = hashlib.sha1(record['data'].encode('utf-8')).hexdigest()
+        records.append(record)
+    return records
+
+# 判断缓存是否过期
+def is_stale(resource_type, region, ttl=INVENTORY_TTL):
+    synced_at = get_sync_time(resource_type, region)
+    return synced_at is None or time.time() - synced_at > ttl
+
+# 同步某类资源；缓存未过期且未强制刷新时跳过
+# 返回 (是否执行了同步, 资源总数, 变化的记录数, 删除的记录数)
+def sync_inventory(resource_type, cookie, csrfcode, uin, region, force=False, max_workers=DEFAULT_MAX_WORKERS):
+    if not force and not is_stale(resource_type, region):
+        return False, 0, 0, 0
+    synced_at = time.time()
+    records = to_records(resource_type, list_all(resource_type, cookie, csrfcode, uin, region, max_workers))
+    changed, removed = upsert_inventory(resource_type, region, records, synced_at, full_sync=True)
+    return True, len(records), changed, removed
+
+# 按ID增量刷新指定资源（例如批量操作之后），查询不到的资源从缓存中删除
+def refresh_resources(resource_type, resource_ids, cookie, csrfcode, uin, region, max_workers=DEFAULT_MAX_WORKERS):
+    resource_ids = list(resource_ids)
+
+    def fetch(batch):
+        return describe_page(resource_type, 0, cookie, csrfcode, uin, region, ids=batch)[0]
+
+    items = []
+    for batch, page in run_tasks(list(chunked(resource_ids, DESCRIBE_LIMIT)), fetch, max_workers):
+        items.extend(page)
+    records = to_records(resource_type, items)
+    found = {record['resource_id'] for record in records}
+    removed_ids = [resource_id for resource_id in resource_ids if resource_id not in found]
+    return upsert_inventory(resource_type, region, records, time.time(), removed_ids=removed_ids)
+
+# 补全创建镜像数据所需的缓存是否可用：实例不在清单中、或所在地域的实例/云硬盘清单已过期时，
+# 抛出 ValueError 并列出这些实例，避免因缓存缺失或过时创建出不包含数据盘的镜像
+def check_image_inventory(instance_ids, instances):
+    missing = [instance_id for instance_id in instance_ids if instance_id not in instances]
+    if missing:
+        raise ValueError(f"以下 {len(missing)} 台实例不在资源清单中，请先同步实例和云硬盘清单: {', '.join(missing)}")
+    stale = {}
+    for instance_id in instance_ids:
+        region = instances[instance_id]['region']
+        if region not in stale:
+            stale[region] = [resource_type for resource_type in ("instance", "disk") if is_stale(resource_type, region)]
+    stale_ids = [instance_id for instance_id in instance_ids if stale[instances[instance_id]['region']]]
+    if stale_ids:
+        regions = ', '.join(f"{region}（{'/'.join(INVENTORY_TYPE_LABELS[t] for t in types)}）" for region, types in stale.items() if types)
+        raise ValueError(f"资源清单已过期: {regions}，请重新同步后再创建镜像。涉及 {len(stale_ids)} 台实例: {', '.join(stale_ids)}")
+
+# 根据缓存生成创建镜像所需的行（ID_cvm, cvm_name, ID_dataDisk），代替上传的映射文件
+# 缓存缺失或过期时抛出 ValueError（见 check_image_inventory）
+def image_rows_from_inventory(instance_ids):
+    instances = get_inventory_by_ids("instance", instance_ids)
+    check_image_inventory(instance_ids, instances)
+    attached = get_attached_data_disks(instance_ids)
+    rows = []
+    for instance_id in instance_ids:
+        for disk_id in attached.get(instance_id) or [None]:
+            rows.append({"ID_cvm": instance_id, "cvm_name": instances[instance_id]['name'], "ID_dataDisk": disk_id})
+    return rows
@@ -0,0 +1,173 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# 运行指标：按操作统计请求耗时分布、错误码、重试次数和进行中的请求数，并记录各阶段耗时
+# 指标保存在模块级注册表中，跨 Streamlit 重跑保留；可以在侧边栏查看，或导出为 Prometheus 文本格式
+#
+# 阶段：
+# - csv_parse: 读取上传的CSV文件
+# - network: HTTP 请求本身（不含限流等待和重试退避），并发时为各请求耗时之和
+# - response_parse: 解析响应
+# - render: 界面显示每个结果
+# - export: 生成结果报告（CSV/Excel/JSONL）
+# - session_start / rerun: 页面会话首次加载、之后每次重跑时准备页面的耗时（不含批量操作本身）
+
+# 耗时分布的桶上限（秒）
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+PHASE_BUCKETS = (0.001, 0.01, 0.1, 1, 10, 60)
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    # 估算分位数：返回累计数达到该分位的桶上限，落在最后一个桶时返回观测到的最大值
+    def quantile(self, fraction):
+        if not self.count:
+            return 0.0
+        target = math.ceil(self.count * fraction)
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+        return self.max
+
+_lock = threading.Lock()
+_request_latency = {}
+_requests = {}
+_retries = {}
+_in_flight = {}
+_phases = {}
+
+# 记录一次请求（含限流等待和重试）的耗时和错误码，成功时错误码为空
+def observe_request(action, latency, error_code=''):
+    with _lock:
+        _request_latency.setdefault(action, Histogram()).observe(latency)
+        key = (action, error_code or 'OK')
+        _requests[key] = _requests.get(key, 0) + 1
+
+# 记录一次被限频后的重试
+def record_retry(action):
+    with _lock:
+        _retries[action] = _retries.get(action, 0) + 1
+
+# 统计进行中的请求数
+@contextmanager
+def track_in_flight(action):
+    with _lock:
+        _in_flight[action] = _in_flight.get(action, 0) + 1
+    try:
+        yield
+    finally:
+        with _lock:
+            _in_flight[action] -= 1
+
+def observe_phase(phase, seconds):
+    with _lock:
+        _phases.setdefault(phase, Histogram(PHASE_BUCKETS)).observe(seconds)
+
+# 记录一段代码的阶段耗时
+@contextmanager
+def phase_timer(phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_phase(phase, time.perf_counter() - start)
+
+# 逐个返回元素，并把调用方处理每个元素的耗时计入指定阶段（例如界面渲染或写结果文件）
+def timed_iter(items, phase):
+    for item in items:
+        start = time.perf_counter()
+        yield item
+        observe_phase(phase, time.perf_counter() - start)
+
+def reset_metrics():
+    with _lock:
+        _request_latency.clear()
+        _requests.clear()
+        _retries.clear()
+        _phases.clear()
+
+# 按操作汇总的请求指标和各阶段耗时，供界面显示
+def get_snapshot():
+    with _lock:
+        actions = sorted(set(_request_latency) | set(_retries) | {action for action, count in _in_flight.items() if count})
+        requests = []
+        for action in actions:
+            histogram = _request_latency.get(action, Histogram())
+            errors = sum(count for (name, code), count in _requests.items() if name == action and code != 'OK')
+            requests.append({
+                "action": action,
+                "requests": histogram.count,
+                "errors": errors,
+                "retries": _retries.get(action, 0),
+                "in_flight": _in_flight.get(action, 0),
+                "avg_ms": histogram.sum / histogram.count * 1000 if histogram.count else 0.0,
+                "p50_ms": histogram.quantile(0.5) * 1000,
+                "p99_ms": histogram.quantile(0.99) * 1000,
+            })
+        error_codes = [
+            {"action": action, "error_code": code, "count": count}
+            for (action, code), count in sorted(_requests.items(), key=lambda item: -item[1]) if code != 'OK'
+        ]
+        phases = [
+            {"phase": phase, "count": histogram.count, "total_seconds": histogram.sum,
+             "avg_ms": histogram.sum / histogram.count * 1000 if histogram.count else 0.0}
+            for phase, histogram in sorted(_phases.items())
+        ]
+    return {"requests": requests, "error_codes": error_codes, "phases": phases}
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _histogram_lines(name, label, value, histogram):
+    lines = []
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{label}="{_escape(value)}",le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{label}="{_escape(value)}",le="+Inf"}} {histogram.count}')
+    lines.append(f'{name}_sum{{{label}="{_escape(value)}"}} {histogram.sum}')
+    lines.append(f'{name}_count{{{label}="{_escape(value)}"}} {histogram.count}')
+    return lines
+
+# 导出为 Prometheus 文本格式
+def render_prometheus():
+    with _lock:
+        lines = [
+            "# HELP capi_request_duration_seconds 请求耗时（含限流等待和重试）",
+            "# TYPE capi_request_duration_seconds histogram",
+        ]
+        for action, histogram in sorted(_request_latency.items()):
+            lines.extend(_histogram_lines("capi_request_duration_seconds", "action", action, histogram))
+        lines += ["# HELP capi_requests_total 按错误码统计的请求数（成功为 OK）", "# TYPE capi_requests_total counter"]
+        for (action, code), count in sorted(_requests.items()):
+            lines.append(f'capi_requests_total{{action="{_escape(action)}",code="{_escape(code)}"}} {count}')
+        lines += ["# HELP capi_retries_total 被限频后的重试次数", "# TYPE capi_retries_total counter"]
+        for action, count in sorted(_retries.items()):
+            lines.append(f'capi_retries_total{{action="{_escape(action)}"}} {count}')
+        lines += ["# HELP capi_in_flight_requests 进行中的请求数", "# TYPE capi_in_flight_requests gauge"]
+        for action, count in sorted(_in_flight.items()):
+            lines.append(f'capi_in_flight_requests{{action="{_escape(action)}"}} {count}')
+        lines += ["# HELP capi_phase_duration_seconds 各阶段耗时", "# TYPE capi_phase_duration_seconds histogram"]
+        for phase, histogram in sorted(_phases.items()):
+            lines.extend(_histogram_lines("capi_phase_duration_seconds", "phase", phase, histogram))
+    return "\n".join(lines) + "\n"
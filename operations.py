@@ -0,0 +1,368 @@
+import queue
+import threading
+from datetime import datetime
+from capi import send_request
+from database import create_job, JobJournal, TASK_SUCCESS, TASK_FAILED
+from executor import run_batches, DEFAULT_MAX_WORKERS
+from metrics import phase_timer
+from rate_limiter import get_error_code, RETRYABLE_ERROR_PREFIXES, CREATE_RETRYABLE_ERROR_PREFIXES
+
+# 批量操作的公共逻辑（构造请求、发送、解析响应、写任务日志），不依赖 Streamlit，供界面和命令行共用
+# 资源统一表示为 (资源ID, 参数)，参数为重新执行时所需的额外信息（如镜像名称），没有时为 None
+
+# 构造关机请求
+def build_stop_instances(resources, region):
+    return {
+        "serviceType": "cvm",
+        "action": "StopInstances",
+        "data": {
+            "Version": "2017-03-12",
+            "InstanceIds": [resource_id for resource_id, payload in resources],
+            "StopType": "SOFT_FIRST",
+            "StoppedMode": "KEEP_CHARGING"
+        },
+        "region": region
+    }
+
+# 构造开机请求
+def build_start_instances(resources, region):
+    return {
+        "serviceType": "cvm",
+        "action": "StartInstances",
+        "data": {
+            "Version": "2017-03-12",
+            "InstanceIds": [resource_id for resource_id, payload in resources]
+        },
+        "region": region
+    }
+
+# 工具创建的镜像和快照的名称（继续执行前按名称核对是否已创建）
+def image_name(payload):
+    return payload['cvm_name'] + '-image'
+
+def snapshot_name(disk_id):
+    return f"{disk_id}_last_snapshot"
+
+# 构造创建镜像请求（每次一台实例）
+def build_create_image(resources, region):
+    instance_id, payload = resources[0]
+    return {
+        "serviceType": "cvm",
+        "action": "CreateImage",
+        "region": region,
+        "data": {
+            "Version": "2017-03-12",
+            "InstanceId": instance_id,
+            "ImageName": image_name(payload),
+            "ImageDescription": "CDC迁移",
+            "ForcePoweroff": "FALSE",
+            "Sysprep": "FALSE",
+            "DataDiskIds": payload['data_disk_ids']
+        }
+    }
+
+# 构造删除镜像请求
+def build_delete_images(resources, region):
+    return {
+        "serviceType": "cvm",
+        "action": "DeleteImages",
+        "region": region,
+        "data": {
+            "Version": "2017-03-12",
+            "ImageIds": [resource_id for resource_id, payload in resources],
+            "DeleteBindedSnap": True
+        }
+    }
+
+# cbs 接口使用的数字地域ID
+CBS_REGION_IDS = {
+    "ap-guangzhou": 1,
+    "ap-shanghai": 4,
+    "ap-hongkong": 5,
+    "na-toronto": 6,
+    "ap-beijing": 8,
+    "ap-singapore": 9,
+    "na-siliconvalley": 15,
+    "ap-chengdu": 16,
+    "eu-frankfurt": 17,
+    "ap-seoul": 18,
+    "ap-chongqing": 19,
+    "ap-mumbai": 21,
+    "na-ashburn": 22,
+    "ap-bangkok": 23,
+    "ap-tokyo": 25,
+    "ap-nanjing": 33,
+    "ap-jakarta": 72,
+    "sa-saopaulo": 74,
+}
+# 未指定地域时使用的 regionId（与之前固定写死的值一致）
+DEFAULT_CBS_REGION_ID = 4
+
+# 获取 cbs 接口的 regionId，不支持的地域抛出 ValueError
+def get_region_id(region):
+    if not region:
+        return DEFAULT_CBS_REGION_ID
+    if region not in CBS_REGION_IDS:
+        raise ValueError(f"不支持的地域: {region}，请在 CBS_REGION_IDS 中补充对应的 regionId")
+    return CBS_REGION_IDS[region]
+
+# 构造创建快照请求（每次一块云硬盘）
+def build_create_snapshot(resources, region):
+    disk_id, payload = resources[0]
+    return {
+        "serviceType": "cbs",
+        "action": "CreateSnapshot",
+        "regionId": get_region_id(region),
+        "data": {
+            "Version": "2017-03-12",
+            "DiskId": disk_id,
+            "SnapshotName": snapshot_name(disk_id)
+        }
+    }
+
+# 构造删除快照请求
+def build_delete_snapshots(resources, region):
+    return {
+        "serviceType": "cbs",
+        "action": "DeleteSnapshots",
+        "regionId": get_region_id(region),
+        "data": {
+            "Version": "2017-03-12",
+            "SnapshotIds": [resource_id for resource_id, payload in resources]
+        }
+    }
+
+# 各操作的配置：
+# - build: 构造请求
+# - service: cvm 接口需要 region，cbs 接口不需要
+# - batch_limit: 单次请求可携带的最大ID数（1 表示不支持批量）
+# - result_key: 创建类操作从响应中提取的新资源ID字段
+# - flush_size: 任务日志批量写入的条数；创建类操作重复发送会产生重复资源，逐条写入
+OPERATIONS = {
+    "StopInstances": {"build": build_stop_instances, "service": "cvm", "batch_limit": 100, "result_key": None, "flush_size": 100},
+    "StartInstances": {"build": build_start_instances, "service": "cvm", "batch_limit": 100, "result_key": None, "flush_size": 100},
+    "CreateImage": {"build": build_create_image, "service": "cvm", "batch_limit": 1, "result_key": "ImageId", "flush_size": 1},
+    "DeleteImages": {"build": build_delete_images, "service": "cvm", "batch_limit": 100, "result_key": None, "flush_size": 100},
+    "CreateSnapshot": {"build": build_create_snapshot, "service": "cbs", "batch_limit": 1, "result_key": "SnapshotId", "flush_size": 1},
+    "DeleteSnapshots": {"build": build_delete_snapshots, "service": "cbs", "batch_limit": 100, "result_key": None, "flush_size": 100},
+}
+
+# 各操作继续执行时重发的失败错误码前缀：创建类操作只重发限频错误，避免产生重复资源
+RETRYABLE_PREFIXES = {
+    action: CREATE_RETRYABLE_ERROR_PREFIXES if spec['result_key'] else RETRYABLE_ERROR_PREFIXES
+    for action, spec in OPERATIONS.items()
+}
+
+# 各操作中未确认是否已执行的失败错误码前缀：创建类操作遇到网络错误或内部错误时镜像/快照可能已经创建，
+# 继续执行前与发送中的资源一起按名称查询核对
+AMBIGUOUS_PREFIXES = {
+    action: ('ClientError', 'InternalError') if spec['result_key'] else ()
+    for action, spec in OPERATIONS.items()
+}
+
+# 各操作需要的CSV列，第一列为资源ID
+REQUIRED_COLUMNS = {
+    "StopInstances": ["ID_cvm"],
+    "StartInstances": ["ID_cvm"],
+    "CreateImage": ["ID_cvm", "cvm_name", "ID_dataDisk"],
+    "DeleteImages": ["ImageId"],
+    "CreateSnapshot": ["ID"],
+    "DeleteSnapshots": ["SnapshotId"],
+}
+
+# 判断CSV中的值是否为空（None、空字符串或 pandas 读取的 NaN）
+def is_blank(value):
+    return value is None or value != value or value == ''
+
+# 将CSV行（字典列表）转换为资源列表，按首次出现的顺序去重
+def build_resources(action, rows):
+    id_column = REQUIRED_COLUMNS[action][0]
+    if action == "CreateImage":
+        # 同一实例的多行合并为一个资源，数据盘ID汇总到一起
+        resources = {}
+        for row in rows:
+            instance_id = row[id_column]
+            if instance_id not in resources:
+                resources[instance_id] = {'cvm_name': row['cvm_name'], 'data_disk_ids': []}
+            if not is_blank(row['ID_dataDisk']):
+                resources[instance_id]['data_disk_ids'].append(row['ID_dataDisk'])
+        return list(resources.items())
+    resource_ids = dict.fromkeys(row[id_column] for row in rows)
+    return [(resource_id, None) for resource_id in resource_ids]
+
+# 可归因于具体资源的错误码前缀：合并请求返回这些错误时拆分批次，定位出错的资源
+# 限频、网络、内部错误等与资源无关，拆分只会成倍增加请求，不在此列
+RESOURCE_ERROR_PREFIXES = (
+    'InvalidInstanceId', 'InvalidImageId', 'InvalidSnapshot', 'InvalidDisk', 'InvalidParameterValue',
+    'UnsupportedOperation', 'ResourceNotFound', 'ResourceInUse', 'ResourceUnavailable', 'OperationDenied',
+)
+
+# 判断失败是否由批次中的某个资源引起（需要拆分批次）
+def is_resource_error(response_json):
+    return get_error_code(response_json).startswith(RESOURCE_ERROR_PREFIXES)
+
+# 获取响应中的 Response 部分，格式无效时返回空字典
+def get_response_body(response_json):
+    if 'data' in response_json and 'Response' in response_json['data']:
+        return response_json['data']['Response']
+    return {}
+
+# 解析单个资源的响应结果
+def parse_result(action, resource_id, response_json):
+    result_key = OPERATIONS[action]['result_key']
+    body = get_response_body(response_json)
+    error = body.get('Error', {})
+    result_id = body.get(result_key, '') if result_key else ''
+
+    status = "成功"
+    error_msg = ""
+    if not body:
+        status = "失败"
+        error_msg = "无效的响应格式"
+    elif error:
+        status = "失败"
+        error_msg = error.get('Message', '未知错误')
+    elif result_key and not result_id:
+        status = "失败"
+        error_msg = f"未获取到 {result_key}"
+
+    return {
+        "resource_id": resource_id,
+        "status": status,
+        "error_code": error.get('Code', ''),
+        "error_message": error_msg,
+        "request_id": body.get('RequestId', ''),
+        "result_id": result_id or '',
+        "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }
+
+# 获取某个操作的批次大小，未开启批量模式时每次请求只携带一个ID
+def get_batch_size(action, batch_mode):
+    return OPERATIONS[action]['batch_limit'] if batch_mode else 1
+
+# 创建任务日志；继续执行已有任务时沿用原任务ID
+def open_journal(action, region, resources, job_id=None):
+    if job_id is None:
+        job_id = create_job(action, region, resources)
+    return JobJournal(job_id, OPERATIONS[action]['flush_size'])
+
+# 执行批量操作，按输入顺序逐个返回 (解析结果, 原始响应)，并写入任务日志
+# 结果在工作线程收到响应时立即写入任务日志，调用方中途停止读取（页面重跑、中断）也不会丢失已发送请求的结果；
+# 创建类操作在发送前标记为发送中，中断后可按名称核对
+# cancel_event 被设置后不再发送新请求，未发送的资源在任务日志中保持待执行状态
+def run_operation(action, resources, cookie, csrfcode, uin, region, max_workers=DEFAULT_MAX_WORKERS, batch_mode=False, job_id=None, cancel_event=None):
+    build = OPERATIONS[action]['build']
+    if OPERATIONS[action]['service'] == 'cbs':
+        # 在发送任何请求之前检查地域是否支持
+        get_region_id(region)
+    journal = open_journal(action, region, resources, job_id)
+    creates = OPERATIONS[action]['result_key'] is not None
+    results = {}
+
+    def send(batch):
+        resource_ids = [resource_id for resource_id, payload in batch]
+        if creates:
+            journal.mark_sending(resource_ids)
+        return send_request(action, build(batch, region), cookie, csrfcode, uin, region, resource_ids, journal.job_id)
+
+    def record(resource, response_json):
+        resource_id, payload = resource
+        with phase_timer('response_parse'):
+            result = parse_result(action, resource_id, response_json)
+        journal.record(
+            resource_id,
+            TASK_SUCCESS if result['status'] == "成功" else TASK_FAILED,
+            result['error_code'],
+            result['error_message'],
+            result['request_id'],
+            result['result_id']
+        )
+        results[resource_id] = result
+
+    batch_size = get_batch_size(action, batch_mode)
+    responses = run_batches(resources, send, is_resource_error, batch_size, max_workers, cancel_event, on_result=record)
+    try:
+        for (resource_id, payload), response_json in responses:
+            if response_json is None:
+                continue
+            result = results.pop(resource_id)
+            result['region'] = region
+            result['job_id'] = journal.job_id
+            yield result, response_json
+    finally:
+        # 先等待已发送的请求返回并写入结果，再关闭任务日志
+        responses.close()
+        journal.close()
+
+# CSV中指定资源所在地域的列（可选）
+REGION_COLUMN = "region"
+
+# 按CSV中的 region 列拆分资源，没有该列或为空时使用默认地域，返回 {地域: 资源列表}
+def split_by_region(action, rows, default_region):
+    grouped = {}
+    for row in rows:
+        region = row.get(REGION_COLUMN)
+        region = '' if is_blank(region) else str(region).strip()
+        grouped.setdefault(region or default_region, []).append(row)
+    return {region: build_resources(action, region_rows) for region, region_rows in grouped.items()}
+
+# 资源总数
+def count_resources(shards):
+    return sum(len(resources) for resources in shards.values())
+
+_SHARD_DONE = object()
+
+# 多地域并行执行：shards 为 {地域: 资源列表}，每个地域一个任务，使用独立的线程池和限流器
+# 按完成顺序逐个返回 (解析结果, 原始响应)，结果中的 region 和 job_id 标明所属地域和任务
+# job_ids 为 {地域: 任务ID}，继续执行已有任务时传入
+def run_sharded(action, shards, cookie, csrfcode, uin, max_workers=DEFAULT_MAX_WORKERS, batch_mode=False, job_ids=None, cancel_event=None):
+    job_ids = job_ids or {}
+    shards = {region: resources for region, resources in shards.items() if resources}
+    if len(shards) <= 1:
+        for region, resources in shards.items():
+            yield from run_operation(action, resources, cookie, csrfcode, uin, region, max_workers, batch_mode, job_ids.get(region), cancel_event)
+        return
+    if OPERATIONS[action]['service'] == 'cbs':
+        for region in shards:
+            get_region_id(region)
+
+    results = queue.Queue()
+    stop = threading.Event()
+
+    def run_region(region, resources):
+        try:
+            for item in run_operation(action, resources, cookie, csrfcode, uin, region, max_workers, batch_mode, job_ids.get(region), stop):
+                results.put(item)
+        except Exception as e:
+            results.put(e)
+        finally:
+            results.put(_SHARD_DONE)
+
+    threads = [threading.Thread(target=run_region, args=(region, resources), name=f"region-{region}", daemon=True)
+               for region, resources in shards.items()]
+    for thread in threads:
+        thread.start()
+    remaining = len(threads)
+    error = None
+    try:
+        while remaining:
+            if cancel_event is not None and cancel_event.is_set():
+                stop.set()
+            try:
+                item = results.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if item is _SHARD_DONE:
+                remaining -= 1
+            elif isinstance(item, Exception):
+                # 某个地域出错时停止其他地域发送新请求，已发送的请求仍写入任务日志
+                error = error or item
+                stop.set()
+            else:
+                yield item
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    if error is not None:
+        raise error
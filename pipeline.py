@@ -0,0 +1,324 @@
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+from capi import send_request
+from database import create_job, JobJournal, record_completions, TASK_SUCCESS, TASK_FAILED, TASK_SKIPPED
+from executor import chunked, send_with_bisect, DEFAULT_MAX_WORKERS
+from operations import OPERATIONS, parse_result, is_resource_error, get_region_id
+from preflight import describe_states
+from scheduling import resource_size
+from tracker import TRACKED_OPERATIONS, MISSING_LIMIT
+
+# 迁移流水线：把"关机 → 快照 → 创建镜像 → 开机"按实例拆成有依赖关系的步骤，每台实例独立推进，
+# 实例A创建镜像时实例B可以仍在关机，总耗时接近最长的单实例链路，而不是各阶段耗时之和
+#
+# 每台实例的依赖关系：
+#   关机 → 每块数据盘的快照 ┐
+#   关机 → 创建镜像         ┴→ 开机
+# 关机成功后开机总会执行：快照或创建镜像失败时只跳过依赖它的步骤，不会让实例一直处于关机状态
+# 步骤发送成功后进入等待状态，所有等待中的步骤按查询接口合并批量轮询，直到资源进入目标状态
+# 可发送的步骤按优先级从高到低发送：优先级为该步骤到链路结束的最大云硬盘容量之和（关键路径），
+# 容量最大的实例最先关机、最先创建镜像和快照，整批的完成时间接近最大单台实例的耗时
+# 每个地域的每种操作对应一个任务日志，中断后可以在"继续未完成的任务"中单独继续执行
+
+# 各步骤的配置：
+# - action: 发送的操作
+# - describe / done / failed: 轮询使用的查询接口，以及视为完成和失败的状态
+# - ok_errors: 视为已处于目标状态的错误码（例如实例已关机）
+# - timeout: 等待完成的最长时间（秒）
+STEP_SPECS = {
+    "stop": {"label": "关机", "action": "StopInstances", "describe": "DescribeInstances",
+             "done": {"STOPPED"}, "failed": set(),
+             "ok_errors": ("UnsupportedOperation.InstanceStateStopped",), "timeout": 900},
+    "snapshot": {"label": "快照", "action": "CreateSnapshot", "describe": "DescribeSnapshots",
+                 "done": TRACKED_OPERATIONS["CreateSnapshot"]["success"], "failed": TRACKED_OPERATIONS["CreateSnapshot"]["failed"],
+                 "ok_errors": (), "timeout": 7200},
+    "image": {"label": "创建镜像", "action": "CreateImage", "describe": "DescribeImages",
+              "done": TRACKED_OPERATIONS["CreateImage"]["success"], "failed": TRACKED_OPERATIONS["CreateImage"]["failed"],
+              "ok_errors": (), "timeout": 7200},
+    "start": {"label": "开机", "action": "StartInstances", "describe": "DescribeInstances",
+              "done": {"RUNNING"}, "failed": set(),
+              "ok_errors": ("UnsupportedOperation.InstanceStateRunning",), "timeout": 900},
+}
+DEFAULT_STEPS = ("stop", "snapshot", "image", "start")
+
+# 每个地域同时进行中（发送中或等待完成）的步骤数
+DEFAULT_REGION_LIMIT = 20
+# 每台实例同时进行中的快照和创建镜像步骤数，0 表示不限制
+DEFAULT_INSTANCE_LIMIT = 0
+# 受实例并发限制的步骤（读取云硬盘数据，同一实例同时进行会互相争用）
+INSTANCE_LIMITED_STEPS = ("snapshot", "image")
+# 批量轮询间隔（秒）
+POLL_INTERVAL = 10
+# 调度循环在没有请求完成时的最长等待时间（秒）
+TICK = 0.5
+
+# 步骤状态
+STEP_PENDING = "等待依赖"
+STEP_SENDING = "发送中"
+STEP_WAITING = "等待完成"
+STEP_DONE = "完成"
+STEP_FAILED = "失败"
+STEP_SKIPPED = "跳过"
+
+class PipelineTask:
+    def __init__(self, key, instance_id, step, resource_id, payload, region, deps, after=()):
+        self.key = key
+        self.instance_id = instance_id
+        self.step = step
+        self.resource_id = resource_id
+        self.payload = payload
+        self.region = region
+        # 必须成功的依赖，以及只需结束（成功、失败或跳过）的前序步骤
+        self.deps = deps
+        self.after = list(after)
+        self.dependents = []
+        self.status = STEP_PENDING
+        # 等待完成时轮询的资源ID（实例ID、新镜像ID或新快照ID）
+        self.target_id = None
+        self.waiting_since = None
+        self.missing = 0
+        # 本步骤的云硬盘容量，以及到链路结束的最大容量之和（调度优先级）
+        self.size = 0
+        self.priority = 0
+
+# 按实例构造步骤及依赖关系，返回 {步骤键: PipelineTask}（按实例顺序）
+# shards 为 {地域: 资源列表}，资源与创建镜像相同：[(实例ID, {'cvm_name', 'data_disk_ids'})]
+# disk_sizes 为 {云硬盘ID: 容量GB}，用于计算各步骤的调度优先级
+def build_pipeline(shards, steps=DEFAULT_STEPS, disk_sizes=None):
+    tasks = {}
+
+    def add(key, instance_id, step, resource_id, payload, region, deps, after=()):
+        task = PipelineTask(key, instance_id, step, resource_id, payload, region, deps, after)
+        tasks[key] = task
+        for dep in list(deps) + list(after):
+            tasks[dep].dependents.append(key)
+        return key
+
+    for region, resources in shards.items():
+        for instance_id, payload in resources:
+            stop_deps = []
+            if "stop" in steps:
+                stop_deps = [add(f"{instance_id}/stop", instance_id, "stop", instance_id, None, region, [])]
+            middle = []
+            if "snapshot" in steps:
+                for disk_id in payload['data_disk_ids']:
+                    middle.append(add(f"{instance_id}/snapshot/{disk_id}", instance_id, "snapshot", disk_id, None, region, stop_deps))
+            if "image" in steps:
+                middle.append(add(f"{instance_id}/image", instance_id, "image", instance_id, payload, region, stop_deps))
+            if "start" in steps:
+                add(f"{instance_id}/start", instance_id, "start", instance_id, None, region, stop_deps, middle)
+
+    # 依赖总在后续步骤之前加入，倒序遍历即可由后往前累计优先级
+    disk_sizes = disk_sizes or {}
+    for task in reversed(list(tasks.values())):
+        if task.step == "snapshot":
+            task.size = resource_size("CreateSnapshot", task.resource_id, None, disk_sizes)
+        elif task.step == "image":
+            task.size = resource_size("CreateImage", task.resource_id, task.payload, disk_sizes)
+        task.priority = task.size + max((tasks[key].priority for key in task.dependents), default=0)
+    return tasks
+
+def _event(task, detail=''):
+    return {
+        "region": task.region,
+        "instance_id": task.instance_id,
+        "step": STEP_SPECS[task.step]['label'],
+        "resource_id": task.target_id or task.resource_id,
+        "status": task.status,
+        "detail": detail,
+        "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }
+
+# 包含快照步骤时检查各地域是否有对应的 cbs regionId，不支持的地域抛出 ValueError
+# 必须在关机之前检查，否则实例关机后才在创建快照时出错，无法继续开机
+def check_pipeline_regions(shards, steps=DEFAULT_STEPS):
+    if "snapshot" in steps:
+        for region in shards:
+            get_region_id(region)
+
+# 执行流水线，每当步骤状态变化时返回一个事件字典：
+# region、instance_id、step、resource_id、status、detail、time
+# shards 为 {地域: 资源列表}，各地域的步骤共用一个调度循环，按地域分别限制并发、合并请求和轮询
+# disk_sizes 为 {云硬盘ID: 容量GB}，instance_limit 为每台实例同时进行中的快照和创建镜像步骤数（0 不限制）
+# cancel_event 被设置后不再发送新步骤，已发送的请求等待响应后结束
+# 调用方应先调用 check_pipeline_regions；这里在发送任何请求之前再检查一次
+def run_pipeline(shards, cookie, csrfcode, uin, steps=DEFAULT_STEPS, max_workers=DEFAULT_MAX_WORKERS,
+                 region_limit=DEFAULT_REGION_LIMIT, cancel_event=None, disk_sizes=None, instance_limit=DEFAULT_INSTANCE_LIMIT):
+    check_pipeline_regions(shards, steps)
+    tasks = build_pipeline(shards, steps, disk_sizes)
+    if not tasks:
+        return
+    # 调度顺序：优先级从高到低，相同时保持实例顺序
+    schedule = sorted(tasks.values(), key=lambda task: -task.priority)
+
+    # 每个地域的每种操作一个任务日志，键为 (步骤, 地域)
+    journals = {}
+    for region in shards:
+        for step in steps:
+            step_resources = [(task.resource_id, task.payload) for task in tasks.values()
+                              if task.step == step and task.region == region]
+            if step_resources:
+                action = STEP_SPECS[step]['action']
+                job_id = create_job(action, region, step_resources)
+                journals[(step, region)] = JobJournal(job_id, OPERATIONS[action]['flush_size'])
+
+    active = Counter()
+    instance_active = Counter()
+    futures = {}
+    last_poll = 0.0
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    # 跳过未执行的步骤，任务日志中记为已跳过，继续执行任务时不会单独执行
+    def skip(task, detail):
+        task.status = STEP_SKIPPED
+        journals[(task.step, task.region)].record(task.resource_id, TASK_SKIPPED, '', detail)
+        return _event(task, detail)
+
+    def finish(task, status, detail=''):
+        task.status = status
+        active[task.region] -= 1
+        if task.step in INSTANCE_LIMITED_STEPS:
+            instance_active[task.instance_id] -= 1
+        events = [_event(task, detail)]
+        if status == STEP_FAILED:
+            # 必须成功的依赖失败时跳过后续步骤；只需前序步骤结束的步骤（开机）不受影响
+            stack = [task]
+            while stack:
+                failed = stack.pop()
+                for key in failed.dependents:
+                    dependent = tasks[key]
+                    if dependent.status == STEP_PENDING and failed.key in dependent.deps:
+                        events.append(skip(dependent, f"依赖的步骤失败: {task.key}"))
+                        stack.append(dependent)
+        return events
+
+    # 在工作线程中发送并立即写入任务日志，返回 {资源ID: 解析结果}；调度循环中途退出也不会丢失已发送请求的结果
+    def send_group(step, region, group):
+        action = STEP_SPECS[step]['action']
+        build = OPERATIONS[action]['build']
+        journal = journals[(step, region)]
+
+        def send_batch(batch):
+            resource_ids = [resource_id for resource_id, payload in batch]
+            if OPERATIONS[action]['result_key']:
+                journal.mark_sending(resource_ids)
+            return send_request(action, build(batch, region), cookie, csrfcode, uin, region, resource_ids, journal.job_id)
+
+        results = {}
+        for (resource_id, payload), response_json in send_with_bisect([(task.resource_id, task.payload) for task in group], send_batch, is_resource_error):
+            result = parse_result(action, resource_id, response_json)
+            journal.record(
+                resource_id,
+                TASK_SUCCESS if result['status'] == "成功" else TASK_FAILED,
+                result['error_code'], result['error_message'], result['request_id'], result['result_id']
+            )
+            results[resource_id] = result
+        return results
+
+    try:
+        while True:
+            events = []
+            cancelled = cancel_event is not None and cancel_event.is_set()
+
+            # 1. 按优先级发送依赖已完成、且地域和实例并发未满的步骤；开关机合并为批量请求
+            if not cancelled:
+                ready = {}
+                for task in schedule:
+                    if task.status != STEP_PENDING or active[task.region] >= region_limit:
+                        continue
+                    limited = task.step in INSTANCE_LIMITED_STEPS
+                    if limited and instance_limit and instance_active[task.instance_id] >= instance_limit:
+                        continue
+                    if all(tasks[dep].status == STEP_DONE for dep in task.deps) and \
+                            all(tasks[key].status in (STEP_DONE, STEP_FAILED, STEP_SKIPPED) for key in task.after):
+                        task.status = STEP_SENDING
+                        active[task.region] += 1
+                        if limited:
+                            instance_active[task.instance_id] += 1
+                        ready.setdefault((task.step, task.region), []).append(task)
+                        events.append(_event(task))
+                for (step, region), ready_tasks in ready.items():
+                    batch_limit = OPERATIONS[STEP_SPECS[step]['action']]['batch_limit']
+                    for group in chunked(ready_tasks, batch_limit):
+                        futures[executor.submit(send_group, step, region, group)] = (step, region, group)
+
+            # 2. 处理已返回的请求
+            if futures:
+                done, not_done = wait(list(futures), timeout=TICK, return_when=FIRST_COMPLETED)
+                for future in done:
+                    step, region, group = futures.pop(future)
+                    spec = STEP_SPECS[step]
+                    results = future.result()
+                    for task in group:
+                        result = results[task.resource_id]
+                        if result['status'] == "成功" or result['error_code'] in spec['ok_errors']:
+                            task.status = STEP_WAITING
+                            task.target_id = result['result_id'] or task.resource_id
+                            task.waiting_since = time.monotonic()
+                            events.append(_event(task, result['request_id']))
+                        else:
+                            events.extend(finish(task, STEP_FAILED, result['error_message']))
+
+            # 3. 批量轮询等待完成的步骤
+            waiting = [task for task in tasks.values() if task.status == STEP_WAITING]
+            if waiting and time.monotonic() - last_poll >= POLL_INTERVAL:
+                last_poll = time.monotonic()
+                by_describe = {}
+                for task in waiting:
+                    by_describe.setdefault((STEP_SPECS[task.step]['describe'], task.region), []).append(task)
+                for (describe_action, region), group in by_describe.items():
+                    states, unknown, calls = describe_states(describe_action, list({task.target_id for task in group}),
+                                                             cookie, csrfcode, uin, region, max_workers)
+                    completions = {}
+                    for task in group:
+                        spec = STEP_SPECS[task.step]
+                        state = states.get(task.target_id)
+                        if task.target_id in unknown:
+                            pass
+                        elif state in spec['done']:
+                            events.extend(finish(task, STEP_DONE, state))
+                        elif state in spec['failed']:
+                            events.extend(finish(task, STEP_FAILED, state))
+                        elif state is None:
+                            task.missing += 1
+                            if task.missing >= MISSING_LIMIT:
+                                state = "NOT_FOUND"
+                                events.extend(finish(task, STEP_FAILED, "资源不存在"))
+                        if task.status == STEP_WAITING and time.monotonic() - task.waiting_since > spec['timeout']:
+                            events.extend(finish(task, STEP_FAILED, f"等待超时（{spec['timeout']} 秒），最后状态 {state}"))
+                        if state and task.step in ("image", "snapshot"):
+                            completions.setdefault(task.step, []).append(
+                                (task.target_id, task.resource_id, state, task.status != STEP_WAITING))
+                    for step, rows in completions.items():
+                        record_completions(journals[(step, region)].job_id, rows)
+
+            yield from events
+
+            # 取消后等待已发送的请求返回即结束，等待完成中的步骤不再轮询
+            if cancelled and not futures:
+                for task in tasks.values():
+                    if task.status == STEP_PENDING:
+                        yield skip(task, "已取消")
+                    elif task.status == STEP_WAITING:
+                        task.status = STEP_SKIPPED
+                        yield _event(task, "已取消，未确认是否完成")
+                return
+            if all(task.status in (STEP_DONE, STEP_FAILED, STEP_SKIPPED) for task in tasks.values()):
+                return
+            if not futures:
+                # 只剩等待完成的步骤时，睡到下一次轮询
+                delay = max(TICK, POLL_INTERVAL - (time.monotonic() - last_poll)) if waiting else TICK
+                if cancel_event is not None:
+                    cancel_event.wait(delay)
+                else:
+                    time.sleep(delay)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        for journal in journals.values():
+            journal.close()
+
+# 流水线的步骤总数（用于显示进度）
+def count_pipeline_steps(shards, steps=DEFAULT_STEPS):
+    return len(build_pipeline(shards, steps))
@@ -0,0 +1,213 @@
+import json
+import math
+import os
+import random
+import time
+from executor import MAX_WORKERS_LIMIT
+from operations import OPERATIONS, count_resources, get_batch_size, get_region_id
+from pipeline import STEP_SPECS, DEFAULT_STEPS
+from rate_limiter import MAX_RATE
+from response_log import LOG_DIR, LOG_FILE
+
+# 容量规划（dry-run）：不发送任何操作请求，按地域给出确切的请求计划（请求数、每批ID数），
+# 并根据结构化响应日志中历史运行的请求耗时和限频情况，估算总耗时和接口调用量，
+# 便于在执行前选择并发数和维护窗口
+#
+# 估算方法（每个地域独立并行执行，总耗时取最慢的地域）：
+# - 请求耗时取历史 p50 / p90（日志中的耗时已包含限流等待和重试退避）
+# - 受并发限制的耗时 = 请求数 × 单次耗时 / 并发数
+# - 受配额限制的耗时 = 请求数 / 配额速率；曾经触发限频的任务所达到的吞吐量视为配额，否则取限流器上限
+# - 预计请求数（含重试）= 请求数 / (1 - 限频比例)
+
+# 读取最近多少天的历史记录
+PROFILE_DAYS = 30
+# 每个 (操作, 地域) 保留的耗时样本数，用于计算分位数
+PROFILE_SAMPLE_SIZE = 10000
+# 计算任务吞吐量时要求的最少请求数和最短持续时间（秒）
+MIN_JOB_REQUESTS = 20
+MIN_JOB_SECONDS = 1.0
+# 没有历史记录时使用的单次请求耗时（秒）
+DEFAULT_LATENCY = 0.5
+
+# 估算依据
+SOURCE_REGION = "该地域历史"
+SOURCE_ACTION = "该操作所有地域历史"
+SOURCE_DEFAULT = "默认值（无历史记录）"
+
+def default_log_path():
+    return os.path.join(LOG_DIR, LOG_FILE)
+
+# 日志文件及其轮转文件，按时间从新到旧排列
+def iter_log_paths(log_path):
+    yield log_path
+    number = 1
+    while os.path.exists(f"{log_path}.{number}"):
+        yield f"{log_path}.{number}"
+        number += 1
+
+class _ProfileBuilder:
+    def __init__(self):
+        self.requests = 0
+        self.throttled = 0
+        self.errors = 0
+        self.samples = []
+        self.jobs = {}
+
+    def add(self, record):
+        latency = record.get('latency_ms', 0) / 1000
+        error_code = record.get('error_code') or ''
+        self.requests += 1
+        self.throttled += 1 if error_code.startswith('RequestLimitExceeded') else 0
+        self.errors += 1 if error_code else 0
+        # 蓄水池抽样，样本数有上限
+        if len(self.samples) < PROFILE_SAMPLE_SIZE:
+            self.samples.append(latency)
+        else:
+            index = random.randrange(self.requests)
+            if index < PROFILE_SAMPLE_SIZE:
+                self.samples[index] = latency
+        job_id = record.get('job_id')
+        if job_id is not None:
+            job = self.jobs.setdefault(job_id, [0, 0, record['time'], record['time']])
+            job[0] += 1
+            job[1] += 1 if error_code.startswith('RequestLimitExceeded') else 0
+            job[2] = min(job[2], record['time'])
+            job[3] = max(job[3], record['time'])
+
+    def build(self):
+        samples = sorted(self.samples)
+
+        def quantile(fraction):
+            return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+        # 各任务的吞吐量（每秒请求数）
+        peak_rps = 0.0
+        throttled_rps = 0.0
+        for count, throttled, first, last in self.jobs.values():
+            if count < MIN_JOB_REQUESTS or last - first < MIN_JOB_SECONDS:
+                continue
+            rps = count / (last - first)
+            peak_rps = max(peak_rps, rps)
+            if throttled:
+                throttled_rps = max(throttled_rps, rps)
+        return {
+            "requests": self.requests,
+            "p50": quantile(0.5),
+            "p90": quantile(0.9),
+            "throttle_rate": self.throttled / self.requests,
+            "error_rate": self.errors / self.requests,
+            "peak_rps": peak_rps,
+            # 触发过限频的任务达到的吞吐量，近似为接口配额
+            "quota_rps": throttled_rps or None,
+        }
+
+# 从结构化响应日志读取最近的历史记录，返回 {(操作, 地域): 统计}，地域为 None 的键为该操作所有地域的汇总
+def load_profiles(log_path=None, days=PROFILE_DAYS):
+    log_path = log_path or default_log_path()
+    since = time.time() - days * 86400
+    builders = {}
+    for path in iter_log_paths(log_path):
+        try:
+            if os.path.getmtime(path) < since:
+                break
+            f = open(path, 'rb')
+        except OSError:
+            continue
+        with f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get('time', 0) < since or record.get('action') not in OPERATIONS:
+                    continue
+                builders.setdefault((record['action'], record.get('region')), _ProfileBuilder()).add(record)
+                builders.setdefault((record['action'], None), _ProfileBuilder()).add(record)
+    return {key: builder.build() for key, builder in builders.items()}
+
+def _find_profile(profiles, action, region):
+    if (action, region) in profiles:
+        return profiles[(action, region)], SOURCE_REGION
+    if (action, None) in profiles:
+        return profiles[(action, None)], SOURCE_ACTION
+    return None, SOURCE_DEFAULT
+
+# 单个地域的耗时估算（秒）
+def _estimate_seconds(calls, latency, max_workers, quota_rps):
+    return max(calls * latency / max_workers, calls / quota_rps)
+
+# 生成请求计划并估算耗时：shards 为 {地域: 资源列表}，profiles 为 load_profiles 的结果（为 None 时读取日志）
+# 不发送任何请求；地域不支持时抛出 ValueError，与实际执行时一致
+def estimate_plan(action, shards, max_workers, batch_mode=False, profiles=None):
+    if profiles is None:
+        profiles = load_profiles()
+    batch_size = get_batch_size(action, batch_mode)
+    regions = []
+    for region, resources in shards.items():
+        if OPERATIONS[action]['service'] == 'cbs':
+            get_region_id(region)
+        calls = math.ceil(len(resources) / batch_size)
+        profile, source = _find_profile(profiles, action, region)
+        p50 = profile['p50'] if profile else DEFAULT_LATENCY
+        p90 = profile['p90'] if profile else DEFAULT_LATENCY
+        throttle_rate = min(profile['throttle_rate'], 0.9) if profile else 0.0
+        quota_rps = (profile['quota_rps'] if profile else None) or MAX_RATE
+        regions.append({
+            "region": region,
+            "resources": len(resources),
+            "batch_size": batch_size,
+            "calls": calls,
+            "expected_requests": math.ceil(calls / (1 - throttle_rate)),
+            "source": source,
+            "history_requests": profile['requests'] if profile else 0,
+            "latency_p50": p50,
+            "latency_p90": p90,
+            "throttle_rate": throttle_rate,
+            "error_rate": profile['error_rate'] if profile else 0.0,
+            "peak_rps": profile['peak_rps'] if profile else 0.0,
+            "quota_rps": quota_rps,
+            "seconds_low": _estimate_seconds(calls, p50, max_workers, quota_rps),
+            "seconds_high": _estimate_seconds(calls, p90, max_workers, quota_rps),
+            # 单次耗时 × 配额速率即可用满配额，再增加并发只会触发限频
+            "suggested_workers": max(1, min(MAX_WORKERS_LIMIT, math.ceil(p50 * quota_rps))),
+        })
+    return {
+        "action": action,
+        "max_workers": max_workers,
+        "batch_mode": batch_mode,
+        "resources": count_resources(shards),
+        "calls": sum(item['calls'] for item in regions),
+        "expected_requests": sum(item['expected_requests'] for item in regions),
+        # 各地域并行执行，总耗时取最慢的地域
+        "seconds_low": max((item['seconds_low'] for item in regions), default=0.0),
+        "seconds_high": max((item['seconds_high'] for item in regions), default=0.0),
+        "regions": regions,
+    }
+
+# 迁移流水线各步骤的请求计划，返回各步骤的估算结果列表
+# 流水线中开关机总是合并请求；耗时上限按各步骤依次执行估算，不含等待资源进入目标状态的时间
+def estimate_pipeline(shards, steps=DEFAULT_STEPS, max_workers=MAX_WORKERS_LIMIT, profiles=None):
+    if profiles is None:
+        profiles = load_profiles()
+    plans = []
+    for step in steps:
+        if step == "snapshot":
+            step_shards = {region: [(disk_id, None) for instance_id, payload in resources for disk_id in payload['data_disk_ids']]
+                           for region, resources in shards.items()}
+        else:
+            step_shards = shards
+        step_shards = {region: resources for region, resources in step_shards.items() if resources}
+        if step_shards:
+            plan = estimate_plan(STEP_SPECS[step]['action'], step_shards, max_workers, True, profiles)
+            plan['step'] = STEP_SPECS[step]['label']
+            plans.append(plan)
+    return plans
+
+# 把秒数格式化为便于阅读的时长
+def format_duration(seconds):
+    seconds = int(math.ceil(seconds))
+    if seconds < 60:
+        return f"{seconds} 秒"
+    if seconds < 3600:
+        return f"{seconds // 60} 分 {seconds % 60} 秒"
+    return f"{seconds // 3600} 小时 {seconds % 3600 // 60} 分"
@@ -0,0 +1,200 @@
+import math
+from datetime import datetime, timedelta, timezone
+from capi import send_request
+from database import get_unconfirmed_tasks, record_task_results, TASK_SUCCESS, TASK_PENDING
+from executor import run_tasks, chunked, DEFAULT_MAX_WORKERS
+from operations import get_response_body, get_batch_size, get_region_id, image_name, snapshot_name, AMBIGUOUS_PREFIXES
+
+# 执行前预检：批量查询资源当前状态，跳过已处于目标状态或已不存在的资源，并给出请求计划
+
+# 查询接口单次最多携带的ID数（也是每页的条数）
+DESCRIBE_LIMIT = 100
+
+# 查询接口的配置：
+# - service: cvm 接口在请求中携带 region，cbs 接口携带数字 regionId
+# - id_param: 请求中的ID列表参数
+# - set_key / id_key / state_key: 响应中的资源列表、资源ID和状态字段
+DESCRIBE_SPECS = {
+    "DescribeInstances": {"service": "cvm", "id_param": "InstanceIds", "set_key": "InstanceSet", "id_key": "InstanceId", "state_key": "InstanceState"},
+    "DescribeImages": {"service": "cvm", "id_param": "ImageIds", "set_key": "ImageSet", "id_key": "ImageId", "state_key": "ImageState"},
+    "DescribeDisks": {"service": "cbs", "id_param": "DiskIds", "set_key": "DiskSet", "id_key": "DiskId", "state_key": "DiskState"},
+    "DescribeSnapshots": {"service": "cbs", "id_param": "SnapshotIds", "set_key": "SnapshotSet", "id_key": "SnapshotId", "state_key": "SnapshotState"},
+}
+
+# 各操作预检使用的查询接口，以及视为"无需执行"的状态
+PREFLIGHT_CHECKS = {
+    "StopInstances": ("DescribeInstances", {"STOPPED", "STOPPING"}),
+    "StartInstances": ("DescribeInstances", {"RUNNING", "STARTING"}),
+    "CreateImage": ("DescribeInstances", set()),
+    "DeleteImages": ("DescribeImages", set()),
+    "CreateSnapshot": ("DescribeDisks", set()),
+    "DeleteSnapshots": ("DescribeSnapshots", set()),
+}
+
+# 构造查询请求；ids 为 None 时按 filters 分页列出全部资源
+def build_describe_request(describe_action, ids, offset, region, filters=None):
+    spec = DESCRIBE_SPECS[describe_action]
+    data = {
+        "serviceType": spec['service'],
+        "action": describe_action,
+        "data": {
+            "Version": "2017-03-12",
+            "Offset": offset,
+            "Limit": DESCRIBE_LIMIT
+        }
+    }
+    if ids is not None:
+        data["data"][spec['id_param']] = ids
+    if filters:
+        data["data"]["Filters"] = filters
+    if spec['service'] == 'cvm':
+        data["region"] = region
+    else:
+        data["regionId"] = get_region_id(region)
+    return data
+
+# 分页查询一批ID的状态，返回 {资源ID: 状态}；查询失败时返回 None
+def describe_batch(describe_action, ids, cookie, csrfcode, uin, region):
+    spec = DESCRIBE_SPECS[describe_action]
+    states = {}
+    calls = 0
+    offset = 0
+    while True:
+        data = build_describe_request(describe_action, ids, offset, region)
+        body = get_response_body(send_request(describe_action, data, cookie, csrfcode, uin, region, ids))
+        calls += 1
+        if not body or 'Error' in body:
+            return None, calls
+        items = body.get(spec['set_key']) or []
+        for item in items:
+            states[item[spec['id_key']]] = item.get(spec['state_key'], '')
+        offset += len(items)
+        if not items or offset >= body.get('TotalCount', 0):
+            return states, calls
+
+# 按ID批量查询资源状态，返回 ({资源ID: 状态}, 无法确认状态的ID集合, 查询请求次数)
+def describe_states(describe_action, ids, cookie, csrfcode, uin, region, max_workers=DEFAULT_MAX_WORKERS):
+    states = {}
+    unknown = set()
+    calls = 0
+
+    def describe(batch):
+        return describe_batch(describe_action, batch, cookie, csrfcode, uin, region)
+
+    for batch, (batch_states, batch_calls) in run_tasks(list(chunked(list(ids), DESCRIBE_LIMIT)), describe, max_workers):
+        calls += batch_calls
+        if batch_states is None:
+            unknown.update(batch)
+        else:
+            states.update(batch_states)
+    return states, unknown, calls
+
+# 预检：返回计划字典
+# - resources: 需要执行的资源
+# - skipped: 跳过的资源 [(资源ID, 原因)]
+# - unknown: 查询失败、无法确认状态而保留执行的资源数
+# - describe_calls: 预检查询请求次数
+# - planned_calls: 执行阶段预计的请求次数（不含重试和失败拆分）
+def plan_operation(action, resources, cookie, csrfcode, uin, region, max_workers=DEFAULT_MAX_WORKERS, batch_mode=False):
+    describe_action, done_states = PREFLIGHT_CHECKS[action]
+    ids = [resource_id for resource_id, payload in resources]
+    states, unknown, describe_calls = describe_states(describe_action, ids, cookie, csrfcode, uin, region, max_workers)
+
+    to_run = []
+    skipped = []
+    for resource_id, payload in resources:
+        if resource_id in unknown:
+            to_run.append((resource_id, payload))
+        elif resource_id not in states:
+            skipped.append((resource_id, "资源不存在"))
+        elif states[resource_id] in done_states:
+            skipped.append((resource_id, f"已处于 {states[resource_id]} 状态"))
+        else:
+            to_run.append((resource_id, payload))
+
+    return {
+        "action": action,
+        "region": region,
+        "resources": to_run,
+        "skipped": skipped,
+        "unknown": len(unknown),
+        "describe_calls": describe_calls,
+        "planned_calls": math.ceil(len(to_run) / get_batch_size(action, batch_mode)),
+    }
+
+# 接口返回的时间不带时区时（云硬盘接口）按北京时间处理
+API_TIMEZONE = timezone(timedelta(hours=8))
+
+# 解析接口返回的创建时间为时间戳，无法解析时返回 None
+# 镜像为 ISO 8601（带时区），快照为 "YYYY-MM-DD HH:MM:SS"
+def parse_created_time(value):
+    if not value:
+        return None
+    try:
+        created = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if created.tzinfo is None:
+        created = created.replace(tzinfo=API_TIMEZONE)
+    return created.timestamp()
+
+# 继续执行创建类任务前的核对：发送中（或因网络错误、内部错误失败）的资源可能已经创建，
+# 按工具的命名规则查询，找到发送之后创建的同名镜像/快照即视为成功，确认未创建的才重新发送
+RECONCILE_SPECS = {
+    "CreateImage": {"describe": "DescribeImages", "name_key": "ImageName", "time_key": "CreatedTime"},
+    "CreateSnapshot": {"describe": "DescribeSnapshots", "name_key": "SnapshotName", "time_key": "CreateTime"},
+}
+# 本机与接口时钟的允许偏差，以及发送到写入结果之间的最长间隔（秒）
+CLOCK_SKEW = 300
+
+# 核对使用的名称和过滤条件
+def _reconcile_filters(action, resource_id, payload):
+    if action == "CreateImage":
+        name = image_name(payload)
+        return name, [{"Name": "image-name", "Values": [name]}]
+    name = snapshot_name(resource_id)
+    return name, [{"Name": "snapshot-name", "Values": [name]}, {"Name": "disk-id", "Values": [resource_id]}]
+
+# 查询 sent_at 之后创建的同名资源，返回新资源ID；确认不存在时返回空字符串，查询失败时返回 None
+# 创建时间无法解析的同名资源视为已创建，宁可不重发也不产生重复资源
+def find_created(action, resource_id, payload, sent_at, cookie, csrfcode, uin, region):
+    spec = RECONCILE_SPECS[action]
+    describe_spec = DESCRIBE_SPECS[spec['describe']]
+    name, filters = _reconcile_filters(action, resource_id, payload)
+    data = build_describe_request(spec['describe'], None, 0, region, filters)
+    body = get_response_body(send_request(spec['describe'], data, cookie, csrfcode, uin, region, [resource_id]))
+    if not body or 'Error' in body:
+        return None
+    for item in body.get(describe_spec['set_key']) or []:
+        if item.get(spec['name_key']) != name:
+            continue
+        created_at = parse_created_time(item.get(spec['time_key']))
+        if created_at is None or created_at >= sent_at - CLOCK_SKEW:
+            return item[describe_spec['id_key']]
+    return ''
+
+# 核对任务中未确认的资源并更新任务日志：已创建的记为成功（写入新资源ID），确认未创建的恢复为待执行，
+# 查询失败的保持不变（不会被继续执行）。返回 {"confirmed", "pending", "unknown"} 各自的数量
+def reconcile_unconfirmed(job_id, action, cookie, csrfcode, uin, region, max_workers=DEFAULT_MAX_WORKERS):
+    counts = {"confirmed": 0, "pending": 0, "unknown": 0}
+    if action not in RECONCILE_SPECS:
+        return counts
+    tasks = get_unconfirmed_tasks(job_id, AMBIGUOUS_PREFIXES[action])
+
+    def check(task):
+        resource_id, payload, updated_at = task
+        sent_at = datetime.strptime(updated_at, '%Y-%m-%d %H:%M:%S').timestamp()
+        return find_created(action, resource_id, payload, sent_at, cookie, csrfcode, uin, region)
+
+    rows = []
+    for (resource_id, payload, updated_at), created_id in run_tasks(tasks, check, max_workers):
+        if created_id is None:
+            counts['unknown'] += 1
+        elif created_id:
+            counts['confirmed'] += 1
+            rows.append((resource_id, TASK_SUCCESS, '', '继续执行前核对：已创建', '', created_id))
+        else:
+            counts['pending'] += 1
+            rows.append((resource_id, TASK_PENDING, '', '', '', ''))
+    record_task_results(job_id, rows)
+    return counts
@@ -0,0 +1,132 @@
+import random
+import threading
+import time
+from executor import MAX_WORKERS_LIMIT
+from metrics import record_retry
+
+# 令牌桶初始速率和上下限（每秒请求数）
+INITIAL_RATE = 10.0
+MIN_RATE = 1.0
+MAX_RATE = 100.0
+# 触发限频后速率和并发上限的缩减比例
+DECREASE_FACTOR = 0.5
+# 两次缩减之间的最小间隔（秒），避免同一轮在途请求的限频错误重复缩减
+DECREASE_COOLDOWN = 1.0
+# 首次限频之后的增长：每个成功请求增加该值，速率每秒（并发上限每轮）约增长 10%
+INCREASE_FRACTION = 0.1
+
+# 限频重试次数和退避时间（秒）
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 10.0
+
+# 获取响应中的错误码，没有错误时返回空字符串
+def get_error_code(response_json):
+    try:
+        error = response_json['data']['Response'].get('Error')
+    except (KeyError, TypeError, AttributeError):
+        error = None
+    if error:
+        return error.get('Code', '')
+    code = response_json.get('code', '') if isinstance(response_json, dict) else ''
+    return code if isinstance(code, str) else ''
+
+# 判断响应是否为限频错误（RequestLimitExceeded 及其子错误码）
+def is_throttled(response_json):
+    return get_error_code(response_json).startswith('RequestLimitExceeded')
+
+# 继续执行任务时重发的失败错误码前缀（开关机、删除等重复执行结果不变的操作）
+# 网络错误和内部错误时请求可能已被后端处理，对这些操作重发也只会得到相同的结果
+RETRYABLE_ERROR_PREFIXES = ('RequestLimitExceeded', 'ClientError.NetworkError', 'InternalError')
+# 创建类操作只重发限频错误：限频时请求确定未被处理；网络错误（例如请求体发出后连接被重置）
+# 和内部错误时镜像/快照可能已经创建，重发会产生重复资源
+CREATE_RETRYABLE_ERROR_PREFIXES = ('RequestLimitExceeded',)
+
+# 单个 (action, region) 的自适应限流器：令牌桶限速 + AIMD 调整速率和并发上限
+# 慢启动：首次被限频之前，每个成功请求使速率和并发上限加 1，即每轮翻倍，后端不限频时很快达到上限；
+# 首次被限频后减半，之后按当前值的比例缓慢增长
+class AdaptiveLimiter:
+    def __init__(self, initial_rate=INITIAL_RATE, min_rate=MIN_RATE, max_rate=MAX_RATE,
+                 max_concurrency=MAX_WORKERS_LIMIT):
+        self.rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.concurrency_limit = float(max_concurrency)
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.tokens = 1.0
+        self.updated_at = time.monotonic()
+        self.decreased_at = 0.0
+        self.slow_start = True
+        self.condition = threading.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        capacity = max(1.0, self.rate)
+        self.tokens = min(capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    # 等待令牌和并发名额
+    def acquire(self):
+        with self.condition:
+            while True:
+                self._refill()
+                if self.tokens >= 1 and self.in_flight < int(self.concurrency_limit):
+                    self.tokens -= 1
+                    self.in_flight += 1
+                    return
+                timeout = (1 - self.tokens) / self.rate if self.tokens < 1 else None
+                self.condition.wait(timeout)
+
+    # 释放并发名额，并根据是否被限频调整速率和并发上限
+    def release(self, throttled):
+        with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                self.slow_start = False
+                if now - self.decreased_at >= DECREASE_COOLDOWN:
+                    self.rate = max(self.min_rate, self.rate * DECREASE_FACTOR)
+                    self.concurrency_limit = max(1.0, self.concurrency_limit * DECREASE_FACTOR)
+                    self.decreased_at = now
+            elif self.slow_start:
+                self.rate = min(self.max_rate, self.rate + 1)
+                self.concurrency_limit = min(self.max_concurrency, self.concurrency_limit + 1)
+            else:
+                # 每秒约有 rate 个成功请求，每个增加 INCREASE_FRACTION，每秒的增量与当前速率成正比
+                self.rate = min(self.max_rate, self.rate + INCREASE_FRACTION)
+                self.concurrency_limit = min(self.max_concurrency, self.concurrency_limit + INCREASE_FRACTION)
+            self.condition.notify_all()
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+# 获取 (action, region) 对应的限流器，跨请求和脚本重跑保留已学习到的速率
+def get_limiter(action, region=None):
+    key = (action, region)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = AdaptiveLimiter()
+            _limiters[key] = limiter
+        return limiter
+
+# 带抖动的指数退避时间
+def backoff_delay(attempt):
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+# 经限流器发送请求，被限频时退避后重试，超过重试次数返回最后一次响应
+def call_with_limit(action, region, send):
+    limiter = get_limiter(action, region)
+    for attempt in range(MAX_RETRIES + 1):
+        limiter.acquire()
+        throttled = False
+        try:
+            response_json = send()
+            throttled = is_throttled(response_json)
+        finally:
+            limiter.release(throttled)
+        if not throttled or attempt == MAX_RETRIES:
+            return response_json
+        record_retry(action)
+        time.sleep(backoff_delay(attempt))
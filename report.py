@@ -0,0 +1,46 @@
+import csv
+import io
+
+# 结果报告导出：按行流式写出 CSV 和 Excel，内存占用不随报告行数增长
+# 只在用户请求下载时生成，不占用批量操作本身的时间
+
+# CSV 每次写出的行数
+CSV_CHUNK_ROWS = 10000
+
+# 按块返回 CSV 文本，rows 为字典列表（或任意可迭代对象），columns 为输出的列，headers 为表头（默认与列名相同）
+def iter_csv_chunks(rows, columns, headers=None, chunk_rows=CSV_CHUNK_ROWS):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(headers or columns)
+    for count, row in enumerate(rows, 1):
+        writer.writerow([row.get(column, '') for column in columns])
+        if count % chunk_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+# 把报告写为 CSV，output 为二进制文件对象
+def write_csv_report(rows, columns, output, headers=None):
+    for chunk in iter_csv_chunks(rows, columns, headers):
+        output.write(chunk.encode('utf-8'))
+
+# 使用 openpyxl 的只写模式把报告写为 Excel，逐行写入，不在内存中保留整个工作表
+def write_excel_report(rows, columns, sheet_name, output, headers=None):
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    # Excel 工作表名称最长 31 个字符
+    sheet = workbook.create_sheet(title=sheet_name[:31])
+    sheet.append(headers or columns)
+    for row in rows:
+        sheet.append([row.get(column, '') for column in columns])
+    workbook.save(output)
+
+# 生成报告文件内容（bytes），file_format 为 "csv" 或 "xlsx"
+def build_report(rows, columns, file_format, sheet_name="结果", headers=None):
+    output = io.BytesIO()
+    if file_format == "xlsx":
+        write_excel_report(rows, columns, sheet_name, output, headers)
+    else:
+        write_csv_report(rows, columns, output, headers)
+    return output.getvalue()
@@ -0,0 +1,175 @@
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows 上没有 fcntl，只能保证单进程内的写入顺序
+    fcntl = None
+
+# 结构化响应日志：每次请求追加一行紧凑的JSON，按大小轮转，并维护偏移量索引文件
+#
+# 日志行字段：time、job_id、action、resource_ids、region、latency_ms、request_id、error_code、error_message、task_id
+# 索引文件（日志文件名加 .idx）每行为 {"offset", "time", "job_id"}：
+# 每个任务在当前日志文件中首次出现时、以及每隔 INDEX_INTERVAL 行记录一次，
+# 统计工具可据此直接定位到某个任务或时间段，无需从头扫描全部历史
+#
+# 多个进程（例如定时任务中的命令行和界面）可能同时写同一个日志：写入和轮转都在日志文件旁的
+# .lock 文件上加进程间的排他锁（fcntl.flock），索引中的偏移量在锁内从文件末尾取得；
+# 其他进程轮转后，本进程在下次写入时发现文件已被替换并重新打开
+
+LOG_DIR = 'logs'
+LOG_FILE = 'responses.jsonl'
+# 单个日志文件的最大字节数，超出后轮转
+MAX_LOG_BYTES = 50 * 1024 * 1024
+# 保留的历史日志文件数（responses.jsonl.1 ~ responses.jsonl.N）
+MAX_LOG_FILES = 10
+# 每隔多少行写一条索引
+INDEX_INTERVAL = 1000
+
+def index_path(log_path):
+    return log_path + '.idx'
+
+def lock_path(log_path):
+    return log_path + '.lock'
+
+class ResponseLog:
+    def __init__(self, path, max_bytes=MAX_LOG_BYTES, max_files=MAX_LOG_FILES, index_interval=INDEX_INTERVAL):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.index_interval = index_interval
+        self.lock = threading.Lock()
+        self.lock_file = None
+        self.file = None
+        self.index_file = None
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(self.path, 'ab')
+        self.index_file = open(index_path(self.path), 'ab')
+        # 重新打开已有文件时，第一行写入一条索引，不必读取旧索引
+        self.since_index = self.index_interval
+        self.indexed_jobs = set()
+
+    def _close_files(self):
+        if self.file is not None:
+            self.file.close()
+            self.index_file.close()
+            self.file = None
+            self.index_file = None
+
+    # 日志文件是否已被其他进程轮转（路径不存在或已指向新文件）
+    def _replaced(self):
+        try:
+            return os.stat(self.path).st_ino != os.fstat(self.file.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+
+    # 进程间排他锁，未加锁时返回 False（没有 fcntl 时）
+    def _lock_processes(self):
+        if fcntl is None:
+            return False
+        if self.lock_file is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.lock_file = open(lock_path(self.path), 'ab')
+        fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX)
+        return True
+
+    def _unlock_processes(self):
+        fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
+
+    # 轮转：responses.jsonl -> responses.jsonl.1 -> ... ，超出保留数量的文件被删除
+    def _rotate(self):
+        self._close_files()
+        for suffix in ('', '.idx'):
+            oldest = f"{self.path}.{self.max_files}{suffix}"
+            if os.path.exists(oldest):
+                os.remove(oldest)
+            for number in range(self.max_files - 1, 0, -1):
+                source = f"{self.path}.{number}{suffix}"
+                if os.path.exists(source):
+                    os.replace(source, f"{self.path}.{number + 1}{suffix}")
+            if os.path.exists(self.path + suffix):
+                os.replace(self.path + suffix, f"{self.path}.1{suffix}")
+        self._open()
+
+    def write(self, record):
+        with self.lock:
+            locked = self._lock_processes()
+            try:
+                self._write(record)
+            finally:
+                if locked:
+                    self._unlock_processes()
+
+    # 在线程锁和进程锁内调用
+    def _write(self, record):
+        if self.file is None:
+            self._open()
+        elif self._replaced():
+            self._close_files()
+            self._open()
+        # 偏移量取自文件末尾，包含其他进程写入的内容
+        self.file.seek(0, os.SEEK_END)
+        if self.file.tell() >= self.max_bytes:
+            self._rotate()
+        offset = self.file.tell()
+        # 在锁内取时间，保证日志中的时间随行号单调递增
+        record['time'] = round(time.time(), 3)
+        job_id = record.get('job_id')
+        if self.since_index >= self.index_interval or (job_id is not None and job_id not in self.indexed_jobs):
+            entry = {"offset": offset, "time": record['time'], "job_id": job_id}
+            self.index_file.write((json.dumps(entry) + '\n').encode('utf-8'))
+            self.index_file.flush()
+            self.indexed_jobs.add(job_id)
+            self.since_index = 0
+        line = (json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+        self.file.write(line)
+        self.file.flush()
+        self.since_index += 1
+
+    def close(self):
+        with self.lock:
+            self._close_files()
+            if self.lock_file is not None:
+                self.lock_file.close()
+                self.lock_file = None
+
+_log = ResponseLog(os.path.join(LOG_DIR, LOG_FILE))
+
+# 从响应中提取日志字段并写入日志，写入失败不影响请求本身
+# 日志只用于统计和排查，任何异常（包括格式异常的响应）都不抛给发送请求的调用方
+def log_response(action, region, resource_ids, job_id, latency, response_json):
+    try:
+        _log.write(build_record(action, region, resource_ids, job_id, latency, response_json))
+    except Exception:
+        pass
+
+# 构造一行日志；响应不是预期的字典结构时记为 ClientError.InvalidResponse
+def build_record(action, region, resource_ids, job_id, latency, response_json):
+    body = {}
+    if isinstance(response_json, dict) and isinstance(response_json.get('data'), dict):
+        body = response_json['data'].get('Response') or {}
+    if not isinstance(body, dict):
+        body = {}
+    error = body.get('Error') or {}
+    if not isinstance(error, dict):
+        error = {}
+    message = response_json.get('message', '') if isinstance(response_json, dict) else ''
+    return {
+        "job_id": job_id,
+        "action": action,
+        "resource_ids": list(resource_ids or []),
+        "region": region,
+        "latency_ms": round(latency * 1000, 1),
+        "request_id": body.get('RequestId', ''),
+        "error_code": error.get('Code', '') if body else 'ClientError.InvalidResponse',
+        "error_message": error.get('Message', '') if body else message,
+        "task_id": str(body.get('TaskId', '')),
+    }
@@ -0,0 +1,110 @@
+import json
+import os
+import threading
+import time
+import uuid
+import weakref
+import zlib
+
+# 结果存储：每个资源在内存中只保留一条固定字段的精简记录（元组），
+# 原始响应压缩后追加写入磁盘文件，按资源ID索引偏移量，需要时再单独读取
+# 界面表格和结果报告按页读取记录，内存占用只与资源数和精简字段有关，与响应大小无关
+
+RESULTS_DIR = 'results'
+# 超过该时间（秒）的响应文件在创建新存储时清理，避免会话异常结束后文件残留
+RESULT_FILE_TTL = 24 * 3600
+
+# 每条记录保存的字段
+RESULT_FIELDS = ("region", "job_id", "resource_id", "status", "error_code", "error_message", "request_id", "result_id", "time")
+
+# 本进程中仍在使用的响应文件（各会话的结果存储共用一个进程），清理时跳过
+# 结果存储关闭或被回收（例如会话过期后）时移除
+_open_paths = set()
+_open_paths_lock = threading.Lock()
+
+# 关闭并删除响应文件，由 close() 或结果存储被回收时调用（不能引用结果存储本身）
+def _release(path, file):
+    if not file.closed:
+        file.close()
+    with _open_paths_lock:
+        _open_paths.discard(os.path.abspath(path))
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+# 清理过期的响应文件，仍在使用的文件即使超过有效期也保留
+def cleanup_result_files(directory=RESULTS_DIR, ttl=RESULT_FILE_TTL):
+    if not os.path.isdir(directory):
+        return
+    now = time.time()
+    with _open_paths_lock:
+        open_paths = set(_open_paths)
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if os.path.abspath(path) in open_paths:
+            continue
+        try:
+            if now - os.path.getmtime(path) > ttl:
+                os.remove(path)
+        except OSError:
+            pass
+
+class ResultStore:
+    def __init__(self, directory=RESULTS_DIR):
+        os.makedirs(directory, exist_ok=True)
+        cleanup_result_files(directory)
+        self.path = os.path.join(directory, f"{uuid.uuid4().hex}.bin")
+        self.file = open(self.path, 'ab')
+        with _open_paths_lock:
+            _open_paths.add(os.path.abspath(self.path))
+        self._finalizer = weakref.finalize(self, _release, self.path, self.file)
+        self.offset = 0
+        self.records = []
+        # 资源ID -> 响应在文件中的 (偏移量, 长度)
+        self.responses = {}
+        self.failed = 0
+
+    def add(self, result, response_json):
+        self.records.append(tuple(result.get(field, '') for field in RESULT_FIELDS))
+        if result['status'] != "成功":
+            self.failed += 1
+        data = zlib.compress(json.dumps(response_json, ensure_ascii=False).encode('utf-8'))
+        self.file.write(data)
+        self.responses[result['resource_id']] = (self.offset, len(data))
+        self.offset += len(data)
+
+    def __len__(self):
+        return len(self.records)
+
+    # 逐条返回记录字典
+    def __iter__(self):
+        for record in self.records:
+            yield dict(zip(RESULT_FIELDS, record))
+
+    # 返回一页记录
+    def page(self, offset, limit):
+        return [dict(zip(RESULT_FIELDS, record)) for record in self.records[offset:offset + limit]]
+
+    # 失败资源的ID
+    def failed_ids(self):
+        status_index = RESULT_FIELDS.index("status")
+        id_index = RESULT_FIELDS.index("resource_id")
+        return [record[id_index] for record in self.records if record[status_index] != "成功"]
+
+    # 读取某个资源的原始响应，不存在时（包括响应文件已被其他进程清理）返回 None
+    def get_response(self, resource_id):
+        if resource_id not in self.responses or self.file.closed:
+            return None
+        offset, length = self.responses[resource_id]
+        self.file.flush()
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                return json.loads(zlib.decompress(f.read(length)).decode('utf-8'))
+        except FileNotFoundError:
+            return None
+
+    # 关闭并删除响应文件
+    def close(self):
+        self._finalizer()
@@ -0,0 +1,76 @@
+from database import get_inventory_by_ids, init_inventory_db
+from executor import DEFAULT_MAX_WORKERS
+from inventory import refresh_resources
+from operations import is_blank
+
+# 按容量从大到小调度：创建镜像和快照的耗时主要取决于云硬盘容量，先发起容量最大的资源，
+# 在并发受限时整批的完成时间接近最大单个资源的耗时，而不是被排在最后的大盘拖长（最长处理时间优先）
+#
+# 容量来源依次为：上传文件中的 DiskSize 列、本地资源清单、按ID查询云硬盘（DescribeDisks，结果写入资源清单）
+# 创建镜像按实例数据盘容量之和排序；查不到容量的云硬盘按 0 计，保持原有顺序排在最后
+
+# 上传文件中可选的云硬盘容量列（GB）
+SIZE_COLUMN = "DiskSize"
+
+# 按容量排序的操作，以及上传文件中对应的云硬盘ID列
+SIZED_ACTIONS = {"CreateImage": "ID_dataDisk", "CreateSnapshot": "ID"}
+
+# 从上传的行中读取云硬盘容量，返回 {云硬盘ID: 容量GB}；空值和无法解析的值忽略
+def sizes_from_rows(action, rows):
+    disk_column = SIZED_ACTIONS[action]
+    sizes = {}
+    for row in rows:
+        disk_id = row.get(disk_column)
+        value = row.get(SIZE_COLUMN)
+        if is_blank(disk_id) or is_blank(value):
+            continue
+        try:
+            sizes[disk_id] = float(value)
+        except (TypeError, ValueError):
+            continue
+    return sizes
+
+# 资源涉及的云硬盘ID
+def disk_ids_of(action, resources):
+    if action == "CreateImage":
+        return [disk_id for resource_id, payload in resources for disk_id in payload['data_disk_ids']]
+    return [resource_id for resource_id, payload in resources]
+
+# 补全各地域云硬盘的容量，返回 {云硬盘ID: 容量GB}
+# known 为上传文件中读取的容量；describe 为 False 时只使用资源清单，不发送查询请求
+# 查询失败时不影响执行，相应的云硬盘按容量未知处理
+def resolve_disk_sizes(action, shards, known=None, cookie=None, csrfcode=None, uin=None,
+                       max_workers=DEFAULT_MAX_WORKERS, describe=True):
+    sizes = dict(known or {})
+    init_inventory_db()
+    for region, resources in shards.items():
+        missing = [disk_id for disk_id in dict.fromkeys(disk_ids_of(action, resources)) if disk_id not in sizes]
+        if not missing:
+            continue
+        for disk_id, record in get_inventory_by_ids("disk", missing).items():
+            if record['size_gb']:
+                sizes[disk_id] = record['size_gb']
+        missing = [disk_id for disk_id in missing if disk_id not in sizes]
+        if not missing or not describe:
+            continue
+        try:
+            refresh_resources("disk", missing, cookie, csrfcode, uin, region, max_workers)
+        except RuntimeError:
+            continue
+        for disk_id, record in get_inventory_by_ids("disk", missing).items():
+            if record['size_gb']:
+                sizes[disk_id] = record['size_gb']
+    return sizes
+
+# 单个资源的容量：快照为云硬盘容量，创建镜像为实例数据盘容量之和
+def resource_size(action, resource_id, payload, sizes):
+    if action == "CreateImage":
+        return sum(sizes.get(disk_id, 0) for disk_id in payload['data_disk_ids'])
+    return sizes.get(resource_id, 0)
+
+# 各地域内按容量从大到小排列资源（容量相同时保持原有顺序），返回新的 {地域: 资源列表}
+def order_longest_first(action, shards, sizes):
+    return {
+        region: sorted(resources, key=lambda resource: -resource_size(action, resource[0], resource[1], sizes))
+        for region, resources in shards.items()
+    }
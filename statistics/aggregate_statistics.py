@@ -0,0 +1,170 @@
+import csv
+import json
+import sqlite3
+import argparse
+from datetime import datetime
+from process_responses import list_log_files, load_index, find_start_offset, format_percent
+
+# 跨多次运行的增量统计：把结构化响应日志中的新记录累加到持久化的计数中，
+# 只处理上次检查点之后新增的记录，再根据累计计数输出错误率和耗时趋势，无需重新解析旧日志
+
+STATS_DB = "statistics.db"
+
+def connect_stats_db(db_file=STATS_DB):
+    conn = sqlite3.connect(db_file)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute('''CREATE TABLE IF NOT EXISTS daily_stats
+                    (day TEXT, action TEXT, error_code TEXT,
+                     requests INTEGER, resources INTEGER, latency_sum REAL, latency_max REAL,
+                     PRIMARY KEY (day, action, error_code))''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS job_stats
+                    (job_id INTEGER PRIMARY KEY, action TEXT,
+                     requests INTEGER, errors INTEGER, resources INTEGER, latency_sum REAL,
+                     first_time REAL, last_time REAL)''')
+    # 检查点：最后处理的记录时间，以及该时间上已处理的记录数（同一毫秒可能有多条记录）
+    conn.execute('''CREATE TABLE IF NOT EXISTS checkpoint
+                    (log_path TEXT PRIMARY KEY, last_time REAL, seen_at_last_time INTEGER)''')
+    return conn
+
+def get_checkpoint(conn, log_path):
+    row = conn.execute("SELECT last_time, seen_at_last_time FROM checkpoint WHERE log_path = ?", (log_path,)).fetchone()
+    return row if row else (None, 0)
+
+def iter_new_records(log_path, last_time, seen_at_last_time):
+    """按索引定位到检查点，逐条返回检查点之后的日志记录"""
+    skipped = 0
+    for path in list_log_files(log_path):
+        offset = find_start_offset(load_index(path), since=last_time)
+        if offset is None:
+            continue
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            continue
+        with f:
+            f.seek(offset)
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if last_time is not None:
+                    if record['time'] < last_time:
+                        continue
+                    if record['time'] == last_time and skipped < seen_at_last_time:
+                        skipped += 1
+                        continue
+                yield record
+
+def fold_records(conn, log_path):
+    """把检查点之后的新记录累加到统计表中，返回新处理的记录数"""
+    last_time, seen_at_last_time = get_checkpoint(conn, log_path)
+    daily = {}
+    jobs = {}
+    count = 0
+    for record in iter_new_records(log_path, last_time, seen_at_last_time):
+        count += 1
+        if record['time'] == last_time:
+            seen_at_last_time += 1
+        else:
+            last_time = record['time']
+            seen_at_last_time = 1
+
+        latency = record.get('latency_ms', 0)
+        resources = len(record.get('resource_ids') or [])
+        day = datetime.fromtimestamp(record['time']).strftime("%Y-%m-%d")
+        key = (day, record.get('action', ''), record.get('error_code', ''))
+        stats = daily.setdefault(key, [0, 0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += resources
+        stats[2] += latency
+        stats[3] = max(stats[3], latency)
+
+        job_id = record.get('job_id')
+        if job_id is not None:
+            job = jobs.setdefault(job_id, [record.get('action', ''), 0, 0, 0, 0.0, record['time'], record['time']])
+            job[1] += 1
+            job[2] += 1 if record.get('error_code') else 0
+            job[3] += resources
+            job[4] += latency
+            job[6] = record['time']
+
+    if not count:
+        return 0
+
+    # 计数和检查点在同一事务中写入，中断时不会重复累加
+    with conn:
+        conn.executemany('''INSERT INTO daily_stats VALUES (?, ?, ?, ?, ?, ?, ?)
+                            ON CONFLICT(day, action, error_code) DO UPDATE SET
+                            requests = requests + excluded.requests,
+                            resources = resources + excluded.resources,
+                            latency_sum = latency_sum + excluded.latency_sum,
+                            latency_max = MAX(latency_max, excluded.latency_max)''',
+                         [key + tuple(stats) for key, stats in daily.items()])
+        conn.executemany('''INSERT INTO job_stats VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                            ON CONFLICT(job_id) DO UPDATE SET
+                            requests = requests + excluded.requests,
+                            errors = errors + excluded.errors,
+                            resources = resources + excluded.resources,
+                            latency_sum = latency_sum + excluded.latency_sum,
+                            last_time = excluded.last_time''',
+                         [(job_id,) + tuple(job) for job_id, job in jobs.items()])
+        conn.execute("INSERT OR REPLACE INTO checkpoint VALUES (?, ?, ?)", (log_path, last_time, seen_at_last_time))
+    return count
+
+def write_trends(conn, trends_file):
+    """按天、按操作输出请求数、错误率和耗时趋势"""
+    rows = conn.execute('''SELECT day, action, SUM(requests), SUM(resources),
+                                  SUM(CASE WHEN error_code != '' THEN requests ELSE 0 END),
+                                  SUM(latency_sum), MAX(latency_max)
+                           FROM daily_stats GROUP BY day, action ORDER BY day, action''').fetchall()
+    with open(trends_file, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["日期", "操作", "请求数", "资源数", "失败请求数", "错误率", "平均耗时(ms)", "最大耗时(ms)"])
+        for day, action, requests, resources, errors, latency_sum, latency_max in rows:
+            average = latency_sum / requests if requests else 0
+            writer.writerow([day, action, requests, resources, errors, format_percent(errors, requests), f"{average:.1f}", f"{latency_max:.1f}"])
+    return len(rows)
+
+def write_error_codes(conn, errors_file):
+    """按操作、错误码输出累计失败次数"""
+    rows = conn.execute('''SELECT action, error_code, SUM(requests) FROM daily_stats
+                           WHERE error_code != '' GROUP BY action, error_code
+                           ORDER BY SUM(requests) DESC''').fetchall()
+    with open(errors_file, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["操作", "错误码", "次数"])
+        writer.writerows(rows)
+
+def write_job_trends(conn, jobs_file):
+    """按任务输出请求数、错误率、平均耗时和持续时间"""
+    rows = conn.execute("SELECT * FROM job_stats ORDER BY job_id").fetchall()
+    with open(jobs_file, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["任务ID", "操作", "请求数", "失败请求数", "错误率", "资源数", "平均耗时(ms)", "开始时间", "持续时间(秒)"])
+        for job_id, action, requests, errors, resources, latency_sum, first_time, last_time in rows:
+            average = latency_sum / requests if requests else 0
+            start = datetime.fromtimestamp(first_time).strftime("%Y-%m-%d %H:%M:%S")
+            writer.writerow([job_id, action, requests, errors, format_percent(errors, requests), resources,
+                             f"{average:.1f}", start, f"{last_time - first_time:.1f}"])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="增量汇总结构化响应日志，输出错误率和耗时趋势")
+    parser.add_argument("log_file", help="结构化响应日志，例如 ../logs/responses.jsonl（自动包含已轮转的历史文件）")
+    parser.add_argument("--db", default=STATS_DB, help=f"累计统计数据库（默认 {STATS_DB}）")
+    parser.add_argument("--trends", default="trends.csv", help="按天、按操作的趋势输出文件")
+    parser.add_argument("--errors", default="error_codes.csv", help="错误码统计输出文件")
+    parser.add_argument("--jobs", default="job_trends.csv", help="按任务的统计输出文件")
+    args = parser.parse_args()
+
+    conn = connect_stats_db(args.db)
+    try:
+        added = fold_records(conn, args.log_file)
+        days = write_trends(conn, args.trends)
+        write_error_codes(conn, args.errors)
+        write_job_trends(conn, args.jobs)
+    finally:
+        conn.close()
+
+    print(f"新增汇总 {added} 条记录，累计 {days} 个（日期, 操作）组合")
+    print(f"趋势已保存到 {args.trends}，错误码统计已保存到 {args.errors}，任务统计已保存到 {args.jobs}")
@@ -1,25 +1,63 @@
 import re
 import json
 import csv
-import sys
 import ast
+import os
+import argparse
+import multiprocessing
 from collections import Counter
+from datetime import datetime
+
+# 多进程解析时每次分发给子进程的记录数
+CHUNK_SIZE = 256
+# 记录数少于该值时不启动进程池，直接在当前进程解析
+MIN_PARALLEL_RECORDS = 2000
+
+INSTANCE_ID_PATTERN = re.compile(r'Instance (ins-[a-zA-Z0-9]+)')
+RESPONSE_PATTERN = re.compile(r'response: (.*$)')
+
+def iter_records(input_file):
+    """逐行读取输入文件，按空行切分并逐个返回以 Instance 开头的响应，内存占用与文件大小无关"""
+    with open(input_file, 'r', encoding='utf-8') as f:
+        lines = []
+        for line in f:
+            if line.strip():
+                lines.append(line)
+                continue
+            if lines:
+                record = ''.join(lines).strip()
+                lines = []
+                if record.startswith("Instance"):
+                    yield record
+        if lines:
+            record = ''.join(lines).strip()
+            if record.startswith("Instance"):
+                yield record
+
+def parse_response_data(json_str):
+    """优先按JSON解析，失败时再按Python字典字符串解析"""
+    if json_str.startswith('{"'):
+        try:
+            return json.loads(json_str)
+        except ValueError:
+            pass
+    # 使用ast.literal_eval更安全地解析Python字典字符串
+    return ast.literal_eval(json_str)
 
 def extract_instance_info(response_str):
     # 提取实例ID
-    instance_id_match = re.search(r'Instance (ins-[a-zA-Z0-9]+)', response_str)
+    instance_id_match = INSTANCE_ID_PATTERN.search(response_str)
     instance_id = instance_id_match.group(1) if instance_id_match else "未知"
     
     # 尝试解析JSON部分
     try:
         # 找到JSON部分
-        json_part_match = re.search(r'response: (.*$)', response_str.strip())
+        json_part_match = RESPONSE_PATTERN.search(response_str.strip())
         if not json_part_match:
             raise Exception("无法识别响应格式")
             
         json_str = json_part_match.group(1).strip()
-        # 使用ast.literal_eval更安全地解析Python字典字符串
-        response_data = ast.literal_eval(json_str)
+        response_data = parse_response_data(json_str)
         
         # 确定状态信息
         status = "成功"
@@ -52,25 +90,26 @@ def extract_instance_info(response_str):
             "task_id": "无"
         }
 
-def generate_statistics(results):
+def format_percent(count, total):
+    """计算百分比，总数为 0 时返回 0.0%"""
+    return f"{count/total*100:.1f}%" if total else "0.0%"
+
+def generate_statistics(status_count, error_count):
     """生成统计信息"""
-    total = len(results)
-    status_count = Counter([r["status"] for r in results])
+    total = sum(status_count.values())
+    failed = status_count.get('失败', 0)
     
     print("\n===== 统计信息 =====")
     print(f"总实例数: {total}")
-    print(f"成功: {status_count.get('成功', 0)} ({status_count.get('成功', 0)/total*100:.1f}%)")
-    print(f"失败: {status_count.get('失败', 0)} ({status_count.get('失败', 0)/total*100:.1f}%)")
-    print(f"解析错误: {status_count.get('解析错误', 0)} ({status_count.get('解析错误', 0)/total*100:.1f}%)")
+    print(f"成功: {status_count.get('成功', 0)} ({format_percent(status_count.get('成功', 0), total)})")
+    print(f"失败: {failed} ({format_percent(failed, total)})")
+    print(f"解析错误: {status_count.get('解析错误', 0)} ({format_percent(status_count.get('解析错误', 0), total)})")
     
     # 错误信息统计
-    if status_count.get('失败', 0) > 0:
-        error_messages = [r["message"] for r in results if r["status"] == "失败"]
-        error_count = Counter(error_messages)
-        
+    if failed > 0:
         print("\n错误信息统计:")
         for error, count in error_count.most_common():
-            print(f"- {error}: {count}次 ({count/status_count.get('失败', 0)*100:.1f}%)")
+            print(f"- {error}: {count}次 ({format_percent(count, failed)})")
     
     # 写入统计信息到CSV
     stats_file = "statistics.csv"
@@ -78,55 +117,165 @@ def generate_statistics(results):
         writer = csv.writer(f)
         writer.writerow(["指标", "数值", "百分比"])
         writer.writerow(["总实例数", total, "100%"])
-        writer.writerow(["成功", status_count.get('成功', 0), f"{status_count.get('成功', 0)/total*100:.1f}%"])
-        writer.writerow(["失败", status_count.get('失败', 0), f"{status_count.get('失败', 0)/total*100:.1f}%"])
-        writer.writerow(["解析错误", status_count.get('解析错误', 0), f"{status_count.get('解析错误', 0)/total*100:.1f}%"])
+        writer.writerow(["成功", status_count.get('成功', 0), format_percent(status_count.get('成功', 0), total)])
+        writer.writerow(["失败", failed, format_percent(failed, total)])
+        writer.writerow(["解析错误", status_count.get('解析错误', 0), format_percent(status_count.get('解析错误', 0), total)])
         
-        if status_count.get('失败', 0) > 0:
+        if failed > 0:
             writer.writerow([])
             writer.writerow(["错误信息", "次数", "占失败比例"])
             for error, count in error_count.most_common():
-                writer.writerow([error, count, f"{count/status_count.get('失败', 0)*100:.1f}%"])
+                writer.writerow([error, count, format_percent(count, failed)])
     
     print(f"\n统计信息已保存到 {stats_file}")
 
-def process_responses(input_file, output_file):
-    # 读取输入文件
-    with open(input_file, 'r', encoding='utf-8') as f:
-        content = f.read()
-    
-    # 分割多个响应 - 使用空行分割
-    responses = content.split("\n\n")
-    responses = [r.strip() for r in responses if r.strip()]  # 移除空字符串
-    
-    # 处理每个响应
-    results = []
-    for response in responses:
-        if not response.startswith("Instance"):
+def list_log_files(log_path):
+    """结构化响应日志及其轮转文件，按时间从旧到新排列（responses.jsonl.N ... responses.jsonl.1, responses.jsonl）"""
+    rotated = []
+    number = 1
+    while os.path.exists(f"{log_path}.{number}"):
+        rotated.append(f"{log_path}.{number}")
+        number += 1
+    return list(reversed(rotated)) + [log_path]
+
+def load_index(log_path):
+    """读取日志的偏移量索引（日志文件名加 .idx），没有索引时返回空列表"""
+    try:
+        with open(log_path + '.idx', 'r', encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except (OSError, ValueError):
+        return []
+
+def find_start_offset(index, job_id=None, since=None, until=None):
+    """根据索引确定开始读取的偏移量；返回 None 表示该文件中没有需要的记录"""
+    if not index:
+        return 0
+    if until is not None and index[0]['time'] > until:
+        return None
+    if job_id is not None:
+        offsets = [entry['offset'] for entry in index if entry.get('job_id') == job_id]
+        return min(offsets) if offsets else None
+    offset = 0
+    if since is not None:
+        for entry in index:
+            if entry['time'] > since:
+                break
+            offset = entry['offset']
+    return offset
+
+def log_record_results(record):
+    """将一行结构化日志转换为每个资源一条的结果"""
+    if record.get('error_code'):
+        status = "失败"
+        message = record.get('error_message') or record['error_code']
+    else:
+        status = "成功"
+        message = "操作成功完成"
+    task_id = record.get('task_id') or "无"
+    return [
+        {"instance_id": resource_id, "status": status, "message": message, "task_id": task_id}
+        for resource_id in record.get('resource_ids') or []
+    ]
+
+def iter_log_results(log_path, job_id=None, since=None, until=None, action=None):
+    """按索引定位后读取结构化响应日志，只返回指定任务、时间段和操作的结果"""
+    for path in list_log_files(log_path):
+        if not os.path.exists(path):
             continue
-        result = extract_instance_info(response)
-        results.append(result)
-    
-    # 写入CSV文件
+        offset = find_start_offset(load_index(path), job_id, since, until)
+        if offset is None:
+            continue
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    yield {"instance_id": "未知", "status": "解析错误", "message": "无法解析日志行", "task_id": "无"}
+                    continue
+                if until is not None and record['time'] > until:
+                    return
+                if since is not None and record['time'] < since:
+                    continue
+                if job_id is not None and record.get('job_id') != job_id:
+                    continue
+                if action is not None and record.get('action') != action:
+                    continue
+                yield from log_record_results(record)
+
+def iter_results(input_file, workers):
+    """解析所有响应，按输入顺序返回结果；workers 大于 1 时使用进程池并行解析"""
+    records = iter_records(input_file)
+    if workers <= 1:
+        for record in records:
+            yield extract_instance_info(record)
+        return
+
+    # 先读取少量记录，数量不多时不必承担启动进程池的开销
+    head = []
+    for record in records:
+        head.append(record)
+        if len(head) >= MIN_PARALLEL_RECORDS:
+            break
+    if len(head) < MIN_PARALLEL_RECORDS:
+        for record in head:
+            yield extract_instance_info(record)
+        return
+
+    def all_records():
+        yield from head
+        yield from records
+
+    with multiprocessing.Pool(workers) as pool:
+        yield from pool.imap(extract_instance_info, all_records(), CHUNK_SIZE)
+
+def is_log_file(input_file):
+    """是否为应用写出的结构化响应日志（responses.jsonl 及其轮转文件）"""
+    return input_file.endswith('.jsonl') or '.jsonl.' in os.path.basename(input_file)
+
+def process_responses(input_file, output_file, workers=None, job_id=None, since=None, until=None, action=None):
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if is_log_file(input_file):
+        # 结构化日志按JSON逐行解析，速度足够快，不需要进程池
+        results = iter_log_results(input_file, job_id, since, until, action)
+    else:
+        results = iter_results(input_file, workers)
+
+    # 边解析边写入CSV，只累计统计所需的计数
+    status_count = Counter()
+    error_count = Counter()
     with open(output_file, 'w', encoding='utf-8', newline='') as f:
         writer = csv.DictWriter(f, fieldnames=["instance_id", "status", "message", "task_id"])
         writer.writeheader()
-        writer.writerows(results)
+        for result in results:
+            writer.writerow(result)
+            status_count[result["status"]] += 1
+            if result["status"] == "失败":
+                error_count[result["message"]] += 1
     
-    print(f"处理完成！共处理了 {len(results)} 个实例响应，结果已保存到 {output_file}")
+    print(f"处理完成！共处理了 {sum(status_count.values())} 个实例响应，结果已保存到 {output_file}")
     
     # 生成统计信息
-    generate_statistics(results)
+    generate_statistics(status_count, error_count)
     
-    return results
+    return status_count, error_count
+
+def parse_time(value):
+    return datetime.strptime(value, "%Y-%m-%d %H:%M:%S").timestamp()
 
 if __name__ == "__main__":
-    if len(sys.argv) < 3:
-        print("使用方式：python process_responses.py 输入文件路径 输出文件路径")
-        print("例如：python process_responses.py responses.txt results.csv")
-        sys.exit(1)
-    
-    input_file = sys.argv[1]
-    output_file = sys.argv[2]
+    parser = argparse.ArgumentParser(
+        description="处理实例操作响应，导出结果和统计信息",
+        epilog="例如：python process_responses.py responses.txt results.csv 4"
+    )
+    parser.add_argument("input_file", help="输入文件：文本响应，或应用写出的结构化日志 logs/responses.jsonl")
+    parser.add_argument("output_file", help="输出CSV文件")
+    parser.add_argument("workers", nargs="?", type=int, help="并行解析的进程数，默认使用全部CPU核数")
+    parser.add_argument("--job-id", type=int, help="只统计指定任务（仅结构化日志）")
+    parser.add_argument("--since", type=parse_time, help="开始时间，格式 YYYY-MM-DD HH:MM:SS（仅结构化日志）")
+    parser.add_argument("--until", type=parse_time, help="结束时间，格式 YYYY-MM-DD HH:MM:SS（仅结构化日志）")
+    parser.add_argument("--action", help="只统计指定操作，例如 StopInstances（仅结构化日志）")
+    args = parser.parse_args()
     
-    process_responses(input_file, output_file) 
\ No newline at end of file
+    process_responses(args.input_file, args.output_file, args.workers, args.job_id, args.since, args.until, args.action)
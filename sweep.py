@@ -0,0 +1,126 @@
+import re
+import time
+from database import query_inventory, get_inventory_data
+from executor import DEFAULT_MAX_WORKERS
+from inventory import sync_inventory
+from preflight import parse_created_time
+
+# 遗留资源清理：按工具的命名规则从资源清单中找出工具创建的镜像和快照，
+# 筛选超过指定天数、且未被实例或镜像引用的资源，批量合并删除，不依赖用户保存的 image_ids.csv / snapshot_info.csv
+#
+# 命名规则（与 operations 中的请求构造一致）：
+# - 镜像：名称为 "<实例名称>-image"，描述为 "CDC迁移"
+# - 快照：名称为 "<云硬盘ID>_last_snapshot"
+# 资源列表通过资源清单分页并发同步（缓存有效期内不重复查询）
+
+IMAGE_NAME_SUFFIX = "-image"
+IMAGE_DESCRIPTION = "CDC迁移"
+SNAPSHOT_NAME_PATTERN = re.compile(r"disk-[0-9a-z]+_last_snapshot")
+
+# 默认只清理创建超过该天数的资源
+DEFAULT_MIN_AGE_DAYS = 7
+
+# 清理的资源类型及对应的删除操作
+SWEEP_ACTIONS = {"image": "DeleteImages", "snapshot": "DeleteSnapshots"}
+
+# 可以删除的状态
+DELETABLE_STATE = "NORMAL"
+
+# 清理报告的字段，keep_reason 为空表示未被引用、可以删除
+SWEEP_FIELDS = ["type", "region", "resource_id", "name", "state", "size_gb", "created_time", "age_days", "keep_reason"]
+
+# 判断资源是否为工具创建（record 为资源清单记录，镜像的描述保存在 usage 字段）
+def is_tool_artifact(resource_type, record):
+    if resource_type == "image":
+        return record['name'].endswith(IMAGE_NAME_SUFFIX) and record['usage'] == IMAGE_DESCRIPTION
+    return SNAPSHOT_NAME_PATTERN.fullmatch(record['name'] or '') is not None
+
+# 同步清理需要的资源清单（实例用于判断镜像是否被使用），返回 {资源类型: 是否执行了同步}
+# 查询失败时抛出 RuntimeError
+def sync_sweep_inventory(cookie, csrfcode, uin, region, force=False, max_workers=DEFAULT_MAX_WORKERS):
+    synced = {}
+    for resource_type in ("instance", "image", "snapshot"):
+        synced[resource_type] = sync_inventory(resource_type, cookie, csrfcode, uin, region, force, max_workers)[0]
+    return synced
+
+# 资源被引用或不能删除的原因，返回空字符串表示可以删除
+def _keep_reason(resource_type, record, data, image_users):
+    if record['state'] != DELETABLE_STATE:
+        return f"状态为 {record['state']}"
+    if resource_type == "image":
+        users = image_users.get(record['resource_id'])
+        if users:
+            return f"被 {len(users)} 台实例使用: {', '.join(users[:3])}"
+        return ''
+    images = [image.get('ImageId', '') for image in data.get('Images') or []]
+    if images or data.get('ImageCount'):
+        return f"关联镜像: {', '.join(images[:3]) or data.get('ImageCount')}"
+    return ''
+
+# 从资源清单中找出某个地域工具创建、且创建超过 min_age_days 天的镜像和快照，返回报告行列表
+# 创建时间无法解析的资源保留，不参与删除
+def find_orphans(region, min_age_days=DEFAULT_MIN_AGE_DAYS, resource_types=tuple(SWEEP_ACTIONS), now=None):
+    now = now or time.time()
+    image_users = {}
+    if "image" in resource_types:
+        for instance_id, item in get_inventory_data("instance", region).items():
+            if item.get('ImageId'):
+                image_users.setdefault(item['ImageId'], []).append(instance_id)
+
+    rows = []
+    for resource_type in resource_types:
+        records = [record for record in query_inventory(resource_type, region) if is_tool_artifact(resource_type, record)]
+        if not records:
+            continue
+        data = get_inventory_data(resource_type, region)
+        for record in records:
+            created_at = parse_created_time(record['created_time'])
+            age_days = (now - created_at) / 86400 if created_at is not None else None
+            if age_days is not None and age_days < min_age_days:
+                continue
+            if age_days is None:
+                keep_reason = "创建时间未知"
+            else:
+                keep_reason = _keep_reason(resource_type, record, data.get(record['resource_id'], {}), image_users)
+            rows.append({
+                "type": resource_type,
+                "region": region,
+                "resource_id": record['resource_id'],
+                "name": record['name'],
+                "state": record['state'],
+                "size_gb": record['size_gb'],
+                "created_time": record['created_time'],
+                "age_days": round(age_days, 1) if age_days is not None else '',
+                "keep_reason": keep_reason,
+            })
+    return rows
+
+# 删除镜像时随镜像一并删除（DeleteBindedSnap）的快照ID，取自资源清单中镜像的 SnapshotSet
+# images 为 {地域: [删除成功的镜像ID]}；必须在删除后刷新镜像清单之前调用（刷新后镜像记录会被移除）
+def bound_snapshot_ids(images):
+    snapshot_ids = set()
+    for region, image_ids in images.items():
+        data = get_inventory_data("image", region)
+        for image_id in image_ids:
+            snapshot_ids.update(snapshot.get('SnapshotId') for snapshot in data.get(image_id, {}).get('SnapshotSet') or [])
+    return snapshot_ids
+
+# 从待删除的快照中去掉已随镜像删除的快照，避免再次删除时报 InvalidSnapshotId.NotFound
+# 返回 (新的 {地域: 资源列表}, 去掉的快照ID列表)
+def drop_bound_snapshots(snapshot_shards, bound_ids):
+    dropped = []
+    shards = {}
+    for region, resources in snapshot_shards.items():
+        dropped.extend(resource_id for resource_id, payload in resources if resource_id in bound_ids)
+        remaining = [(resource_id, payload) for resource_id, payload in resources if resource_id not in bound_ids]
+        if remaining:
+            shards[region] = remaining
+    return shards, dropped
+
+# 报告中可以删除的资源，按地域拆分：{地域: [(资源ID, None)]}
+def orphan_shards(rows, resource_type):
+    shards = {}
+    for row in rows:
+        if row['type'] == resource_type and not row['keep_reason']:
+            shards.setdefault(row['region'], []).append((row['resource_id'], None))
+    return shards
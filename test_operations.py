@@ -0,0 +1,46 @@
+import unittest
+from operations import CBS_REGION_IDS, DEFAULT_CBS_REGION_ID, get_region_id, build_create_snapshot, build_delete_snapshots
+
+# cbs 接口的地域ID映射：改动会改变快照请求发往的地域，必须有意为之并同步更新这里
+EXPECTED_CBS_REGION_IDS = {
+    "ap-guangzhou": 1,
+    "ap-shanghai": 4,
+    "ap-hongkong": 5,
+    "na-toronto": 6,
+    "ap-beijing": 8,
+    "ap-singapore": 9,
+    "na-siliconvalley": 15,
+    "ap-chengdu": 16,
+    "eu-frankfurt": 17,
+    "ap-seoul": 18,
+    "ap-chongqing": 19,
+    "ap-mumbai": 21,
+    "na-ashburn": 22,
+    "ap-bangkok": 23,
+    "ap-tokyo": 25,
+    "ap-nanjing": 33,
+    "ap-jakarta": 72,
+    "sa-saopaulo": 74,
+}
+
+class CbsRegionIdTest(unittest.TestCase):
+    def test_mapping(self):
+        self.assertEqual(CBS_REGION_IDS, EXPECTED_CBS_REGION_IDS)
+
+    def test_default_region_id(self):
+        # 未指定地域时与早期固定写死的值一致
+        self.assertEqual(DEFAULT_CBS_REGION_ID, 4)
+        self.assertEqual(get_region_id(''), 4)
+        self.assertEqual(get_region_id(None), 4)
+
+    def test_unsupported_region(self):
+        with self.assertRaises(ValueError):
+            get_region_id("xx-unknown")
+
+    def test_requests_use_mapped_region_id(self):
+        for region, region_id in EXPECTED_CBS_REGION_IDS.items():
+            self.assertEqual(build_create_snapshot([("disk-1", None)], region)['regionId'], region_id)
+            self.assertEqual(build_delete_snapshots([("snap-1", None)], region)['regionId'], region_id)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+import time
+from database import record_completions
+from executor import DEFAULT_MAX_WORKERS
+from preflight import describe_states
+
+# 完成状态跟踪：创建镜像/快照的接口返回后，新资源仍处于创建中（CREATING）
+# 按固定的少量分页请求批量查询所有未完成的资源（每次请求最多100个ID），而不是每个资源单独轮询；
+# 状态没有变化时逐步拉长轮询间隔，有变化时缩短，状态变化实时写入任务日志并返回给调用方
+# 超过等待时间仍未完成、或连续多次查询失败的资源不再跟踪，以 TIMEOUT / QUERY_FAILED 状态返回；
+# 这两种状态在任务日志中不记为最终状态，之后可以用 track 命令继续跟踪
+
+# 各创建操作对应的查询接口，成功和失败的最终状态，以及每个资源等待完成的最长时间（秒，从开始跟踪时计算）
+TRACKED_OPERATIONS = {
+    "CreateImage": {"describe": "DescribeImages", "success": {"NORMAL", "USING"}, "failed": {"CREATEFAILED"}, "timeout": 7200},
+    "CreateSnapshot": {"describe": "DescribeSnapshots", "success": {"NORMAL"}, "failed": set(), "timeout": 7200},
+}
+
+# 轮询间隔（秒）
+POLL_MIN_INTERVAL = 5
+POLL_MAX_INTERVAL = 60
+POLL_BACKOFF = 1.5
+# 创建后立即查询可能还查不到新资源，连续多次查不到才视为失败
+MISSING_LIMIT = 3
+# 同一资源连续查询失败（请求失败或返回错误）的次数上限，超过后放弃跟踪
+QUERY_FAILURE_LIMIT = 5
+
+# 放弃跟踪时返回的状态
+STATE_TIMEOUT = "TIMEOUT"
+STATE_QUERY_FAILED = "QUERY_FAILED"
+GIVE_UP_STATES = (STATE_TIMEOUT, STATE_QUERY_FAILED)
+
+# 状态是否为最终状态
+def is_final_state(action, state):
+    spec = TRACKED_OPERATIONS[action]
+    return state in spec['success'] or state in spec['failed']
+
+# 跟踪新资源直到全部进入最终状态，每轮查询返回一次进度字典：
+# - changes: 本轮状态发生变化的资源 [(新资源ID, 源资源ID, 状态, 是否最终状态)]
+# - pending: 仍未完成的资源数
+# - calls: 累计查询请求次数
+# - interval: 下一轮查询前等待的秒数
+# targets 为 {新资源ID: 源资源ID}；stop_event 被设置时提前结束，未完成的资源可以之后继续跟踪
+# timeout 为每个资源等待完成的最长时间（秒），默认使用 TRACKED_OPERATIONS 中的配置
+def track_completion(action, targets, cookie, csrfcode, uin, region, job_id=None, max_workers=DEFAULT_MAX_WORKERS, stop_event=None,
+                     timeout=None):
+    describe_action = TRACKED_OPERATIONS[action]['describe']
+    deadline = time.monotonic() + (timeout or TRACKED_OPERATIONS[action]['timeout'])
+    pending = dict(targets)
+    states = {}
+    missing = {}
+    failures = {}
+    calls = 0
+    interval = POLL_MIN_INTERVAL
+
+    while pending:
+        found, unknown, batch_calls = describe_states(describe_action, list(pending), cookie, csrfcode, uin, region, max_workers)
+        calls += batch_calls
+        expired = time.monotonic() >= deadline
+
+        changes = []
+        for resource_id in list(pending):
+            if resource_id in unknown:
+                failures[resource_id] = failures.get(resource_id, 0) + 1
+                if failures[resource_id] >= QUERY_FAILURE_LIMIT:
+                    changes.append((resource_id, pending[resource_id], STATE_QUERY_FAILED, True))
+                    del pending[resource_id]
+                elif expired:
+                    changes.append((resource_id, pending[resource_id], STATE_TIMEOUT, True))
+                    del pending[resource_id]
+                continue
+            failures.pop(resource_id, None)
+            if resource_id in found:
+                missing.pop(resource_id, None)
+                state = found[resource_id]
+            else:
+                missing[resource_id] = missing.get(resource_id, 0) + 1
+                if missing[resource_id] < MISSING_LIMIT and not expired:
+                    continue
+                state = "NOT_FOUND" if missing[resource_id] >= MISSING_LIMIT else STATE_TIMEOUT
+            final = state == "NOT_FOUND" or is_final_state(action, state)
+            if not final and expired:
+                state, final = STATE_TIMEOUT, True
+            if states.get(resource_id) != state or final:
+                changes.append((resource_id, pending[resource_id], state, final))
+                states[resource_id] = state
+            if final:
+                del pending[resource_id]
+
+        if job_id is not None:
+            # 放弃跟踪的资源不记为最终状态，之后仍可继续跟踪
+            record_completions(job_id, [(resource_id, source_id, state, final and state not in GIVE_UP_STATES)
+                                        for resource_id, source_id, state, final in changes])
+
+        # 有状态变化时缩短间隔，否则逐步拉长
+        if changes:
+            interval = max(POLL_MIN_INTERVAL, interval / POLL_BACKOFF)
+        else:
+            interval = min(POLL_MAX_INTERVAL, interval * POLL_BACKOFF)
+
+        yield {"changes": changes, "pending": len(pending), "calls": calls, "interval": interval if pending else 0}
+
+        if not pending:
+            return
+        # 不超过截止时间等待，到期后立即再查询一次
+        interval = min(interval, max(0, deadline - time.monotonic()))
+        if stop_event is not None:
+            if stop_event.wait(interval):
+                return
+        else:
+            time.sleep(interval)
+
+# 最终状态是否为成功
+def is_success_state(action, state):
+    return state in TRACKED_OPERATIONS[action]['success']